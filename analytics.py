@@ -0,0 +1,171 @@
+"""
+Risk and performance analytics for many PnL curves at once.
+
+Every function takes a (curve x time) matrix of net values (a single curve
+is one row) and reduces along the time axis, so the tranches of one
+backtest or the thousands of configurations of a parameter sweep are
+analysed in one vectorized call.
+"""
+from typing import Dict, Optional
+
+import numpy as np
+
+TRADING_DAYS_PER_YEAR = 365
+ANNUAL_RISK_FREE_RATE = 0.03
+
+
+def _AsCurves(pnl) -> np.ndarray:
+    pnl = np.asarray(pnl, dtype=np.float64)
+    return pnl[None, :] if pnl.ndim == 1 else pnl
+
+
+def _DailyRiskFreeRate(annual_risk_free_rate: float, periods_per_year: int) -> float:
+    return (1 + annual_risk_free_rate) ** (1 / periods_per_year) - 1
+
+
+def Drawdowns(pnl) -> np.ndarray:
+    """Drawdown from the running peak of the compounded returns, <= 0, shape (curve x time - 1)."""
+    pnl = _AsCurves(pnl)
+    cumulative_returns = np.cumprod(1 + (pnl[:, 1:] / pnl[:, :-1] - 1), axis=1)
+    peak = np.maximum.accumulate(cumulative_returns, axis=1)
+    return (cumulative_returns - peak) / peak
+
+
+def LongestRun(flags: np.ndarray) -> np.ndarray:
+    """Length of the longest run of True along the last axis."""
+    steps = np.arange(flags.shape[-1])
+    # 每个位置之前最近一次 False 的下标，连续 True 的长度就是两者之差
+    last_reset = np.maximum.accumulate(np.where(flags, -1, steps), axis=-1)
+    return np.where(flags, steps - last_reset, 0).max(axis=-1, initial=0)
+
+
+def AnalysePnLCurves(
+    pnl,
+    annual_risk_free_rate: float = ANNUAL_RISK_FREE_RATE,
+    periods_per_year: int = TRADING_DAYS_PER_YEAR,
+    turnover: Optional[np.ndarray] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Metrics of every curve, one array entry per row of pnl.
+
+    The AnalysePnLTrace keys keep their definitions (population std, Sharpe
+    on returns in excess of the daily risk-free rate, drawdown in percent),
+    plus sortino_ratio (downside deviation of the excess returns),
+    annual_return_pct(%) (geometric), calmar_ratio, max_drawdown_duration
+    (longest stretch of bars under the previous peak), hit_rate (share of
+    non-flat bars with a positive return) and, when a (curve x time)
+    turnover matrix is given, its mean.
+    """
+    pnl = _AsCurves(pnl)
+    num_periods = pnl.shape[1] - 1
+    daily_returns = pnl[:, 1:] / pnl[:, :-1] - 1
+    excess_returns = daily_returns - _DailyRiskFreeRate(annual_risk_free_rate, periods_per_year)
+    drawdown = Drawdowns(pnl)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        excess_mean = np.mean(excess_returns, axis=1)
+        sharpe_ratio = excess_mean / np.std(excess_returns, axis=1) * np.sqrt(periods_per_year)
+        downside = np.sqrt(np.mean(np.minimum(excess_returns, 0.0) ** 2, axis=1))
+        sortino_ratio = excess_mean / downside * np.sqrt(periods_per_year)
+
+        max_drawdown = np.min(drawdown, axis=1)
+        annual_return = (pnl[:, -1] / pnl[:, 0]) ** (periods_per_year / num_periods) - 1
+        calmar_ratio = annual_return / np.abs(max_drawdown)
+        hit_rate = (daily_returns > 0).sum(axis=1) / (daily_returns != 0).sum(axis=1)
+
+    metrics = {
+        "sharpe_ratio": sharpe_ratio,
+        "final_return_pct(%)": (pnl[:, -1] / pnl[:, 0] - 1) * 100,
+        "max_drawdown(%)": max_drawdown * 100.0,
+        "volatility": np.std(daily_returns, axis=1) * np.sqrt(periods_per_year),
+        "average_daily_return": np.mean(daily_returns, axis=1),
+        "sortino_ratio": sortino_ratio,
+        "annual_return_pct(%)": annual_return * 100,
+        "calmar_ratio": calmar_ratio,
+        "max_drawdown_duration": LongestRun(drawdown < 0),
+        "hit_rate": hit_rate,
+    }
+    if turnover is not None:
+        metrics["turnover"] = np.mean(_AsCurves(turnover), axis=1)
+    return metrics
+
+
+def RollingMetrics(
+    pnl,
+    window: int,
+    annual_risk_free_rate: float = ANNUAL_RISK_FREE_RATE,
+    periods_per_year: int = TRADING_DAYS_PER_YEAR,
+) -> Dict[str, np.ndarray]:
+    """
+    Trailing-window return, volatility and Sharpe of every curve, shape
+    (curve x time - window); column j covers returns j .. j + window - 1.
+    """
+    pnl = _AsCurves(pnl)
+    daily_returns = pnl[:, 1:] / pnl[:, :-1] - 1
+    excess_returns = daily_returns - _DailyRiskFreeRate(annual_risk_free_rate, periods_per_year)
+
+    def window_sum(values):
+        csum = np.concatenate([np.zeros((len(values), 1)), np.cumsum(values, axis=1)], axis=1)
+        return csum[:, window:] - csum[:, :-window]
+
+    mean = window_sum(daily_returns) / window
+    excess_mean = window_sum(excess_returns) / window
+    variance = np.maximum(window_sum(daily_returns ** 2) / window - mean ** 2, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sharpe = excess_mean / np.sqrt(variance) * np.sqrt(periods_per_year)
+    return {
+        "rolling_return_pct(%)": (pnl[:, window:] / pnl[:, :-window] - 1) * 100,
+        "rolling_volatility": np.sqrt(variance * periods_per_year),
+        "rolling_sharpe_ratio": sharpe,
+    }
+
+
+def BootstrapCI(
+    pnl,
+    n_boot: int = 1000,
+    block_size: int = 1,
+    confidence: float = 0.95,
+    annual_risk_free_rate: float = ANNUAL_RISK_FREE_RATE,
+    periods_per_year: int = TRADING_DAYS_PER_YEAR,
+    seed: int = 0,
+    batch_size: int = 256,
+) -> Dict[str, np.ndarray]:
+    """
+    Bootstrap confidence intervals of the Sharpe ratio and the average
+    daily return of every curve.
+
+    Returns are resampled in circular blocks of block_size bars (1 = iid);
+    all curves share the same resampled bar indices, so differences between
+    curves are not blurred by sampling noise. Curves are processed
+    batch_size at a time to bound memory. Returns {metric_low, metric_high}.
+    """
+    pnl = _AsCurves(pnl)
+    daily_returns = pnl[:, 1:] / pnl[:, :-1] - 1
+    excess_returns = daily_returns - _DailyRiskFreeRate(annual_risk_free_rate, periods_per_year)
+    num_curves, num_periods = daily_returns.shape
+
+    rng = np.random.default_rng(seed)
+    num_blocks = -(-num_periods // block_size)
+    starts = rng.integers(0, num_periods, size=(n_boot, num_blocks))
+    sample_idx = ((starts[:, :, None] + np.arange(block_size)) % num_periods).reshape(n_boot, -1)[:, :num_periods]
+    # 每个bootstrap样本里每根k线被抽到的次数，均值和方差就变成矩阵乘法，不用展开 (curve x n_boot x time)
+    counts = np.zeros((n_boot, num_periods))
+    np.add.at(counts, (np.arange(n_boot)[:, None], sample_idx), 1.0)
+    counts /= num_periods
+
+    tail = (1 - confidence) / 2 * 100
+    names = ["sharpe_ratio", "average_daily_return"]
+    result = {f"{name}_{side}": np.empty(num_curves) for name in names for side in ["low", "high"]}
+    # 每批只保留 (batch_size x n_boot) 的中间结果
+    for start in range(0, num_curves, batch_size):
+        batch = slice(start, start + batch_size)
+        mean_return = (counts @ daily_returns[batch].T).T
+        excess_mean = (counts @ excess_returns[batch].T).T
+        excess_variance = np.maximum((counts @ (excess_returns[batch] ** 2).T).T - excess_mean ** 2, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sharpe = excess_mean / np.sqrt(excess_variance) * np.sqrt(periods_per_year)
+        for name, values in zip(names, [sharpe, mean_return]):
+            result[f"{name}_low"][batch], result[f"{name}_high"][batch] = np.nanpercentile(
+                values, [tail, 100 - tail], axis=1
+            )
+    return result
@@ -0,0 +1,432 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import polars as pl
+
+from analytics import AnalysePnLCurves
+from cost_model import CostModel
+from portfolio import BuildTargetWeights
+from universe import TradableMask
+
+logger = logging.getLogger("Backtest")
+
+commission = 10 / 10000.0
+START_CASH = 100000
+VOL_FILTER_RATIO = 30
+
+LONG_TRADE_RANK_RATIO = 1.0
+SHORT_TRADE_RANK_RATIO = 0.5
+
+DYNAMIC_POS_SCALE = 0
+# 未来n天的平均收益率阈值，用来判断是否需要让多空仓位不平衡
+POS_RET_THRESHOLD = 3.0
+
+
+def AnalysePnLTrace(pnl, annual_risk_free_rate=0.03, trading_days_per_year=365):
+    """
+    Analyze the PnL trace to compute various financial metrics.
+
+    Parameters:
+        pnl (list or numpy.array): A series of net asset values or account balances over time.
+        annual_risk_free_rate (float): The annual risk-free rate, default is 3% (0.03).
+        trading_days_per_year (int): The number of trading days per year, default is 365.
+
+    Returns:
+        dict: A dictionary with keys as metric names and values as metric values
+        (see analytics.AnalysePnLCurves, which does the same for many curves at once).
+    """
+    metrics = AnalysePnLCurves(pnl, annual_risk_free_rate, trading_days_per_year)
+    return {name: values[0] for name, values in metrics.items()}
+
+
+def GetTradeableSymbolList(current_factors, input_ret, current_open_time_when_open_pos) -> list:
+    # 找出所有因子值不是NaN的symbol
+    has_missing = current_factors.select((pl.all().is_null() | pl.all().is_nan()).any()).row(0)
+    return [col for col, missing in zip(current_factors.columns, has_missing) if not missing]
+
+
+def BuildBacktestPanels(result_hour: pl.DataFrame, value_columns: List[str]) -> Dict[str, np.ndarray]:
+    """
+    Convert the long result frame into aligned (time x symbol) float arrays.
+
+    Rows are the sorted unique close_time values; symbols keep the order of
+    first appearance (the same column order pivot() produces). Missing
+    (time, symbol) cells are NaN. "open" is indexed by open_time instead, with
+    its own "open_time" axis, since rebalancing uses the next bar's open.
+    """
+    symbols = result_hour["symbol"].unique(maintain_order=True)
+    close_times = result_hour["close_time"].unique().sort()
+    open_times = result_hour["open_time"].unique().sort()
+
+    col_idx = result_hour["symbol"].replace_strict(symbols, pl.int_range(len(symbols), eager=True)).to_numpy()
+    close_idx = np.searchsorted(close_times.to_numpy(), result_hour["close_time"].to_numpy())
+    open_idx = np.searchsorted(open_times.to_numpy(), result_hour["open_time"].to_numpy())
+
+    panels = {
+        "symbols": np.array(symbols.to_list()),
+        "close_time": close_times.to_numpy(),
+        "open_time": open_times.to_numpy(),
+    }
+    for column in value_columns:
+        time_axis, row_idx = ("open_time", open_idx) if column == "open" else ("close_time", close_idx)
+        panel = np.full((len(panels[time_axis]), len(symbols)), np.nan)
+        panel[row_idx, col_idx] = result_hour[column].cast(pl.Float64).fill_null(np.nan).to_numpy()
+        panels[column] = panel
+    return panels
+
+
+def _RowSum(values: np.ndarray):
+    # 沿symbol方向从左到右逐列累加（缺失值当0），累加顺序固定，结果可复现
+    if values.shape[-1] == 0:
+        return np.zeros(values.shape[:-1]) if values.ndim > 1 else 0.0
+    total = np.cumsum(np.where(np.isnan(values), 0.0, values), axis=-1)[..., -1]
+    return total if values.ndim > 1 else float(total)
+
+
+def GetTargetWeights(
+    factors: np.ndarray,
+    volumes: np.ndarray,
+    group_num: int,
+    long_factor_combination_list: List[int],
+    trade_with_rank: int,
+    tradable_mask: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Target-weight panel of the backtest's selection rule; rows that do not trade are all zero.
+
+    Without tradable_mask the universe is the VOL_FILTER_RATIO volume filter
+    over the symbols whose factor is not NaN.
+    """
+    if tradable_mask is None:
+        tradable_mask = TradableMask(volumes, valid=~np.isnan(factors), vol_filter_ratio=VOL_FILTER_RATIO)
+    return BuildTargetWeights(
+        factors,
+        tradable_mask,
+        method="rank" if trade_with_rank != 0 else "group",
+        group_num=group_num,
+        long_factor_combination_list=long_factor_combination_list,
+        trade_with_rank=trade_with_rank,
+        long_rank_ratio=LONG_TRADE_RANK_RATIO,
+        short_rank_ratio=SHORT_TRADE_RANK_RATIO,
+    )
+
+
+def SimulateTranches(
+    panels: Dict[str, np.ndarray],
+    factor_name: str,
+    group_num: int,
+    long_factor_combination_list: List[int],
+    update_position_time: int,
+    trade_with_rank: int,
+    tranche_list: List[int],
+    tradable_mask: Optional[np.ndarray] = None,
+    cost_model: Optional[CostModel] = None,
+) -> np.ndarray:
+    """
+    Simulate staggered sub-portfolios over the same panels in one time loop.
+
+    Tranche k starts at row k and rebalances every update_position_time rows
+    from there, so at each row at most one tranche trades while all of them
+    are marked to market together. Before its first row a tranche is flat at
+    START_CASH. tradable_mask (rows x symbols of the panels, e.g. from
+    universe.TradableMask) replaces the default VOL_FILTER_RATIO universe.
+    With a cost_model, trades pay its fees / spread / impact (the panels
+    need "quote_volume") and held positions pay funding, instead of the
+    flat `commission`.
+    Returns the PnL curves, shape (len(tranche_list), rows - 1).
+    """
+    factors, open_prices = panels[factor_name], panels["open"]
+    bar_close_vol = panels["volume"]
+    long_scale = panels[f"long_value_scale_{update_position_time}day"]
+    num_symbols = len(panels["symbols"])
+    tranches = np.asarray(tranche_list)
+
+    # 在每一根k线走完的时候计算因子值，然后调仓
+    # 所以要遍历每一个close_time，进行调仓
+    time_array = panels["close_time"][:-1]  # the last line doesn't have next day return
+
+    # 用下一根k线的开盘价作为调仓价格，open_time是1ms后
+    next_bar_open_time = time_array + np.timedelta64(1, "ms")
+    next_open_row = np.searchsorted(panels["open_time"], next_bar_open_time)
+    has_next_open = (next_open_row < len(panels["open_time"])) & (
+        panels["open_time"][np.minimum(next_open_row, len(panels["open_time"]) - 1)] == next_bar_open_time
+    )
+    missing_open = np.full(num_symbols, np.nan)
+
+    if cost_model is not None:
+        proportional_rates = cost_model.proportional_rates(panels["symbols"])
+        quote_volume = panels["quote_volume"]
+        funding = cost_model.funding_panel(panels["close_time"], panels["symbols"])
+
+    # 所有tranche要调仓的行，一次算好目标权重
+    rebalance_rows = np.flatnonzero(
+        np.any(
+            (np.arange(len(time_array))[:, None] >= tranches)
+            & ((np.arange(len(time_array))[:, None] - tranches) % update_position_time == 0),
+            axis=1,
+        )
+    )
+    target_weights = np.zeros((len(time_array), num_symbols))
+    if len(rebalance_rows) > 0:
+        if tradable_mask is None:
+            tradable_mask = TradableMask(bar_close_vol, valid=~np.isnan(factors), vol_filter_ratio=VOL_FILTER_RATIO)
+        target_weights[rebalance_rows] = GetTargetWeights(
+            factors[rebalance_rows],
+            bar_close_vol[rebalance_rows],
+            group_num,
+            long_factor_combination_list,
+            trade_with_rank,
+            tradable_mask=tradable_mask[rebalance_rows],
+        )
+
+    # 每个tranche一行: 现金、仓位
+    today_pnl = 1
+    pnl = np.full((len(tranches), len(time_array)), float(START_CASH))
+    cash = np.full(len(tranches), float(START_CASH))
+    cur_position = np.zeros((len(tranches), num_symbols))
+
+    fut_avg_long_pos_ret, fut_avg_short_pos_ret = 0, 0
+
+    for i, cur_close_time in enumerate(time_array):
+        all_open_price_when_open_pos = open_prices[next_open_row[i]] if has_next_open[i] else missing_open
+        started = tranches <= i
+        skipped = np.zeros(len(tranches), dtype=bool)
+
+        if cost_model is not None and funding is not None:
+            # 上一根k线调仓后持有到现在的仓位，按这段时间结算的资金费率付费
+            position_value = cur_position[started] * all_open_price_when_open_pos
+            cash[started] -= _RowSum(cost_model.funding_costs(position_value, funding[i]))
+
+        # 各tranche调仓相位不同，同一根k线最多只有一个tranche调仓
+        for k in np.flatnonzero(started & ((i - tranches) % update_position_time == 0)):
+            weights = target_weights[i]
+            if not weights.any():
+                # 可以交易的symbol数目不足，无法分组
+                pnl[k, i] = today_pnl
+                skipped[k] = True
+                continue
+
+            # 改为每次开仓都使用固定值
+            each_side_symbol_total_val = 100000.0  # 单边的总价值
+            long_value_ratio = 1.0
+            short_value_ratio = 1.0
+
+            if DYNAMIC_POS_SCALE:
+                if (
+                    fut_avg_long_pos_ret > POS_RET_THRESHOLD
+                    and fut_avg_short_pos_ret > POS_RET_THRESHOLD
+                ):
+                    long_value_ratio, short_value_ratio = 1.2, 0.8
+                elif (
+                    fut_avg_long_pos_ret < -POS_RET_THRESHOLD
+                    and fut_avg_short_pos_ret < -POS_RET_THRESHOLD
+                ):
+                    long_value_ratio, short_value_ratio = 0.8, 1.2
+
+            cur_long_scale = long_scale[i, np.argmax(weights > 0)]
+
+            if cur_long_scale != long_value_ratio:
+                logger.warning(f'{cur_close_time}=====cur_long_scale: {cur_long_scale} not match == long_value_ratio: {long_value_ratio}')
+
+            assert long_value_ratio + short_value_ratio == 2.0, "sum ratio should be 2.0"
+
+            logger.info(f'tranche {tranches[k]} cur close time: {cur_close_time} == long_value_ratio: {long_value_ratio} == short_value_ratio: {short_value_ratio} --- {cur_long_scale}')
+
+            total_long_pos_value = each_side_symbol_total_val * long_value_ratio
+            total_short_pos_value = -each_side_symbol_total_val * short_value_ratio
+
+            # 调仓后每个symbol的市场价值
+            next_step_value = np.where(weights > 0, total_long_pos_value * weights, -total_short_pos_value * weights)
+
+            # 用调仓后的市场价值, 除以每个symbol的开仓价,得到每个symbol的调仓后的仓位
+            # 对于此时没上市的symbol, 开仓价是NaN, 仓位填0
+            next_step_position = next_step_value / all_open_price_when_open_pos
+            next_step_position[np.isnan(next_step_position)] = 0.0
+
+            # 需要调仓的仓位变动, 对于每个symbol，相当于是卖出 diff_position个，所以累加到cash里
+            diff_position = cur_position[k] - next_step_position
+            cash[k] += _RowSum(diff_position * all_open_price_when_open_pos)
+
+            abs_diff_trading_value = _RowSum(np.abs(diff_position) * all_open_price_when_open_pos)
+            if cost_model is None:
+                # 调仓交易额的手续费
+                cash[k] -= abs_diff_trading_value * commission
+            else:
+                trade_value = diff_position * all_open_price_when_open_pos
+                cash[k] -= _RowSum(cost_model.trade_costs(trade_value, proportional_rates, quote_volume[i]))
+
+            cur_position[k] = next_step_position  # 完成调仓
+            logger.debug(
+                f"update position: tranche {tranches[k]} {cur_close_time} === diff_trading_value: {abs_diff_trading_value} == cash: {cash[k]} "
+            )
+
+        # 所有已开始的tranche一起按开盘价盯市
+        marked = started & ~skipped
+        pnl[marked, i] = cash[marked] + _RowSum(all_open_price_when_open_pos * cur_position[marked])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"pnl: {cur_close_time} {pnl[:, i]}")
+    return pnl
+
+
+def _PanelColumns(factor_name: str, update_position_time: int, cost_model: Optional[CostModel]) -> List[str]:
+    columns = [factor_name, "open", "volume", f"long_value_scale_{update_position_time}day"]
+    if cost_model is not None:
+        columns.append("quote_volume")
+    return columns
+
+
+def GetSinglePnL(
+    all_time_hist_data,
+    result_hour,
+    compound_column_name,
+    group_num=20,
+    long_factor_combination_list=[1, 2, 3],
+    update_position_time=1,
+    leverage=1,
+    trade_with_rank=0,
+    cost_model=None,
+):
+    logger.info(f"start get SinglePnl: {result_hour.shape}")
+    FACTOR_NAME = compound_column_name + f"_{update_position_time}day"
+
+    # 只做一次 long -> (time x symbol) 的转换，之后按行号遍历
+    panels = BuildBacktestPanels(result_hour, _PanelColumns(FACTOR_NAME, update_position_time, cost_model))
+    pnl = SimulateTranches(
+        panels,
+        FACTOR_NAME,
+        group_num,
+        long_factor_combination_list,
+        update_position_time,
+        trade_with_rank,
+        tranche_list=[0],
+        cost_model=cost_model,
+    )[0].tolist()
+    return pnl, AnalysePnLTrace(pnl), " "
+
+
+def RunTranchePnL(
+    panels: Dict[str, np.ndarray],
+    factor_name: str,
+    group_num: int,
+    long_factor_combination_list: List[int],
+    update_position_time: int,
+    trade_with_rank: int,
+    tradable_mask: Optional[np.ndarray] = None,
+    cost_model: Optional[CostModel] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """GetTranchePnL on already built panels (shared by the parameter sweep)."""
+    tranche_pnl = SimulateTranches(
+        panels,
+        factor_name,
+        group_num,
+        long_factor_combination_list,
+        update_position_time,
+        trade_with_rank,
+        tranche_list=list(range(update_position_time)),
+        tradable_mask=tradable_mask,
+        cost_model=cost_model,
+    )
+
+    if logger.isEnabledFor(logging.INFO):
+        # 所有tranche的指标一次算完
+        tranche_metrics = AnalysePnLCurves(tranche_pnl)
+        for i in range(len(tranche_pnl)):
+            logger.info(f'Rolling i {i} ===== { {name: values[i] for name, values in tranche_metrics.items()} }')
+
+    sum_pnl = np.zeros(tranche_pnl.shape[1])
+    for cur_pnl in tranche_pnl:
+        sum_pnl += cur_pnl
+    sum_pnl /= update_position_time  # 多个组合进行平均，是平均收益
+    return tranche_pnl, sum_pnl
+
+
+def GetTranchePnL(
+    result_hour: pl.DataFrame,
+    compound_column_name: str,
+    group_num: int = 20,
+    long_factor_combination_list: List[int] = [1, 2, 3],
+    update_position_time: int = 1,
+    trade_with_rank: int = 0,
+    cost_model: Optional[CostModel] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    All update_position_time staggered tranches in one simulation pass.
+
+    Returns (tranche_pnl, combined_pnl): tranche_pnl[k] is the curve of the
+    portfolio that first trades on row k (flat at START_CASH before that),
+    combined_pnl is their average, i.e. what GetRollingPnL reports.
+    """
+    FACTOR_NAME = compound_column_name + f"_{update_position_time}day"
+    panels = BuildBacktestPanels(result_hour, _PanelColumns(FACTOR_NAME, update_position_time, cost_model))
+    return RunTranchePnL(
+        panels,
+        FACTOR_NAME,
+        group_num,
+        long_factor_combination_list,
+        update_position_time,
+        trade_with_rank,
+        cost_model=cost_model,
+    )
+
+
+def GetRollingPnL(
+    all_time_hist_data,
+    result_hour,
+    compound_column_name,
+    group_num=20,
+    long_factor_combination_list=[1, 2, 3],
+    update_position_time=1,
+    leverage=1,
+    trade_with_rank=0,
+    cost_model=None,
+):
+    _, sum_pnl = GetTranchePnL(
+        result_hour,
+        compound_column_name,
+        group_num=group_num,
+        long_factor_combination_list=long_factor_combination_list,
+        update_position_time=update_position_time,
+        trade_with_rank=trade_with_rank,
+        cost_model=cost_model,
+    )
+    return sum_pnl, AnalysePnLTrace(sum_pnl), ' '
+
+
+def GetTargetPositions(
+    result_hour: pl.DataFrame,
+    compound_column_name: str,
+    each_side_value: float,
+    group_num: int = 20,
+    long_factor_combination_list: List[int] = [1, 2, 3],
+    update_position_time: int = 1,
+    trade_with_rank: int = 0,
+) -> Tuple[Dict[str, float], Dict[str, float], Dict[str, float]]:
+    """
+    Target positions (in contracts) for the latest bar, using the same
+    symbol selection as the backtest. Sizes are computed with the latest
+    close price since the next open is not known yet. each_side_value is the
+    total USDT value per side and has no default: it sets the live exposure.
+
+    Returns (long_positions, short_positions, prices); short sizes are negative.
+    """
+    FACTOR_NAME = compound_column_name + f"_{update_position_time}day"
+    latest_close_time = result_hour["close_time"].max()
+    latest = result_hour.filter(pl.col("close_time") == latest_close_time)
+
+    panels = BuildBacktestPanels(latest, [FACTOR_NAME, "volume", "close"])
+    weights = GetTargetWeights(
+        panels[FACTOR_NAME], panels["volume"], group_num, long_factor_combination_list, trade_with_rank
+    )[0]
+    if not weights.any():
+        logger.warning(f"{latest_close_time} 可交易的symbol数目不足，不产生信号")
+        return {}, {}, {}
+
+    prices = dict(zip(latest["symbol"].to_list(), latest["close"].to_list()))
+    long_positions, short_positions = {}, {}
+    for symbol, weight in sorted(zip(panels["symbols"], weights)):
+        if weight > 0:
+            long_positions[symbol] = each_side_value * weight / prices[symbol]
+        elif weight < 0:
+            short_positions[symbol] = each_side_value * weight / prices[symbol]
+    return long_positions, short_positions, prices
@@ -0,0 +1,95 @@
+"""
+Trading cost model for the backtest: per-symbol taker fees, half-spread,
+square-root market impact and funding on held perpetual positions.
+
+Costs are computed as array operations over the traded-value and position
+rows of the (time x symbol) backtest panels, so they add almost nothing to
+the simulation loop. Without a cost model the backtest keeps charging the
+flat `commission` on traded notional.
+"""
+from typing import Dict, Optional
+
+import numpy as np
+import polars as pl
+
+# binance U本位合约 VIP0 taker 手续费 0.05%
+DEFAULT_TAKER_FEE = 5 / 10000.0
+# 半个买卖价差，主流币种大约 1bp，小币种更大，可以按symbol单独设置
+DEFAULT_HALF_SPREAD = 1 / 10000.0
+# 冲击成本 = IMPACT_COEF * sqrt(成交额 / 该k线成交额)，系数约等于 Y * 日波动率（Y ~ 1）
+DEFAULT_IMPACT_COEF = 0.05
+
+
+class CostModel:
+    """
+    Per-trade and per-bar costs of the long-short perpetual book.
+
+    A trade of |value| in a symbol pays taker_fee + half_spread (both can be
+    overridden per symbol) plus impact_coef * sqrt(|value| / quote_volume) of
+    the bar that just closed, all proportional to |value|. Held positions pay
+    position value * funding rate for every funding event (longs pay when the
+    rate is positive); funding_rates is the frame data_loader fetches, with
+    timestamp, symbol and funding_rate columns.
+    """
+
+    def __init__(
+        self,
+        taker_fee: float = DEFAULT_TAKER_FEE,
+        half_spread: float = DEFAULT_HALF_SPREAD,
+        impact_coef: float = DEFAULT_IMPACT_COEF,
+        symbol_taker_fee: Optional[Dict[str, float]] = None,
+        symbol_half_spread: Optional[Dict[str, float]] = None,
+        funding_rates=None,
+    ):
+        self.taker_fee = taker_fee
+        self.half_spread = half_spread
+        self.impact_coef = impact_coef
+        self.symbol_taker_fee = symbol_taker_fee or {}
+        self.symbol_half_spread = symbol_half_spread or {}
+        if funding_rates is not None and not isinstance(funding_rates, pl.DataFrame):
+            funding_rates = pl.from_pandas(funding_rates)
+        self.funding_rates = funding_rates
+
+    def proportional_rates(self, symbols: np.ndarray) -> np.ndarray:
+        """Fee + half spread per symbol, as a fraction of traded value."""
+        return np.array(
+            [
+                self.symbol_taker_fee.get(symbol, self.taker_fee) + self.symbol_half_spread.get(symbol, self.half_spread)
+                for symbol in symbols
+            ]
+        )
+
+    def trade_costs(self, trade_value: np.ndarray, proportional_rates: np.ndarray, quote_volume: np.ndarray) -> np.ndarray:
+        """Cost per symbol of trading |trade_value|; symbols without quote volume pay no impact."""
+        trade_value = np.abs(trade_value)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            participation = np.where(quote_volume > 0, trade_value / quote_volume, 0.0)
+        return trade_value * (proportional_rates + self.impact_coef * np.sqrt(participation))
+
+    def funding_panel(self, close_times: np.ndarray, symbols: np.ndarray) -> Optional[np.ndarray]:
+        """
+        (time x symbol) sum of funding rates settled while a position opened
+        after row i-1 is held, i.e. events in (close_times[i-1], close_times[i]].
+        None without funding data.
+        """
+        if self.funding_rates is None:
+            return None
+        events = self.funding_rates.select(
+            pl.col("timestamp").cast(pl.Datetime("ms")),
+            pl.col("symbol").str.replace_all("/", ""),
+            pl.col("funding_rate").cast(pl.Float64),
+        ).filter(pl.col("symbol").is_in(list(symbols)))
+
+        symbol_order = {symbol: i for i, symbol in enumerate(symbols)}
+        col_idx = np.array([symbol_order[symbol] for symbol in events["symbol"]], dtype=np.int64)
+        row_idx = np.searchsorted(close_times, events["timestamp"].to_numpy(), side="left")
+        inside = row_idx < len(close_times)
+
+        panel = np.zeros((len(close_times), len(symbols)))
+        np.add.at(panel, (row_idx[inside], col_idx[inside]), events["funding_rate"].to_numpy()[inside])
+        return panel
+
+    @staticmethod
+    def funding_costs(position_value: np.ndarray, funding_rate: np.ndarray) -> np.ndarray:
+        # 正的资金费率多头付给空头；position_value 有正负，结果就是要付出的金额
+        return position_value * funding_rate
@@ -0,0 +1,234 @@
+"""
+Production path of code1_get_alpha1.ipynb and the backtest notebook as one
+importable module: data update -> factors -> backtest -> trading signal.
+"""
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Optional
+
+import polars as pl
+
+logger = logging.getLogger("DailyPipeline")
+
+INPUT_PATH = "data/all_data_1d_2023.parquet"
+ORIGINAL_DATA_PATH = "data/all_data_1d.parquet"
+SIGNAL_LOG_DIR = "trading_logs"
+
+FACTOR_COMBINATION_LIST = [
+    "amihud",
+    "return_skewness",
+    "alpha30",
+    "alpha36",
+    "alpha40",
+    "alpha45",
+    "ID",
+]
+UPDATE_POSITION_TIME = 10
+TRADE_LONG_RANK = 20
+TRADE_SHORT_RANK = 10
+
+# 生产回测参数，与 backtest notebook 的运行 cell 一致
+BACKTEST_CONFIG = {
+    "compound_column_name": "linear_compound_factor",
+    "group_num": 10,
+    "long_factor_combination_list": [9],
+    "update_position_time": 5,
+    "trade_with_rank": -20,
+}
+# 写进目标持仓文件的平均日成交额窗口，执行器按它切分大订单
+QUOTE_VOLUME_WINDOW = 7
+
+
+def _AsOfDateTime(as_of: date) -> datetime:
+    return datetime(as_of.year, as_of.month, as_of.day, tzinfo=timezone.utc)
+
+
+def UpdateData(update_mode: str = "full") -> None:
+    # data_loader 依赖 ccxt/requests，只在需要更新数据时导入
+    from data_loader import BinanceDailyDataUpdater
+
+    updater = BinanceDailyDataUpdater(
+        original_data_path=ORIGINAL_DATA_PATH,
+        new_data_path=INPUT_PATH,
+        api_key=os.environ.get("BINANCE_API_KEY"),
+        api_secret=os.environ.get("BINANCE_API_SECRET"),
+    )
+    updater.update(update_mode=update_mode)
+
+
+def CalcPredictions(as_of: date, input_path: str = INPUT_PATH) -> pl.DataFrame:
+    """Factor stage of code1_get_alpha1: features, normalization, compound factor, position scale."""
+    from factor_pipeline import (
+        AddTotalPosValueScale,
+        CalcLinearCompoundFactor,
+        NormalizeFactors,
+        PROD_EXCLUDE_SYMBOLS,
+    )
+    from feature_store import get_features
+    from forward_returns import AttachForwardReturns, ForwardReturnStore
+
+    feature_list = ["open_price_volatility", "close_price_volatility"] + FACTOR_COMBINATION_LIST
+    # 只使用 as_of 之前已经走完的k线
+    input_data = get_features(
+        feature_list,
+        input_path=input_path,
+        exclude_symbols=PROD_EXCLUDE_SYMBOLS,
+        end_time=_AsOfDateTime(as_of),
+    )
+    # 未来收益列从共享的 cube 里取，不再逐列计算
+    fwd_ret_cube = ForwardReturnStore(
+        input_path,
+        exclude_symbols=PROD_EXCLUDE_SYMBOLS,
+        end_time=_AsOfDateTime(as_of),
+        max_horizon=UPDATE_POSITION_TIME,
+    ).load()
+    input_data = AttachForwardReturns(input_data, fwd_ret_cube)
+    input_data = NormalizeFactors(input_data, FACTOR_COMBINATION_LIST)
+    input_data = CalcLinearCompoundFactor(input_data, UPDATE_POSITION_TIME, FACTOR_COMBINATION_LIST)
+    input_data, _ = AddTotalPosValueScale(
+        input_data, day_num=UPDATE_POSITION_TIME, trade_long_rank=TRADE_LONG_RANK, trade_short_rank=TRADE_SHORT_RANK
+    )
+    return input_data
+
+
+def RecentQuoteVolume(as_of: date, input_path: str = INPUT_PATH, window: int = QUOTE_VOLUME_WINDOW) -> Dict[str, float]:
+    """Mean daily quote_volume of every symbol over the `window` days before as_of."""
+    from factor_pipeline import ScanKlines
+
+    end_time = _AsOfDateTime(as_of)
+    volumes = (
+        ScanKlines(input_path, start_time=end_time - timedelta(days=window), end_time=end_time)
+        .group_by("symbol")
+        .agg(pl.col("quote_volume").cast(pl.Float64).mean())
+        .collect()
+    )
+    return dict(zip(volumes["symbol"].to_list(), volumes["quote_volume"].to_list()))
+
+
+def RunBacktest(predictions: pl.DataFrame) -> dict:
+    from backtest import GetRollingPnL
+
+    _, metrics, _ = GetRollingPnL(
+        all_time_hist_data=None,
+        result_hour=predictions.filter(pl.col("linear_compound_factor_7day").is_not_null()),
+        **BACKTEST_CONFIG,
+    )
+    logger.info(f"回测指标: {metrics}")
+    return metrics
+
+
+def WriteSignalLog(
+    as_of: date,
+    long_positions: Dict[str, float],
+    short_positions: Dict[str, float],
+    prices: Dict[str, float],
+    log_dir: str = SIGNAL_LOG_DIR,
+) -> str:
+    """Append one signal block in the format LogSignalReader.parse_log_file expects."""
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, f"trading_signals_{as_of.strftime('%Y%m%d')}.log")
+
+    lines = ["=" * 80, f"回测时间: {as_of.strftime('%Y-%m-%d')}", f"多头持仓 ({len(long_positions)}):"]
+    lines += [f"{symbol:<20} {prices[symbol]:.8f} {size:.6f}" for symbol, size in long_positions.items()]
+    lines.append(f"空头持仓 ({len(short_positions)}):")
+    lines += [f"{symbol:<20} {prices[symbol]:.8f} {size:.6f}" for symbol, size in short_positions.items()]
+    lines.append(f"持仓总结: 多头 {len(long_positions)} 个, 空头 {len(short_positions)} 个")
+    lines.append("=" * 80)
+
+    with open(log_file, "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    logger.info(f"交易信号已写入 {log_file}")
+    return log_file
+
+
+def run_daily(
+    each_side_value: float,
+    as_of: Optional[date] = None,
+    update_data: bool = True,
+    update_mode: str = "full",
+    run_backtest: bool = True,
+    predictions_path: Optional[str] = None,
+    input_path: str = INPUT_PATH,
+) -> dict:
+    """
+    Run the whole daily production path in this process.
+
+    Args:
+        each_side_value: total USDT value per side used to size target positions
+            (the live exposure, so it has to be given explicitly).
+        as_of: signal date (UTC); only bars opened before it are used. Defaults to today.
+        update_data: fetch the latest klines first.
+        update_mode: data_loader update mode, 'full' or 'incremental'.
+        run_backtest: also run the rolling backtest and log its metrics.
+        predictions_path: if given, also write the predictions for the research notebooks.
+        input_path: kline parquet written by data_loader.
+    """
+    from backtest import GetTargetPositions
+    from signal_artifact import WriteTargetPositions
+
+    if not each_side_value > 0:
+        raise ValueError(f"each_side_value 必须大于0: {each_side_value}")
+    as_of = as_of or datetime.now(timezone.utc).date()
+    logger.info(f"=== 开始每日流程 as_of {as_of} ===")
+
+    if update_data:
+        UpdateData(update_mode)
+
+    predictions = CalcPredictions(as_of, input_path=input_path)
+    if predictions_path:
+        predictions.write_parquet(predictions_path)
+
+    metrics = RunBacktest(predictions) if run_backtest else {}
+
+    long_positions, short_positions, prices = GetTargetPositions(
+        predictions,
+        each_side_value=each_side_value,
+        **BACKTEST_CONFIG,
+    )
+    signal_file, positions_file = None, None
+    if long_positions or short_positions:
+        # 执行器读取结构化的目标持仓文件，日志只给人看
+        positions_file = WriteTargetPositions(
+            as_of, long_positions, short_positions, prices, quote_volumes=RecentQuoteVolume(as_of, input_path)
+        )
+        signal_file = WriteSignalLog(as_of, long_positions, short_positions, prices)
+
+    logger.info("=== 每日流程完成 ===")
+    return {
+        "as_of": as_of,
+        "metrics": metrics,
+        "long_positions": long_positions,
+        "short_positions": short_positions,
+        "signal_file": signal_file,
+        "positions_file": positions_file,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("daily_pipeline.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+    parser = argparse.ArgumentParser(description='每日数据更新、因子计算、回测和交易信号')
+    parser.add_argument('--each_side_value', type=float, required=True, help='实盘单边持仓总价值(USDT)，按账户规模设置')
+    parser.add_argument('--as_of', type=str, help='信号日期，格式 YYYY-MM-DD，默认今天(UTC)')
+    parser.add_argument('--skip_data_update', action='store_true', help='不更新k线数据')
+    parser.add_argument('--skip_backtest', action='store_true', help='不运行回测')
+    parser.add_argument('--predictions_path', type=str, default=None, help='同时保存predictions供研究使用')
+    args = parser.parse_args()
+
+    run_daily(
+        each_side_value=args.each_side_value,
+        as_of=datetime.strptime(args.as_of, "%Y-%m-%d").date() if args.as_of else None,
+        update_data=not args.skip_data_update,
+        run_backtest=not args.skip_backtest,
+        predictions_path=args.predictions_path,
+    )
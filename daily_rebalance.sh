@@ -3,7 +3,6 @@
 
 # 设置Python解释器路径
 PYTHON_PATH="$HOME/.pyenv/versions/3.10.10/bin/python"
-JUPYTER_PATH="$HOME/.pyenv/versions/3.10.10/bin/jupyter"
 
 # 设置日志目录
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
@@ -27,34 +26,22 @@ eval "$(pyenv init -)"
 # 导出必要的环境变量
 export PATH=/usr/local/bin:/usr/bin:/bin:/usr/sbin:/sbin:$PATH
 
-# 1. 执行data_loader.py
-echo "1. 正在执行data_loader.py..." >> "$LOG_FILE"
-"$PYTHON_PATH" data_loader.py >> "$LOG_FILE" 2>&1
-if [ $? -ne 0 ]; then
-    echo "data_loader.py 执行失败!" >> "$LOG_FILE"
-    exit 1
-fi
-
-# 2. 执行code1_get_alpha1.ipynb
-echo "2. 正在执行code1_get_alpha1.ipynb..." >> "$LOG_FILE"
-"$JUPYTER_PATH" nbconvert --to script code1_get_alpha1.ipynb
-"$PYTHON_PATH" code1_get_alpha1.py >> "$LOG_FILE" 2>&1
-if [ $? -ne 0 ]; then
-    echo "code1_get_alpha1.ipynb 执行失败!" >> "$LOG_FILE"
+# 实盘单边持仓总价值(USDT)，按账户规模设置，没有默认值
+if [ -z "$EACH_SIDE_VALUE" ]; then
+    echo "未设置 EACH_SIDE_VALUE（单边持仓总价值 USDT）!" >> "$LOG_FILE"
     exit 1
 fi
 
-# 3. 执行code2_backtest_add.ipynb
-echo "3. 正在执行code2_backtest_add.ipynb..." >> "$LOG_FILE"
-"$JUPYTER_PATH" nbconvert --to script code2_backtest_add.ipynb
-"$PYTHON_PATH" code2_backtest_add.py >> "$LOG_FILE" 2>&1
+# 1-3. 数据更新、因子计算、回测和交易信号在同一个进程中完成
+echo "1. 正在执行daily_pipeline.py..." >> "$LOG_FILE"
+"$PYTHON_PATH" daily_pipeline.py --each_side_value "$EACH_SIDE_VALUE" >> "$LOG_FILE" 2>&1
 if [ $? -ne 0 ]; then
-    echo "code2_backtest_add.ipynb 执行失败!" >> "$LOG_FILE"
+    echo "daily_pipeline.py 执行失败!" >> "$LOG_FILE"
     exit 1
 fi
 
-# 4. 执行executor.py
-echo "4. 正在执行executor.py..." >> "$LOG_FILE"
+# 2. 执行executor.py
+echo "2. 正在执行executor.py..." >> "$LOG_FILE"
 "$PYTHON_PATH" executor.py >> "$LOG_FILE" 2>&1
 if [ $? -ne 0 ]; then
     echo "executor.py 执行失败!" >> "$LOG_FILE"
@@ -10,6 +10,8 @@ from typing import List, Dict, Union, Optional
 import requests
 import asyncio
 
+from exchange_metrics import METRICS_DIR, RunMetrics
+
 # 设置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -43,6 +45,8 @@ class BinanceDailyDataUpdater:
         self.start_date = pd.to_datetime(start_date)
         self.api_key = api_key
         self.api_secret = api_secret
+        # 每个请求的耗时、重试、等待和 X-MBX-USED-WEIGHT-1M，update() 结束时写到 metrics 目录
+        self.metrics = RunMetrics("data_loader")
         
         # 从原始数据文件获取交易对列表
         self.symbols = self._get_symbols_from_original_data()
@@ -92,22 +96,30 @@ class BinanceDailyDataUpdater:
                 for retry in range(max_retries):
                     try:
                         headers = {'X-MBX-APIKEY': self.api_key} if self.api_key else {}
-                        response = requests.get(
-                            url, 
-                            params=params, 
-                            headers=headers,
-                            timeout=timeout  # 添加超时设置
-                        )
+                        # klines limit 1500 的 weight 是 10
+                        with self.metrics.timed("klines", weight=10) as call:
+                            response = requests.get(
+                                url, 
+                                params=params, 
+                                headers=headers,
+                                timeout=timeout  # 添加超时设置
+                            )
+                            call["status"] = response.status_code
+                            call["headers"] = response.headers
                         
                         if response.status_code == 429:  # 频率限制
                             wait_time = 60 * (retry + 1)  # 递增等待时间
                             logger.warning(f"{symbol}: 触发频率限制，等待 {wait_time} 秒")
+                            self.metrics.retry("klines", "429")
+                            self.metrics.sleep("klines", "429", wait_time)
                             await asyncio.sleep(wait_time)
                             continue
                             
                         if response.status_code == 418:  # IP 封禁
                             wait_time = 300 * (retry + 1)  # 递增等待时间
                             logger.warning(f"{symbol}: IP 被临时封禁，等待 {wait_time} 秒")
+                            self.metrics.retry("klines", "418")
+                            self.metrics.sleep("klines", "418", wait_time)
                             await asyncio.sleep(wait_time)
                             continue
                         
@@ -119,6 +131,8 @@ class BinanceDailyDataUpdater:
                         if retry < max_retries - 1:
                             wait_time = 5 * (retry + 1)  # 递增等待时间
                             logger.warning(f"{symbol}: 请求超时，第 {retry + 1} 次重试，等待 {wait_time} 秒")
+                            self.metrics.retry("klines", "timeout")
+                            self.metrics.sleep("klines", "timeout", wait_time)
                             await asyncio.sleep(wait_time)
                             continue
                         else:
@@ -129,6 +143,8 @@ class BinanceDailyDataUpdater:
                         if retry < max_retries - 1:
                             wait_time = 5 * (retry + 1)
                             logger.warning(f"{symbol}: 请求失败 ({str(e)})，第 {retry + 1} 次重试，等待 {wait_time} 秒")
+                            self.metrics.retry("klines", "request_error")
+                            self.metrics.sleep("klines", "request_error", wait_time)
                             await asyncio.sleep(wait_time)
                             continue
                         else:
@@ -146,6 +162,7 @@ class BinanceDailyDataUpdater:
                 if len(klines) < 1500:
                     break
                     
+                self.metrics.sleep("klines", "pagination", 0.2)
                 await asyncio.sleep(0.2)
                 
             if not all_klines:
@@ -200,7 +217,10 @@ class BinanceDailyDataUpdater:
             
             # 发送请求
             headers = {'X-MBX-APIKEY': self.api_key} if self.api_key else {}
-            response = requests.get(url, params=params, headers=headers)
+            with self.metrics.timed("fundingRate", weight=1) as call:
+                response = requests.get(url, params=params, headers=headers)
+                call["status"] = response.status_code
+                call["headers"] = response.headers
             response.raise_for_status()
             
             # 处理响应
@@ -280,7 +300,10 @@ class BinanceDailyDataUpdater:
         try:
             binance_symbol = symbol.replace('/', '')
             url = "https://fapi.binance.com/fapi/v1/exchangeInfo"
-            response = requests.get(url)
+            with self.metrics.timed("exchangeInfo", weight=1) as call:
+                response = requests.get(url)
+                call["status"] = response.status_code
+                call["headers"] = response.headers
             response.raise_for_status()
             
             exchange_info = response.json()
@@ -358,6 +381,7 @@ class BinanceDailyDataUpdater:
                     
                     # 避免API限制
                     # 根据更新模式使用不同的等待时间
+                    self.metrics.sleep("klines", "symbol_pacing", symbol_wait_time)
                     await asyncio.sleep(symbol_wait_time)
                     
                 except Exception as e:
@@ -369,6 +393,7 @@ class BinanceDailyDataUpdater:
             
             # 每组处理完后等待一段时间
             # 根据更新模式使用不同的等待时间
+            self.metrics.sleep("klines", "group_pacing", group_wait_time)
             await asyncio.sleep(group_wait_time)
         
         # 如果没有新数据
@@ -469,16 +494,22 @@ class BinanceDailyDataUpdater:
                 logger.critical(f"紧急保存也失败: {csv_error}")
                 raise
 
-    def update(self, update_mode: str = 'incremental') -> None:
+    def update(self, update_mode: str = 'incremental', metrics_dir: Optional[str] = METRICS_DIR) -> None:
         """
         运行更新操作（同步版本）
         
         Args:
             update_mode: 'full'表示完整更新，'incremental'表示增量更新
+            metrics_dir: 本次运行的请求耗时 / 重试 / weight 指标文件目录（None 不写）
         """
         # 在同步环境中运行异步函数
+        self.metrics = RunMetrics("data_loader")
         loop = asyncio.get_event_loop()
-        loop.run_until_complete(self.update_all_data(update_mode=update_mode))
+        try:
+            loop.run_until_complete(self.update_all_data(update_mode=update_mode))
+        finally:
+            if metrics_dir is not None:
+                self.metrics.write(metrics_dir)
 
 # 主程序部分修改
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+"""
+Per-run instrumentation of exchange calls for the executor and data_loader.
+
+RunMetrics times every REST call by endpoint and counts outcomes, retries,
+backoff / rate-limiter sleeps, the request weight reserved on the client
+side and the X-MBX-USED-WEIGHT-1M the exchange reports back. write() saves
+one Prometheus text file per run (node_exporter textfile format): a latency
+histogram and p50 / p90 / p99 summary per endpoint plus the counters, so
+runs can be compared before and after a performance change.
+
+Only the standard library and numpy are used, the executor environment has
+no polars and may have no parquet engine.
+"""
+import logging
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger("ExchangeMetrics")
+
+METRICS_DIR = "metrics"
+# 请求耗时直方图的分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.9, 0.99)
+USED_WEIGHT_HEADER = "x-mbx-used-weight-1m"
+
+
+def UsedWeight(headers) -> Optional[float]:
+    """X-MBX-USED-WEIGHT-1M of a response (header names are case-insensitive), None if absent."""
+    if not headers:
+        return None
+    for key, value in headers.items():
+        if key.lower() == USED_WEIGHT_HEADER:
+            return float(value)
+    return None
+
+
+def _Labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+class RunMetrics:
+    """
+    Metrics of one run of `component` (executor / data_loader).
+
+    latencies {endpoint: [seconds]}, requests {(endpoint, status): n},
+    retries {(endpoint, reason): n}, backoff {(endpoint, reason): [n,
+    seconds]}, weight {endpoint: reserved weight}, used_weight (last and
+    max X-MBX-USED-WEIGHT-1M).
+    """
+
+    def __init__(self, component: str):
+        self.component = component
+        self.started_at = time.time()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.requests: Dict[tuple, int] = defaultdict(int)
+        self.retries: Dict[tuple, int] = defaultdict(int)
+        self.backoff: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0])
+        self.weight: Dict[str, float] = defaultdict(float)
+        self.used_weight: Optional[float] = None
+        self.max_used_weight = 0.0
+
+    def observe(self, endpoint: str, latency: float, status="ok", weight: float = 0.0, headers=None) -> None:
+        """One finished call: its latency, outcome (ok / HTTP code / exception name) and weight."""
+        self.latencies[endpoint].append(latency)
+        self.requests[(endpoint, str(status))] += 1
+        self.weight[endpoint] += weight
+        used = UsedWeight(headers)
+        if used is not None:
+            self.used_weight = used
+            self.max_used_weight = max(self.max_used_weight, used)
+
+    @contextmanager
+    def timed(self, endpoint: str, weight: float = 0.0):
+        """
+        Time the block as one call of endpoint. The block may set call["status"]
+        (e.g. the HTTP code) and call["headers"]; an exception is recorded by
+        its class name and re-raised.
+        """
+        call = {"status": "ok", "headers": None}
+        start = time.monotonic()
+        try:
+            yield call
+        except Exception as e:
+            call["status"] = type(e).__name__
+            raise
+        finally:
+            self.observe(endpoint, time.monotonic() - start, call["status"], weight, call["headers"])
+
+    def retry(self, endpoint: str, reason: str, count: int = 1) -> None:
+        self.retries[(endpoint, reason)] += count
+
+    def sleep(self, endpoint: str, reason: str, seconds: float) -> None:
+        """Record a backoff / pacing sleep (or a wait in the rate limiter)."""
+        entry = self.backoff[(endpoint, reason)]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def summary(self) -> Dict[str, dict]:
+        """{endpoint: {count, errors, p50, p90, p99, max}} with latencies in seconds."""
+        errors = defaultdict(int)
+        for (endpoint, status), n in self.requests.items():
+            if status not in ("ok", "200"):
+                errors[endpoint] += n
+        summary = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            values = np.asarray(latencies)
+            summary[endpoint] = {
+                "count": len(values),
+                "errors": errors[endpoint],
+                **{f"p{int(q * 100)}": round(float(np.quantile(values, q)), 4) for q in QUANTILES},
+                "max": round(float(values.max()), 4),
+            }
+        return summary
+
+    def to_prometheus(self) -> str:
+        base = {"component": self.component}
+        lines = [
+            "# HELP exchange_request_duration_seconds Latency of exchange REST calls.",
+            "# TYPE exchange_request_duration_seconds histogram",
+        ]
+        for endpoint, latencies in sorted(self.latencies.items()):
+            values = np.asarray(latencies)
+            for bucket in LATENCY_BUCKETS:
+                lines.append(
+                    f"exchange_request_duration_seconds_bucket{_Labels(**base, endpoint=endpoint, le=bucket)} "
+                    f"{int((values <= bucket).sum())}"
+                )
+            lines.append(f"exchange_request_duration_seconds_bucket{_Labels(**base, endpoint=endpoint, le='+Inf')} {len(values)}")
+            lines.append(f"exchange_request_duration_seconds_sum{_Labels(**base, endpoint=endpoint)} {values.sum():.6f}")
+            lines.append(f"exchange_request_duration_seconds_count{_Labels(**base, endpoint=endpoint)} {len(values)}")
+
+        lines += [
+            "# HELP exchange_request_duration_quantile_seconds Latency quantiles of exchange REST calls in this run.",
+            "# TYPE exchange_request_duration_quantile_seconds summary",
+        ]
+        for endpoint, latencies in sorted(self.latencies.items()):
+            values = np.asarray(latencies)
+            for q in QUANTILES:
+                lines.append(
+                    f"exchange_request_duration_quantile_seconds{_Labels(**base, endpoint=endpoint, quantile=q)} "
+                    f"{np.quantile(values, q):.6f}"
+                )
+            lines.append(f"exchange_request_duration_quantile_seconds_sum{_Labels(**base, endpoint=endpoint)} {values.sum():.6f}")
+            lines.append(f"exchange_request_duration_quantile_seconds_count{_Labels(**base, endpoint=endpoint)} {len(values)}")
+
+        def counter(name: str, help_text: str, samples: Dict[str, float]) -> None:
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} counter"])
+            lines.extend(f"{name}{labels} {value:g}" for labels, value in samples.items())
+
+        counter("exchange_requests_total", "Exchange REST calls by outcome.", {
+            _Labels(**base, endpoint=e, status=s): n for (e, s), n in sorted(self.requests.items())
+        })
+        counter("exchange_retries_total", "Calls resent after a retryable failure.", {
+            _Labels(**base, endpoint=e, reason=r): n for (e, r), n in sorted(self.retries.items())
+        })
+        counter("exchange_backoff_total", "Backoff, pacing and rate-limiter sleeps.", {
+            _Labels(**base, endpoint=e, reason=r): v[0] for (e, r), v in sorted(self.backoff.items())
+        })
+        counter("exchange_backoff_seconds_total", "Seconds spent in backoff, pacing and rate-limiter sleeps.", {
+            _Labels(**base, endpoint=e, reason=r): round(v[1], 6) for (e, r), v in sorted(self.backoff.items())
+        })
+        counter("exchange_request_weight_total", "Request weight of the calls, from the client-side weight table.", {
+            _Labels(**base, endpoint=e): w for e, w in sorted(self.weight.items())
+        })
+
+        lines += [
+            "# HELP exchange_used_weight_1m X-MBX-USED-WEIGHT-1M reported by the exchange (max over the run).",
+            "# TYPE exchange_used_weight_1m gauge",
+            f"exchange_used_weight_1m{_Labels(**base)} {self.max_used_weight:g}",
+            "# HELP exchange_run_duration_seconds Wall time of the run.",
+            "# TYPE exchange_run_duration_seconds gauge",
+            f"exchange_run_duration_seconds{_Labels(**base)} {time.time() - self.started_at:.3f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, metrics_dir: str = METRICS_DIR) -> str:
+        """Write metrics_dir/<component>_<run start>.prom atomically and log the per-endpoint summary."""
+        os.makedirs(metrics_dir, exist_ok=True)
+        stamp = datetime.fromtimestamp(self.started_at).strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(metrics_dir, f"{self.component}_{stamp}.prom")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(path + ".tmp", path)
+        for endpoint, row in self.summary().items():
+            logger.info(f"{self.component} {endpoint}: {row}")
+        logger.info(f"请求指标已写入 {path}，最大 used weight {self.max_used_weight:g}")
+        return path
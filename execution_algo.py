@@ -0,0 +1,207 @@
+"""
+Sliced execution (TWAP / POV) of large rebalance legs.
+
+A leg is split into slices sent every `interval` seconds. POV sizes the
+slices so that each one stays under `participation` of the quote volume
+expected in its interval (from the recent daily quote_volume of the kline
+store), TWAP uses a fixed slice count. Each slice is a post-only limit order
+at the touch that is cancelled and completed with a market order when it has
+not filled after `post_only_wait` seconds, or a plain market order. The
+slices of all legs run concurrently on one asyncio loop, and every leg
+reports its filled quantity, average price and slippage against the arrival
+(mark) price.
+"""
+import asyncio
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+import ccxt
+import numpy as np
+
+logger = logging.getLogger("ExecutionAlgo")
+
+ALGOS = ("market", "twap", "pov")
+SECONDS_PER_DAY = 86400
+# 每个切片不超过该时间段预期成交额的比例
+DEFAULT_PARTICIPATION = 0.02
+SLICE_INTERVAL = 60.0
+MAX_SLICES = 30
+TWAP_SLICES = 5
+# post-only 挂单等待成交的时间，之后撤单，剩余部分市价成交
+POST_ONLY_WAIT = 10.0
+
+
+def SliceCounts(
+    notional: np.ndarray,
+    quote_volume: np.ndarray,
+    min_notional: np.ndarray,
+    algo: str = "pov",
+    participation: float = DEFAULT_PARTICIPATION,
+    interval: float = SLICE_INTERVAL,
+    max_slices: int = MAX_SLICES,
+    twap_slices: int = TWAP_SLICES,
+) -> np.ndarray:
+    """
+    Number of slices of every leg.
+
+    pov: ceil(notional / (participation * daily quote_volume * interval / 1 day)),
+    twap: twap_slices, market: 1. Counts are capped by max_slices and by
+    notional / min_notional so every slice can still be sent; legs without a
+    quote volume or price are not sliced.
+    """
+    assert algo in ALGOS, f"unknown algo {algo}, expected one of {ALGOS}"
+    notional = np.asarray(notional, dtype=np.float64)
+    if algo == "market":
+        return np.ones(len(notional), dtype=np.int64)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if algo == "twap":
+            counts = np.full(len(notional), float(twap_slices))
+        else:
+            expected_volume = np.asarray(quote_volume, dtype=np.float64) * interval / SECONDS_PER_DAY
+            counts = np.ceil(notional / (participation * expected_volume))
+        counts = np.minimum(counts, np.minimum(max_slices, np.floor(notional / np.asarray(min_notional))))
+    counts = np.where(np.isfinite(counts), counts, 1)
+    return np.maximum(counts, 1).astype(np.int64)
+
+
+def SliceQuantities(quantity: float, count: int, step: float) -> List[float]:
+    """count step-rounded slices adding up to quantity; the last one takes the remainder."""
+    base = math.floor(quantity / count / step + 1e-9) * step
+    if base <= 0:
+        return [quantity]
+    return [round(base, 10)] * (count - 1) + [round(quantity - base * (count - 1), 10)]
+
+
+class SlicedExecutor:
+    """
+    Runs the slices of many legs concurrently through an AsyncOrderDispatcher
+    and books the fills into the ExecutorState snapshot.
+    """
+
+    def __init__(
+        self,
+        dispatcher,
+        state,
+        interval: float = SLICE_INTERVAL,
+        post_only: bool = True,
+        post_only_wait: float = POST_ONLY_WAIT,
+    ):
+        self.dispatcher = dispatcher
+        self.state = state
+        self.interval = interval
+        self.post_only = post_only
+        self.post_only_wait = post_only_wait
+
+    def _params(self, leg: dict, client_order_id: Optional[str], **params) -> dict:
+        params['positionSide'] = leg['positionSide']
+        if client_order_id:
+            params['newClientOrderId'] = client_order_id
+        return params
+
+    async def _market(self, leg: dict, quantity: float, client_order_id: Optional[str] = None) -> Tuple[float, float, dict]:
+        # RESULT 响应里带成交数量和均价
+        order = await self.dispatcher.call(
+            "create_order", leg['symbol'], 'MARKET', leg['side'], quantity, None,
+            self._params(leg, client_order_id, newOrderRespType='RESULT'),
+        )
+        filled = float(order.get('filled') or quantity)
+        price = float(order.get('average') or order.get('price') or self.state.mark_prices.get(leg['symbol'], np.nan))
+        return filled, price, order
+
+    async def _post_only(self, leg: dict, quantity: float, client_order_id: Optional[str] = None) -> Tuple[float, float, dict]:
+        book = await self.dispatcher.call("fapiPublicGetTickerBookTicker", {'symbol': leg['symbol']})
+        price = float(book['bidPrice'] if leg['side'] == 'buy' else book['askPrice'])
+        order = await self.dispatcher.call(
+            "create_order", leg['symbol'], 'LIMIT', leg['side'], quantity, price,
+            self._params(leg, client_order_id, timeInForce='GTX'),
+        )
+        await asyncio.sleep(self.post_only_wait)
+        try:
+            order = await self.dispatcher.call("cancel_order", order['id'], leg['symbol'])
+        except ccxt.OrderNotFound:
+            # 已经全部成交，或者 GTX 会立即成交被交易所直接拒绝
+            order = await self.dispatcher.call("fetch_order", order['id'], leg['symbol'])
+
+        filled = float(order.get('filled') or 0.0)
+        remaining = round(quantity - filled, 10)
+        if remaining <= 0:
+            return filled, price, order
+        try:
+            market_filled, market_price, market_order = await self._market(
+                leg, remaining, f"{client_order_id}m" if client_order_id else None
+            )
+        except Exception as e:
+            # 挂单已经部分成交时保留这部分成交，剩余数量记为未成交
+            if filled <= 0:
+                raise
+            logger.warning(f"{leg['symbol']} 剩余 {remaining} 市价成交失败: {e}")
+            return filled, price, order
+        order = market_order
+        total = filled + market_filled
+        return total, (filled * price + market_filled * market_price) / total, order
+
+    async def _run_leg(self, leg: dict, count: int, step: float) -> dict:
+        start = time.monotonic()
+        arrival_price = self.state.mark_prices.get(leg['symbol'], np.nan)
+        slices = SliceQuantities(leg['quantity'], count, step)
+        filled, filled_value, order_id, error = 0.0, 0.0, None, None
+
+        for k, quantity in enumerate(slices):
+            if k:
+                await asyncio.sleep(max(0.0, start + k * self.interval - time.monotonic()))
+            # 每一片的 client order id 是订单的 id 加上片序号
+            client_order_id = f"{leg['client_order_id']}-s{k}" if leg.get('client_order_id') else None
+            try:
+                if self.post_only:
+                    slice_filled, price, order = await self._post_only(leg, quantity, client_order_id)
+                else:
+                    slice_filled, price, order = await self._market(leg, quantity, client_order_id)
+            except Exception as e:
+                error = str(e)
+                logger.warning(f"{leg['symbol']} 第 {k + 1}/{len(slices)} 片下单失败，停止该订单: {e}")
+                break
+            order_id = order.get('id')
+            filled += slice_filled
+            filled_value += slice_filled * price
+            self.state.apply_fill(leg['symbol'], leg['side'], leg['positionSide'], slice_filled)
+
+        avg_price = filled_value / filled if filled > 0 else np.nan
+        # 买入成交价高于到达价、卖出成交价低于到达价为正的滑点
+        sign = 1.0 if leg['side'] == 'buy' else -1.0
+        if filled <= 0:
+            status = "failed"
+        else:
+            status = "submitted" if filled >= leg['quantity'] - 1e-9 else "partial"
+        return {
+            **leg,
+            "status": status,
+            "order_id": order_id,
+            "error": error,
+            "latency": time.monotonic() - start,
+            "slices": len(slices),
+            "filled": filled,
+            "avg_price": avg_price,
+            "arrival_price": arrival_price,
+            "slippage_bps": sign * (avg_price / arrival_price - 1) * 10000,
+        }
+
+    async def run(self, legs: List[dict], counts: List[int], steps: List[float]) -> List[dict]:
+        """Execute every leg in counts[i] slices of steps[i]-rounded size, all legs concurrently."""
+        results = await asyncio.gather(*(self._run_leg(leg, c, s) for leg, c, s in zip(legs, counts, steps)))
+        if results:
+            logger.info(f"切片执行 {len(results)} 个订单 {sum(counts)} 片: {SummarizeFills(results)}")
+        return list(results)
+
+
+def SummarizeFills(results: List[dict]) -> Dict[str, float]:
+    """Notional-weighted slippage (bps) and fill ratio of sliced results."""
+    sliced = [r for r in results if "slippage_bps" in r and np.isfinite(r["slippage_bps"])]
+    notional = sum(r["notional"] for r in sliced)
+    return {
+        "sliced_legs": len(sliced),
+        "slippage_bps": sum(r["slippage_bps"] * r["notional"] for r in sliced) / notional if notional else np.nan,
+        "fill_ratio": sum(r["filled"] for r in sliced) / sum(r["quantity"] for r in sliced) if sliced else np.nan,
+    }
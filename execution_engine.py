@@ -0,0 +1,281 @@
+"""
+Concurrent order dispatch for BinanceFuturesExecutor.
+
+The legs of a rebalance are split into dependency groups (close / reduce
+legs first, then open / increase legs); the legs of one group are
+independent and are sent concurrently through ccxt's async client, while a
+request-weight token bucket keeps the whole run under the futures IP limit.
+Every leg gets a result record (status, order id, error, latency), and every
+call is timed into an exchange_metrics.RunMetrics (latency per endpoint,
+retries, rate-limiter waits, X-MBX-USED-WEIGHT-1M). The response headers are
+taken from ccxt's on_rest_response hook of that very request: concurrent
+calls share one client, so exchange.last_response_headers after an await may
+belong to another call.
+
+run_batched_groups packs the legs of a group into batchOrders requests of
+up to BATCH_SIZE orders, maps the per-order results back to the legs and
+resends only the legs that failed with a retryable error.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import ccxt
+
+from exchange_metrics import RunMetrics
+from rebalance_planner import REDUCING_ACTIONS
+
+logger = logging.getLogger("ExecutionEngine")
+
+# binance U本位合约 IP 限制：每分钟 2400 weight，留一些余量给同一IP上的其他程序
+WEIGHT_LIMIT_PER_MINUTE = 2000
+# 各接口的 request weight（/fapi 文档）
+ENDPOINT_WEIGHTS = {
+    "create_order": 1,
+    # batchOrders 最多5个订单，weight 5
+    "create_orders": 5,
+    "fetch_ticker": 1,
+    "set_leverage": 1,
+    "fetch_positions": 5,
+    "fetch_balance": 5,
+    "load_markets": 1,
+    # premiumIndex 不带 symbol 返回全部合约，weight 10
+    "fapiPublicGetPremiumIndex": 10,
+    "fapiPrivateGetSymbolConfig": 5,
+    "fapiPrivateGetPositionSideDual": 30,
+    "fapiPrivatePostPositionSideDual": 1,
+    "fapiPublicGetTickerBookTicker": 2,
+    "fapiPrivatePostListenKey": 1,
+    "fapiPrivatePutListenKey": 1,
+    "fapiPrivateDeleteListenKey": 1,
+}
+# 同时在途的请求数
+MAX_CONCURRENCY = 20
+# binance batchOrders 每次最多5个订单
+BATCH_SIZE = 5
+# 可重试的失败最多再发几次，第n次重发前等 n * RETRY_DELAY 秒
+MAX_RETRIES = 2
+RETRY_DELAY = 1.0
+# 这些错误码说明订单没有被接受，可以重发：-1001 内部断开，-1003 请求过多，-1008 服务器繁忙
+RETRYABLE_ERROR_CODES = {-1001, -1003, -1008}
+
+# 当前 task 里正在进行的 dispatcher.call 的记录，on_rest_response 把响应头写进去
+_CURRENT_CALL: contextvars.ContextVar = contextvars.ContextVar("current_call", default=None)
+
+
+class OrderRejected(Exception):
+    """One order of a batch rejected by the exchange, with the binance error code."""
+
+    def __init__(self, code: int, msg: str):
+        super().__init__(f"{code} {msg}")
+        self.code = code
+
+
+def IsRetryable(error: Exception) -> bool:
+    # 429/418 限速时请求没有被处理；超时等状态未知的错误不重发，避免重复下单
+    if isinstance(error, OrderRejected):
+        return error.code in RETRYABLE_ERROR_CODES
+    return isinstance(error, (ccxt.RateLimitExceeded, ccxt.DDoSProtection))
+
+
+def _CaptureResponseHeaders(exchange) -> None:
+    # ccxt 在发请求的 task 里对每个响应调用 on_rest_response，按 contextvar 找到对应的那次调用
+    original = getattr(exchange, "on_rest_response", None)
+    if original is None or getattr(original, "captures_headers", False):
+        return
+
+    def on_rest_response(code, reason, url, method, response_headers, response_body, request_headers, request_body):
+        call = _CURRENT_CALL.get()
+        if call is not None:
+            call["headers"] = response_headers
+        return original(code, reason, url, method, response_headers, response_body, request_headers, request_body)
+
+    on_rest_response.captures_headers = True
+    exchange.on_rest_response = on_rest_response
+
+
+class WeightRateLimiter:
+    """
+    Token bucket over request weight. Refills weight_per_minute / 60 per
+    second up to `burst`; acquire(weight) waits until that much is available.
+    """
+
+    def __init__(self, weight_per_minute: float = WEIGHT_LIMIT_PER_MINUTE, burst: Optional[float] = None):
+        self.rate = weight_per_minute / 60.0
+        self.burst = burst if burst is not None else weight_per_minute / 4
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self, weight: float) -> float:
+        """Take weight tokens; returns the seconds spent waiting for them."""
+        start = time.monotonic()
+        async with self._lock:
+            self._refill()
+            while self._tokens < weight:
+                await asyncio.sleep((weight - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= weight
+        return time.monotonic() - start
+
+
+class AsyncOrderDispatcher:
+    """
+    Weight-limited, concurrency-limited calls on a ccxt async exchange, and
+    group-by-group execution of trade legs.
+    """
+
+    def __init__(
+        self,
+        exchange,
+        limiter: Optional[WeightRateLimiter] = None,
+        max_concurrency: int = MAX_CONCURRENCY,
+        metrics: Optional[RunMetrics] = None,
+    ):
+        self.exchange = exchange
+        self.limiter = limiter or WeightRateLimiter()
+        self.metrics = metrics or RunMetrics("executor")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        _CaptureResponseHeaders(exchange)
+
+    async def call(self, endpoint: str, *args, **kwargs):
+        """Await exchange.<endpoint>(*args, **kwargs) after reserving its request weight."""
+        weight = ENDPOINT_WEIGHTS.get(endpoint, 1)
+        waited = await self.limiter.acquire(weight)
+        if waited > 0.001:
+            self.metrics.sleep(endpoint, "rate_limiter", waited)
+        async with self._semaphore:
+            with self.metrics.timed(endpoint, weight) as call:
+                token = _CURRENT_CALL.set(call)
+                try:
+                    return await getattr(self.exchange, endpoint)(*args, **kwargs)
+                finally:
+                    _CURRENT_CALL.reset(token)
+
+    async def _run_leg(self, leg: dict, execute_leg: Callable[["AsyncOrderDispatcher", dict], Awaitable]) -> dict:
+        start = time.monotonic()
+        result = {**leg, "status": "skipped", "order_id": None, "error": None}
+        try:
+            order = await execute_leg(self, leg)
+            if order is not None:
+                result["status"] = "submitted"
+                result["order_id"] = order.get("id")
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = str(e)
+        result["latency"] = time.monotonic() - start
+        return result
+
+    async def run_groups(
+        self,
+        groups: List[Tuple[str, List[dict]]],
+        execute_leg: Callable[["AsyncOrderDispatcher", dict], Awaitable],
+    ) -> List[dict]:
+        """
+        Run the (name, legs) groups in order; the legs of a group run
+        concurrently and the next group starts when all of them are done.
+        execute_leg(dispatcher, leg) returns the order, or None if the leg
+        was skipped. Returns one result per leg in plan order.
+        """
+        results = []
+        for name, legs in groups:
+            if not legs:
+                continue
+            start = time.monotonic()
+            group_results = await asyncio.gather(*(self._run_leg(leg, execute_leg) for leg in legs))
+            failed = sum(r["status"] == "failed" for r in group_results)
+            logger.info(f"{name}: {len(legs)} 个订单完成，失败 {failed} 个，用时 {time.monotonic() - start:.2f}s")
+            results.extend(group_results)
+        return results
+
+    async def _run_batch(
+        self, legs: List[dict], execute_batch: Callable[["AsyncOrderDispatcher", List[dict]], Awaitable]
+    ) -> List[Tuple[object, float]]:
+        start = time.monotonic()
+        try:
+            outcomes = await execute_batch(self, legs)
+        except Exception as e:
+            outcomes = [e] * len(legs)
+        latency = time.monotonic() - start
+        return [(outcome, latency) for outcome in outcomes]
+
+    async def run_batched_groups(
+        self,
+        groups: List[Tuple[str, List[dict]]],
+        execute_batch: Callable[["AsyncOrderDispatcher", List[dict]], Awaitable],
+        batch_size: int = BATCH_SIZE,
+        max_retries: int = MAX_RETRIES,
+    ) -> List[dict]:
+        """
+        Like run_groups, but the legs of a group are sent batch_size at a time,
+        the batches concurrently. execute_batch(dispatcher, legs) returns one
+        outcome per leg (the order, None if skipped, or the Exception of that
+        order); if it raises, every leg of the batch gets the exception. Legs
+        failed with a retryable error are re-batched and resent up to
+        max_retries times. Results also carry the number of attempts.
+        """
+        results = []
+        for name, legs in groups:
+            if not legs:
+                continue
+            start = time.monotonic()
+            group_results: List[dict] = [None] * len(legs)
+            pending = list(range(len(legs)))
+            for attempt in range(1, max_retries + 2):
+                batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+                outcomes = await asyncio.gather(
+                    *(self._run_batch([legs[j] for j in batch], execute_batch) for batch in batches)
+                )
+                retry = []
+                for batch, batch_outcomes in zip(batches, outcomes):
+                    for j, (outcome, latency) in zip(batch, batch_outcomes):
+                        result = {**legs[j], "status": "skipped", "order_id": None, "error": None}
+                        if isinstance(outcome, Exception):
+                            result["status"] = "failed"
+                            result["error"] = str(outcome)
+                            if IsRetryable(outcome):
+                                retry.append(j)
+                        elif outcome is not None:
+                            result["status"] = "submitted"
+                            result["order_id"] = outcome.get("id")
+                        result["latency"] = latency
+                        result["attempts"] = attempt
+                        group_results[j] = result
+                if not retry or attempt > max_retries:
+                    break
+                logger.warning(f"{name}: {len(retry)} 个订单可重试失败，第 {attempt} 次重发")
+                endpoint = "create_orders" if batch_size > 1 else "create_order"
+                self.metrics.retry(endpoint, "retryable_error", len(retry))
+                self.metrics.sleep(endpoint, "retry_backoff", RETRY_DELAY * attempt)
+                await asyncio.sleep(RETRY_DELAY * attempt)
+                pending = retry
+
+            failed = sum(r["status"] == "failed" for r in group_results)
+            logger.info(
+                f"{name}: {len(legs)} 个订单分 {-(-len(legs) // batch_size)} 批完成，失败 {failed} 个，"
+                f"用时 {time.monotonic() - start:.2f}s"
+            )
+            results.extend(group_results)
+        return results
+
+
+def SplitDependencyGroups(trade_plan: List[dict]) -> List[Tuple[str, List[dict]]]:
+    # 先平仓/减仓释放保证金，再开仓/加仓
+    return [
+        ("平仓/减仓", [trade for trade in trade_plan if trade["action"] in REDUCING_ACTIONS]),
+        ("开仓/加仓", [trade for trade in trade_plan if trade["action"] not in REDUCING_ACTIONS]),
+    ]
+
+
+def SummarizeResults(results: List[dict]) -> Dict[str, int]:
+    summary: Dict[str, int] = {}
+    for result in results:
+        summary[result["status"]] = summary.get(result["status"], 0) + 1
+    return summary
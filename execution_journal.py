@@ -0,0 +1,211 @@
+"""
+Append-only journal of rebalance plans, for safe resumption after a crash.
+
+Every plan gets an id from its target positions and signal date and one
+JSON-lines file journal_dir/<plan id>.jsonl. The legs are written with a client order id
+(sent as newClientOrderId) and their side quantity before / after the leg
+before any order goes out; the result of every leg is appended as soon as
+its dependency group is done, and a final "complete" record closes the
+plan. Lines are fsynced and never rewritten, a torn last line is skipped.
+
+Rerunning the same plan reconciles the unfinished legs against one bulk
+positions snapshot: a leg whose side already reached its planned quantity
+is done, the rest is resent with only the missing quantity, so a crash
+between sending and journaling never sends a leg twice. The result records
+(latency, attempts, fill) double as the execution latency record, see
+ReadJournal.
+
+Only the standard library is used for writing; ReadJournal returns pandas.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+logger = logging.getLogger("ExecutionJournal")
+
+JOURNAL_DIR = "executor_journal"
+# binance newClientOrderId 最长36个字符
+CLIENT_ORDER_ID_PREFIX = "rb"
+# 写进结果记录的字段
+RESULT_FIELDS = ("status", "order_id", "error", "latency", "attempts", "filled", "avg_price", "order_status")
+DONE_STATUSES = ("submitted",)
+
+
+def PlanId(target_positions: Dict[str, float], as_of: Optional[str] = None) -> str:
+    """
+    Stable id of a target book and the signal date it was generated for: the
+    same signal always maps to the same journal, while an unchanged book on a
+    later day is a new plan.
+    """
+    positions = sorted((s, round(float(q), 10)) for s, q in target_positions.items())
+    payload = json.dumps({"as_of": as_of, "positions": positions}, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def ClientOrderId(plan_id: str, index: int, attempt: int = 0) -> str:
+    # 重跑时补发的订单带上第几次，交易所和推送里都能对上原来的计划
+    base = f"{CLIENT_ORDER_ID_PREFIX}-{plan_id}-{index:03d}"
+    return base if attempt == 0 else f"{base}-{attempt}"
+
+
+def _LegAfter(leg: dict) -> float:
+    # 对冲模式：多仓 buy 加仓 sell 减仓，空仓反过来
+    opening = (leg['side'] == 'buy') == (leg['positionSide'] == 'LONG')
+    return leg['before'] + leg['quantity'] if opening else max(leg['before'] - leg['quantity'], 0.0)
+
+
+class RebalanceJournal:
+    """
+    Journal of one plan. legs {client order id: planned leg + before /
+    after}, results {client order id: latest result record}, attempt
+    (number of resumptions) and completed are replayed from the file.
+    """
+
+    def __init__(self, plan_id: str, journal_dir: str = JOURNAL_DIR):
+        self.plan_id = plan_id
+        self.path = os.path.join(journal_dir, f"{plan_id}.jsonl")
+        self.legs: Dict[str, dict] = {}
+        self.results: Dict[str, dict] = {}
+        self.attempt = 0
+        self.completed = False
+        if os.path.exists(self.path):
+            self._replay()
+
+    def _replay(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        for n, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 只有最后一行可能在崩溃时写了一半
+                logger.warning(f"{self.path} 第 {n + 1} 行不完整，跳过")
+                continue
+            if record['type'] == 'plan':
+                self.legs = {leg['client_order_id']: leg for leg in record['legs']}
+            elif record['type'] == 'resume':
+                self.attempt = record['attempt']
+            elif record['type'] == 'result':
+                self.results[record['client_order_id']] = record
+            elif record['type'] == 'complete':
+                self.completed = True
+
+    def _append(self, records: List[dict]) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps({**record, "ts": time.time()}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @property
+    def started(self) -> bool:
+        return bool(self.legs)
+
+    def write_plan(self, trade_plan: List[dict], positions: Dict[str, Dict[str, float]]) -> List[dict]:
+        """Give every leg a client order id and its side quantity before / after, and journal the plan."""
+        empty = {'LONG': 0.0, 'SHORT': 0.0}
+        legs = []
+        for i, trade in enumerate(trade_plan):
+            leg = {**trade, 'client_order_id': ClientOrderId(self.plan_id, i)}
+            leg['before'] = positions.get(leg['symbol'], empty)[leg['positionSide']]
+            leg['after'] = _LegAfter(leg)
+            legs.append(leg)
+        self._append([{"type": "plan", "plan_id": self.plan_id, "legs": legs}])
+        self.legs = {leg['client_order_id']: leg for leg in legs}
+        return legs
+
+    def resume(self, positions: Dict[str, Dict[str, float]], prices: Dict[str, float], steps: Dict[str, float]) -> List[dict]:
+        """
+        Legs still to send after comparing the journal with a fresh positions
+        snapshot. A leg with a "submitted" result or whose side already
+        reached its planned quantity is done (and journaled as reconciled);
+        otherwise the missing quantity (at most the planned one, rounded down
+        to the step) is resent under a new client order id.
+        """
+        self.attempt += 1
+        empty = {'LONG': 0.0, 'SHORT': 0.0}
+        pending, done, reconciled = [], 0, []
+        for i, (client_order_id, leg) in enumerate(self.legs.items()):
+            result = self.results.get(client_order_id)
+            if result is not None and result['status'] in DONE_STATUSES:
+                done += 1
+                continue
+            current = positions.get(leg['symbol'], empty)[leg['positionSide']]
+            opening = (leg['side'] == 'buy') == (leg['positionSide'] == 'LONG')
+            missing = leg['after'] - current if opening else current - leg['after']
+            step = steps.get(leg['symbol'], 1.0)
+            quantity = round(math.floor(min(missing, leg['quantity']) / step + 1e-9) * step, 10)
+            if quantity <= 0:
+                # 订单发出去了但结果没来得及写进日志
+                done += 1
+                reconciled.append({"type": "result", "client_order_id": client_order_id, "status": "submitted", "reconciled": True})
+                continue
+            price = prices.get(leg['symbol'], leg['price'])
+            pending.append({
+                **leg,
+                'quantity': quantity,
+                'notional': quantity * price,
+                'client_order_id': ClientOrderId(self.plan_id, i, self.attempt),
+                'planned_client_order_id': client_order_id,
+            })
+        for record in reconciled:
+            self.results[record['client_order_id']] = record
+        self._append(reconciled + [{
+            "type": "resume",
+            "attempt": self.attempt,
+            "legs": [{'client_order_id': leg['client_order_id'], 'quantity': leg['quantity']} for leg in pending],
+        }])
+        logger.info(f"恢复计划 {self.plan_id} 第 {self.attempt} 次: {done} 个订单已完成，补发 {len(pending)} 个")
+        return pending
+
+    def record(self, results: List[dict]) -> None:
+        """Append the result of every leg; resent legs are booked on their planned leg."""
+        records = []
+        for result in results:
+            client_order_id = result.get('planned_client_order_id') or result.get('client_order_id')
+            if client_order_id is None:
+                continue
+            record = {"type": "result", "client_order_id": client_order_id, "sent_as": result.get('client_order_id')}
+            record.update({field: result[field] for field in RESULT_FIELDS if field in result})
+            records.append(record)
+            self.results[client_order_id] = record
+        if records:
+            self._append(records)
+
+    def complete(self, summary: Optional[dict] = None) -> None:
+        """Close the plan when every leg is done; a rerun of it then sends nothing."""
+        if any(self.results.get(c, {}).get('status') not in DONE_STATUSES for c in self.legs):
+            return
+        self._append([{"type": "complete", "summary": summary or {}}])
+        self.completed = True
+
+
+def ReadJournal(path: str) -> pd.DataFrame:
+    """
+    One row per order sent (the latest result record of each client order
+    id), joined with its planned leg (symbol, action, side, quantity,
+    notional ...), in journal order.
+    """
+    legs, rows = {}, []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record['type'] == 'plan':
+                legs = {leg['client_order_id']: leg for leg in record['legs']}
+            elif record['type'] == 'result':
+                rows.append({**legs.get(record['client_order_id'], {}), **record})
+    frame = pd.DataFrame(rows)
+    if frame.empty:
+        return frame
+    # 推送确认后会再写一次同一订单的结果，以最后一次为准
+    return frame.drop_duplicates(["client_order_id", "sent_as"], keep="last").reset_index(drop=True)
@@ -1,4 +1,5 @@
 import ccxt
+import ccxt.async_support as ccxt_async
 import pandas as pd
 import numpy as np
 import time
@@ -7,9 +8,25 @@ import os
 import re
 import logging
 import math
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 
+from execution_engine import (
+    BATCH_SIZE,
+    MAX_CONCURRENCY,
+    AsyncOrderDispatcher,
+    OrderRejected,
+    SplitDependencyGroups,
+    SummarizeResults,
+)
+from execution_algo import ALGOS, DEFAULT_PARTICIPATION, SLICE_INTERVAL, SlicedExecutor, SliceCounts, SummarizeFills
+from executor_state import AccountConfig, ExecutorState
+from executor_stream import STREAM_URLS, FuturesStream
+from execution_journal import JOURNAL_DIR, PlanId, RebalanceJournal
+from exchange_metrics import METRICS_DIR, RunMetrics
+from rebalance_planner import DEFAULT_MIN_NOTIONAL, REDUCING_ACTIONS, MarketArrays, PlanRebalance, SummarizePlan
+from signal_artifact import ReadQuoteVolumes, ReadTargetPositions
+
 # 设置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -21,8 +38,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger("TradingExecutor")
 
+# 每日调仓的执行方式，默认全部市价单；设 EXECUTION_ALGO=pov / twap 或 --algo 才把大订单切片（见 execution_algo）
+EXECUTION_ALGO = os.environ.get("EXECUTION_ALGO", "market")
+# True 时用 WebSocket 推送的标记价格、持仓和订单状态代替 REST 查询（见 executor_stream）
+STREAMING = False
+
 class LogSignalReader:
-    """读取交易日志文件的类"""
+    """读取交易日志文件的类（执行器改为读取 signal_artifact 的目标持仓文件，这里只用于查看旧日志）"""
     
     def __init__(self, log_dir: str = "trading_logs"):
         self.log_dir = log_dir
@@ -138,17 +160,17 @@ class BinanceFuturesExecutor:
                 'testnet': is_test
             }
         })
+        self.api_key = api_key
+        self.api_secret = api_secret
         
-        # 设置为对冲模式
-        try:
-            # 使用标准的 CCXT 方法设置对冲模式
-            self.exchange.fapiPrivatePostPositionSideDual({'dualSidePosition': 'true'})
-            logger.info("成功设置为对冲模式")
-        except Exception as e:
-            logger.warning(f"设置对冲模式失败（可能已经是对冲模式）: {e}")
+        # 对冲模式和杠杆在每次调仓开始时按本地缓存检查，只有不一致时才发修改请求
+        self.config = AccountConfig(api_key)
             
         self.positions = {}  # 当前持仓
+        self.state = ExecutorState()  # 每次调仓开始时批量加载的账户快照
         self.is_test = is_test
+        self.stream_url = STREAM_URLS[is_test]
+        self.metrics: Optional[RunMetrics] = None  # 最近一次调仓的请求耗时和 weight
         logger.info(f"{'测试网络' if is_test else '实盘'} 交易执行器初始化完成")
 
     def get_account_balance(self) -> float:
@@ -310,6 +332,272 @@ class BinanceFuturesExecutor:
             logger.error(f"下单失败 {formatted_symbol} {side} {quantity}: {e}")
             return None
         
+    def create_async_exchange(self):
+        """和 self.exchange 相同配置的 ccxt 异步客户端；限速由 execution_engine 按 weight 控制"""
+        return ccxt_async.binance({
+            'apiKey': self.api_key,
+            'secret': self.api_secret,
+            'enableRateLimit': False,
+            'options': {
+                'defaultType': 'future',
+                'adjustForTimeDifference': True,
+                'testnet': self.is_test
+            }
+        })
+
+    async def place_order_async(self, dispatcher: AsyncOrderDispatcher, symbol: str, side: str, quantity: float, params: dict):
+        """
+        place_order 的异步版本，params 里必须带 positionSide。数量已经由 PlanRebalance
+        按步长、最小数量和最小名义价值算好，这里直接下单，成交后更新快照里的持仓。
+        """
+        formatted_symbol = self.format_symbol_for_binance(symbol)
+
+        order = await dispatcher.call(
+            "create_order", symbol=formatted_symbol, type='MARKET', side=side, amount=quantity, params=params
+        )
+        logger.info(f"订单执行成功: {formatted_symbol} {side} {quantity} ({params['positionSide']})")
+        # 市价单默认只返回 ACK，filled 为空时按下单数量记
+        self.state.apply_fill(formatted_symbol, side, params['positionSide'], float(order.get('filled') or quantity))
+        return order
+
+    def order_params(self, trade: dict) -> dict:
+        """下单参数：positionSide，日志里计划的订单带上 newClientOrderId"""
+        params = {'positionSide': trade['positionSide']}
+        if trade.get('client_order_id'):
+            params['newClientOrderId'] = trade['client_order_id']
+        return params
+
+    async def execute_leg_async(self, dispatcher: AsyncOrderDispatcher, trade: dict):
+        return await self.place_order_async(
+            dispatcher,
+            symbol=trade['symbol'],
+            side=trade['side'],
+            quantity=trade['quantity'],
+            params=self.order_params(trade)
+        )
+
+    async def execute_batch_async(self, dispatcher: AsyncOrderDispatcher, trades: List[dict]) -> list:
+        """
+        用一个 batchOrders 请求发送最多5个市价单，返回和 trades 对齐的结果：
+        订单，或者该订单被拒绝的 OrderRejected。只有一个订单时直接用 create_order。
+        """
+        if len(trades) == 1:
+            return [await self.execute_leg_async(dispatcher, trades[0])]
+
+        orders = [
+            {
+                'symbol': self.format_symbol_for_binance(trade['symbol']),
+                'type': 'MARKET',
+                'side': trade['side'],
+                'amount': trade['quantity'],
+                'params': self.order_params(trade),
+            }
+            for trade in trades
+        ]
+        responses = await dispatcher.call("create_orders", orders)
+
+        # batchOrders 按请求顺序返回，被拒绝的订单位置上是 {"code": ..., "msg": ...}
+        outcomes = []
+        for request, order in zip(orders, responses):
+            info = order.get('info') or {}
+            if 'code' in info and not info.get('orderId'):
+                outcomes.append(OrderRejected(int(info['code']), info.get('msg', '')))
+                continue
+            logger.info(f"订单执行成功: {request['symbol']} {request['side']} {request['amount']} ({request['params']['positionSide']})")
+            self.state.apply_fill(
+                request['symbol'], request['side'], request['params']['positionSide'], float(order.get('filled') or request['amount'])
+            )
+            outcomes.append(order)
+        return outcomes
+
+    async def rebalance_async(
+        self,
+        target_positions: Dict[str, float],
+        leverage: int = 1,
+        max_concurrency: int = MAX_CONCURRENCY,
+        notional_band: float = DEFAULT_MIN_NOTIONAL,
+        turnover_band: float = 0.0,
+        dry_run: bool = False,
+        batch_size: int = BATCH_SIZE,
+        algo: str = "market",
+        quote_volumes: Optional[Dict[str, float]] = None,
+        participation: float = DEFAULT_PARTICIPATION,
+        slice_interval: float = SLICE_INTERVAL,
+        post_only: bool = True,
+        streaming: bool = False,
+        journal_dir: Optional[str] = JOURNAL_DIR,
+        metrics_dir: Optional[str] = METRICS_DIR,
+        as_of: Optional[str] = None,
+    ) -> List[dict]:
+        """
+        批量加载账户快照和账户设置，按快照生成交易计划，只给杠杆不一致的开仓/加仓交易对设置杠杆，
+        按依赖分组（先平仓/减仓后开仓/加仓）每 batch_size 个订单一个 batchOrders 请求并发发送，
+        可重试的失败只重发失败的订单，最终失败的交易对重新同步。返回每个订单的执行结果；
+        dry_run 时只返回交易计划（含预期成本），不下单。
+        algo 为 twap / pov 时，相对成交额较大的订单由 SlicedExecutor 切片执行，同组的其他订单照常批量发送。
+        streaming 时先连上用户数据流和标记价格流，标记价格和成交后的持仓都来自推送，
+        订单的成交由 ORDER_TRADE_UPDATE 确认，只有没确认到的交易对才用 REST 重新同步。
+        journal_dir 不为 None 时，计划和每组的结果写进 execution_journal；同一信号（目标持仓 + as_of 信号日期）
+        的计划没执行完就重跑时，按快照里的持仓对账，只补发缺少的数量，已经执行完的计划不再下单。
+        每个请求的耗时、重试、等待和 weight 记在 self.metrics，metrics_dir 不为 None 时写成 Prometheus 文本文件。
+        """
+        exchange = self.create_async_exchange()
+        stream = None
+        self.metrics = RunMetrics("executor")
+        try:
+            dispatcher = AsyncOrderDispatcher(exchange, max_concurrency=max_concurrency, metrics=self.metrics)
+            if streaming and not dry_run:
+                # 先连上数据流再读快照，快照之后的持仓变化都会推送过来
+                try:
+                    stream = await FuturesStream(self.state, self.stream_url).start(dispatcher)
+                except Exception as e:
+                    logger.warning(f"连接数据流失败，改用 REST 查询: {e}")
+            if stream is not None:
+                prices_pushed, _, _ = await asyncio.gather(
+                    stream.wait_prices(), self.state.load(dispatcher, mark_prices=False), self.config.load(dispatcher)
+                )
+                if not prices_pushed:
+                    logger.warning("没有收到标记价格推送，改用 premiumIndex")
+                    await self.state.refresh_mark_prices(dispatcher)
+            elif dry_run:
+                await self.state.load(dispatcher)
+            else:
+                await asyncio.gather(self.state.load(dispatcher), self.config.load(dispatcher))
+            if self.state.balance <= 0 and not dry_run:
+                logger.error(f"账户余额不足: {self.state.balance} USDT")
+                return []
+
+            journal = None
+            if journal_dir is not None and not dry_run:
+                journal = RebalanceJournal(
+                    PlanId({self.format_symbol_for_binance(s): q for s, q in target_positions.items()}, as_of), journal_dir
+                )
+            if journal is not None and journal.completed:
+                logger.info(f"计划 {journal.plan_id} 已经执行完成，不再下单")
+                return []
+            if journal is not None and journal.started:
+                # 上次执行中断：按刚读的持仓对账，只补发还没成交的部分
+                symbols = [leg['symbol'] for leg in journal.legs.values()]
+                step, _, _ = MarketArrays(self.state.markets, symbols)
+                trade_plan = journal.resume(self.state.positions, self.state.mark_prices, dict(zip(symbols, step)))
+            else:
+                trade_plan = self.build_trade_plan(target_positions, notional_band=notional_band, turnover_band=turnover_band)
+                if journal is not None:
+                    trade_plan = journal.write_plan(trade_plan, self.state.positions)
+            logger.info(f"交易计划包含 {len(trade_plan)} 个订单: {SummarizePlan(trade_plan)}")
+            for trade in trade_plan:
+                logger.info(f"准备执行: {trade['symbol']} {trade['action']} {trade['side']} {trade['quantity']} ({trade['positionSide']})")
+            if dry_run:
+                return trade_plan
+
+            await self.config.ensure_hedge_mode(dispatcher)
+            # 平仓/减仓单不需要杠杆
+            await self.config.ensure_leverage(
+                dispatcher, [trade['symbol'] for trade in trade_plan if trade['action'] not in REDUCING_ACTIONS], leverage
+            )
+
+            sliced = SlicedExecutor(dispatcher, self.state, interval=slice_interval, post_only=post_only)
+            results = []
+            for name, legs in SplitDependencyGroups(trade_plan):
+                if algo == "market":
+                    group_results = await dispatcher.run_batched_groups(
+                        [(name, legs)], self.execute_batch_async, batch_size=batch_size
+                    )
+                else:
+                    group_results = await self.run_sliced_groups(
+                        dispatcher, sliced, legs, algo, quote_volumes or {}, participation, batch_size
+                    )
+                # 每组执行完马上写日志，中断后重跑时这些订单不会重发
+                if journal is not None:
+                    journal.record(group_results)
+                results.extend(group_results)
+            failed = [self.format_symbol_for_binance(r['symbol']) for r in results if r['status'] == 'failed']
+            if stream is not None:
+                failed += await self.confirm_fills(stream, results)
+                if journal is not None:
+                    # 推送确认后的成交状态（partial / failed）覆盖下单时的结果
+                    journal.record([r for r in results if 'order_status' in r])
+            if journal is not None:
+                journal.complete(SummarizeResults(results))
+            if failed:
+                try:
+                    await self.state.resync(dispatcher, failed)
+                except Exception as e:
+                    logger.warning(f"重新同步持仓失败: {e}")
+            return results
+        finally:
+            if stream is not None:
+                await stream.stop(dispatcher)
+            await exchange.close()
+            if metrics_dir is not None and not dry_run:
+                try:
+                    self.metrics.write(metrics_dir)
+                except OSError as e:
+                    logger.warning(f"写入请求指标失败: {e}")
+
+    async def confirm_fills(self, stream: FuturesStream, results: List[dict]) -> List[str]:
+        """
+        等已提交订单的终态推送，把市价单的成交数量、均价和订单状态写回结果，
+        没有成交的改为 failed、部分成交的改为 partial。返回没等到推送的交易对，由调用方用 REST 重新同步。
+        """
+        submitted = [r for r in results if r['status'] in ('submitted', 'partial') and r['order_id'] is not None]
+        updates = await stream.wait_orders([r['order_id'] for r in submitted])
+        unconfirmed = []
+        for result in submitted:
+            update = updates.get(str(result['order_id']))
+            if update is None:
+                unconfirmed.append(self.format_symbol_for_binance(result['symbol']))
+                continue
+            result['order_status'] = update['status']
+            # 切片订单的 order_id 只是最后一片，成交数量和均价以切片执行的统计为准
+            if 'slices' in result:
+                continue
+            result['filled'] = update['filled']
+            result['avg_price'] = update['avg_price']
+            if update['filled'] <= 0:
+                result['status'] = 'failed'
+                result['error'] = f"订单 {update['status']}，没有成交"
+            elif update['filled'] < result['quantity'] - 1e-9:
+                result['status'] = 'partial'
+        logger.info(f"推送确认 {len(updates)}/{len(submitted)} 个订单的成交，{len(unconfirmed)} 个需要重新同步")
+        return unconfirmed
+
+    async def run_sliced_groups(
+        self,
+        dispatcher: AsyncOrderDispatcher,
+        sliced: SlicedExecutor,
+        trade_plan: List[dict],
+        algo: str,
+        quote_volumes: Dict[str, float],
+        participation: float,
+        batch_size: int = BATCH_SIZE,
+    ) -> List[dict]:
+        """按依赖分组执行：组内需要切片的订单交给 SlicedExecutor，其余订单批量发送，两者并发"""
+        symbols = [trade['symbol'] for trade in trade_plan]
+        step, _, min_notional = MarketArrays(self.state.markets, symbols)
+        counts = SliceCounts(
+            [trade['notional'] for trade in trade_plan],
+            [quote_volumes.get(symbol, np.nan) for symbol in symbols],
+            min_notional,
+            algo=algo,
+            participation=participation,
+            interval=sliced.interval,
+        )
+        index = {id(trade): i for i, trade in enumerate(trade_plan)}
+
+        results = []
+        for name, legs in SplitDependencyGroups(trade_plan):
+            to_slice = [leg for leg in legs if counts[index[id(leg)]] > 1]
+            to_batch = [leg for leg in legs if counts[index[id(leg)]] == 1]
+            batch_results, slice_results = await asyncio.gather(
+                dispatcher.run_batched_groups([(name, to_batch)], self.execute_batch_async, batch_size=batch_size),
+                sliced.run(
+                    to_slice, [counts[index[id(leg)]] for leg in to_slice], [step[index[id(leg)]] for leg in to_slice]
+                ),
+            )
+            results.extend(batch_results + slice_results)
+        return results
+
     # def set_leverage(self, symbol: str, leverage: int = 1):
     #     """设置特定交易对的杠杆倍数"""
     #     try:
@@ -431,168 +719,121 @@ class BinanceFuturesExecutor:
             
     #     except Exception as e:
     #         logger.error(f"执行交易失败: {e}")
-    def execute_trades(self, target_positions: Dict[str, float], leverage: int = 1):
+    def build_trade_plan(
+        self, target_positions: Dict[str, float], notional_band: float = DEFAULT_MIN_NOTIONAL, turnover_band: float = 0.0
+    ) -> List[dict]:
+        """把账户快照和目标持仓对齐成数组，用 PlanRebalance 一次算出所有订单"""
+        targets = {}
+        for symbol, quantity in target_positions.items():
+            targets[self.format_symbol_for_binance(symbol)] = float(quantity)
+        symbols = sorted(set(targets) | set(self.state.held_symbols()))
+
+        empty = {'LONG': 0.0, 'SHORT': 0.0}
+        step, min_qty, min_notional = MarketArrays(self.state.markets, symbols)
+        return PlanRebalance(
+            symbols,
+            current_long=np.array([self.state.positions.get(s, empty)['LONG'] for s in symbols]),
+            current_short=np.array([self.state.positions.get(s, empty)['SHORT'] for s in symbols]),
+            target=np.array([targets.get(s, 0.0) for s in symbols]),
+            prices=np.array([self.state.mark_prices.get(s, np.nan) for s in symbols]),
+            step=step,
+            min_qty=min_qty,
+            min_notional=min_notional,
+            notional_band=notional_band,
+            turnover_band=turnover_band,
+        )
+
+    def execute_trades(
+        self,
+        target_positions: Dict[str, float],
+        leverage: int = 1,
+        max_concurrency: int = MAX_CONCURRENCY,
+        notional_band: float = DEFAULT_MIN_NOTIONAL,
+        turnover_band: float = 0.0,
+        dry_run: bool = False,
+        algo: str = "market",
+        quote_volumes: Optional[Dict[str, float]] = None,
+        participation: float = DEFAULT_PARTICIPATION,
+        slice_interval: float = SLICE_INTERVAL,
+        post_only: bool = True,
+        batch_size: int = BATCH_SIZE,
+        streaming: bool = False,
+        journal_dir: Optional[str] = JOURNAL_DIR,
+        metrics_dir: Optional[str] = METRICS_DIR,
+        as_of: Optional[str] = None,
+    ):
         """
         执行交易
         
         Args:
             target_positions: 目标持仓量 {symbol: quantity}
             leverage: 杠杆倍数,默认为1倍
+            max_concurrency: 同一组（平仓 / 开仓）里同时在途的订单数
+            notional_band: 名义价值小于这个值（USDT）的调整不做，整个方向的开仓/平仓不受限制
+            turnover_band: 调整量小于该方向持仓价值这个比例的不做
+            dry_run: 只生成交易计划（含预期成本），不下单
+            algo: market 全部市价单；twap / pov 把大订单切片执行（见 execution_algo）
+            quote_volumes: {symbol: 近期日均成交额}，pov 按它决定切片数
+            participation: pov 每片不超过该时间段预期成交额的比例
+            slice_interval: 切片之间的间隔（秒）
+            post_only: 切片先挂 post-only 限价单，没成交的部分撤单后市价成交
+            batch_size: 每个 batchOrders 请求的订单数（1 为逐个下单）
+            streaming: 用 WebSocket 推送的标记价格、持仓和订单状态代替 REST 查询
+            journal_dir: 执行日志目录（None 不写）；同一目标持仓中断后重跑只补发缺少的订单
+            metrics_dir: 每次运行的请求耗时 / 重试 / weight 指标文件目录（None 不写）
+            as_of: 目标持仓的信号日期，和目标持仓一起决定执行日志的计划 id，相同持仓的不同日期是不同的计划
+        
+        Returns:
+            每个订单的执行结果列表（status / order_id / error / latency）；执行后的持仓在 self.state 里。
+            dry_run 时返回交易计划
         """
         try:
-            # 获取当前持仓
-            positions = self.exchange.fetch_positions()
-            current_positions = {}
-            
-            # 整理当前持仓信息，分别记录多空仓位
-            for pos in positions:
-                if abs(float(pos['contracts'])) > 0:
-                    # symbol = pos['symbol']
-                    symbol = self.format_symbol_for_binance(pos['symbol'])
-                    if symbol not in current_positions:
-                        current_positions[symbol] = {'LONG': 0, 'SHORT': 0}
-                    position_side = pos['info']['positionSide']  # 获取具体的持仓方向
-                    current_positions[symbol][position_side] = float(pos['contracts'])
-            
-            # 创建交易计划
-            trade_plan = []
-            
-            # 1. 首先处理需要清仓的币种
-            for symbol, positions_info in current_positions.items():
-                if symbol not in target_positions:
-                    # 需要清仓，检查多空仓位
-                    if positions_info['LONG'] > 0:
-                        # 平多仓
-                        trade_plan.append({
-                            'symbol': symbol,
-                            'side': 'sell',
-                            'quantity': positions_info['LONG'],
-                            'positionSide': 'LONG',
-                            'action': 'close'
-                        })
-                    
-                    if positions_info['SHORT'] > 0:
-                        # 平空仓
-                        trade_plan.append({
-                            'symbol': symbol,
-                            'side': 'buy',
-                            'quantity': positions_info['SHORT'],
-                            'positionSide': 'SHORT',
-                            'action': 'close'
-                        })
-            
-            # 2. 处理需要调整的仓位
-            for symbol, target_qty in target_positions.items():
-                formatted_symbol = self.format_symbol_for_binance(symbol)
-                current_info = current_positions.get(formatted_symbol, {'LONG': 0, 'SHORT': 0})
-                
-                if target_qty > 0:  # 目标是多仓
-                    # 如果有空仓，先平掉
-                    if current_info['SHORT'] > 0:
-                        trade_plan.append({
-                            'symbol': symbol,
-                            'side': 'buy',
-                            'quantity': current_info['SHORT'],
-                            'positionSide': 'SHORT',
-                            'action': 'close'
-                        })
-                    
-                    # 调整多仓数量
-                    qty_diff = target_qty - current_info['LONG']
-                    logger.info(f"调整多仓数量: {symbol} diff: {qty_diff}")
-                    if abs(qty_diff) > 1:
-                        trade_plan.append({
-                            'symbol': symbol,
-                            'side': 'buy' if qty_diff > 0 else 'sell',
-                            'quantity': abs(qty_diff),
-                            'positionSide': 'LONG',
-                            'action': 'adjust'
-                        })
-                        
-                elif target_qty < 0:  # 目标是空仓
-                    # 如果有多仓，先平掉
-                    if current_info['LONG'] > 0:
-                        trade_plan.append({
-                            'symbol': symbol,
-                            'side': 'sell',
-                            'quantity': current_info['LONG'],
-                            'positionSide': 'LONG',
-                            'action': 'close'
-                        })
-                    
-                    # 调整空仓数量
-                    qty_diff = abs(target_qty) - current_info['SHORT']
-                    logger.info(f"调整空仓数量: {symbol} diff: {qty_diff}")
-                    if abs(qty_diff) > 1:
-                        trade_plan.append({
-                            'symbol': symbol,
-                            'side': 'sell' if qty_diff > 0 else 'buy',
-                            'quantity': abs(qty_diff),
-                            'positionSide': 'SHORT',
-                            'action': 'adjust'
-                        })
-                
-                else:  # target_qty == 0，需要清仓
-                    if current_info['LONG'] > 0:
-                        trade_plan.append({
-                            'symbol': symbol,
-                            'side': 'sell',
-                            'quantity': current_info['LONG'],
-                            'positionSide': 'LONG',
-                            'action': 'close'
-                        })
-                    if current_info['SHORT'] > 0:
-                        trade_plan.append({
-                            'symbol': symbol,
-                            'side': 'buy',
-                            
-                            'quantity': current_info['SHORT'],
-                            'positionSide': 'SHORT',
-                            'action': 'close'
-                        })
-            
-            # 执行交易计划
-            logger.info(f"交易计划包含 {len(trade_plan)} 个订单")
-            
-            for trade in trade_plan:
-                symbol = trade['symbol']
-                logger.info(f"准备执行: {symbol} {trade['action']} {trade['side']} {trade['quantity']} ({trade['positionSide']})")
-                
-                try:
-                    self.set_leverage(symbol, leverage=1)
-                except Exception as e:
-                    logger.warning(f"设置杠杆失败，继续使用默认杠杆: {e}")
-                
-                # 执行订单
-                result = self.place_order(
-                    symbol=symbol,
-                    side=trade['side'],
-                    quantity=trade['quantity'],
-                    params={'positionSide': trade['positionSide']}
-                )
-                
-                # 避免触发API限制
-                time.sleep(0.5)
-            
-            logger.info("所有交易执行完成")
+            # 持仓、标记价格、余额、合约信息各批量取一次，之后按快照计划和下单
+            results = asyncio.run(self.rebalance_async(
+                target_positions,
+                leverage=leverage,
+                max_concurrency=max_concurrency,
+                notional_band=notional_band,
+                turnover_band=turnover_band,
+                dry_run=dry_run,
+                algo=algo,
+                quote_volumes=quote_volumes,
+                participation=participation,
+                slice_interval=slice_interval,
+                post_only=post_only,
+                batch_size=batch_size,
+                streaming=streaming,
+                journal_dir=journal_dir,
+                metrics_dir=metrics_dir,
+                as_of=as_of,
+            ))
+            if dry_run:
+                return results
+            for result in results:
+                if result['status'] == 'failed':
+                    logger.error(f"下单失败 {result['symbol']} {result['side']} {result['quantity']}: {result['error']}")
+            
+            logger.info(f"所有交易执行完成: {SummarizeResults(results)}")
+            if algo != "market":
+                logger.info(f"切片执行成交情况: {SummarizeFills(results)}")
+            return results
             
         except Exception as e:
             logger.error(f"执行交易失败: {e}")
+            return []
         
-def run_daily_trade():
-    """执行每日交易"""
+def run_daily_trade(algo: str = EXECUTION_ALGO):
+    """执行每日交易，algo 为 market / twap / pov"""
     try:
         logger.info("=== 开始每日交易执行 ===")
         
-        # 1. 读取最新交易信号
-        signal_reader = LogSignalReader()
-        latest_log = signal_reader.get_latest_log_file()
-        
-        if not latest_log:
-            logger.error("未找到日志文件，无法执行交易")
+        # 1. 读取最新交易信号（daily_pipeline 写的目标持仓文件，trading_logs 里的日志只给人看）
+        try:
+            target_positions, backtest_date = ReadTargetPositions()
+        except (FileNotFoundError, ValueError) as e:
+            logger.error(f"读取目标持仓失败，无法执行交易: {e}")
             return
-        
-        target_positions, backtest_date = signal_reader.parse_log_file(latest_log)
+        logger.info(f"读取到 {backtest_date} 的 {len(target_positions)} 个持仓信号")
         
         if not target_positions:
             logger.error("未能解析出有效的交易信号，无法执行交易")
@@ -635,17 +876,17 @@ def run_daily_trade():
             is_test=False  # 不使用测试网络
         )
         
-        # 3. 获取账户余额
-        balance = executor.get_account_balance()
-        if balance <= 0:
-            logger.error(f"账户余额不足: {balance} USDT")
-            return
-        
-        # 4. 执行交易
-        executor.execute_trades(target_positions)
+        # 3. 执行交易（账户余额在执行前的账户快照里检查）
+        executor.execute_trades(
+            target_positions,
+            algo=algo,
+            quote_volumes=ReadQuoteVolumes(),
+            streaming=STREAMING,
+            as_of=backtest_date,
+        )
         
-        # 5. 打印交易后的持仓情况
-        final_positions = executor.get_current_positions()
+        # 4. 打印交易后的持仓情况（按成交或推送更新过的快照，不再重新查询）
+        final_positions = executor.state.net_positions()
         logger.info("=== 交易后持仓情况 ===")
         for symbol, qty in final_positions.items():
             logger.info(f"{symbol}: {qty}")
@@ -656,4 +897,10 @@ def run_daily_trade():
         logger.error(f"执行每日交易时发生错误: {e}")
 
 if __name__ == "__main__":
-    run_daily_trade()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description='执行每日调仓')
+    parser.add_argument('--algo', choices=ALGOS, default=EXECUTION_ALGO, help='执行方式，默认 market（或环境变量 EXECUTION_ALGO）')
+    args = parser.parse_args()
+
+    run_daily_trade(algo=args.algo)
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+Account snapshot for BinanceFuturesExecutor.
+
+Positions, mark prices, the USDT balance and the market metadata are loaded
+once per rebalance in a handful of bulk calls (positionRisk, premiumIndex,
+balance, exchangeInfo); every leg is planned and sized from the snapshot,
+which is updated locally from the fills. Only the symbols of failed orders
+are re-synced from the exchange. With executor_stream.FuturesStream running
+(live), mark prices and positions are pushed by the exchange instead.
+
+The per-symbol leverage and the position mode change rarely; AccountConfig
+keeps them in a local cache file and only sends a change request for a
+symbol whose setting differs from the target.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger("ExecutorState")
+
+ACCOUNT_CONFIG_DIR = "executor_cache"
+# 本地缓存超过这个时间就重新从交易所批量读取一次
+ACCOUNT_CONFIG_MAX_AGE = 24 * 3600
+
+
+class ExecutorState:
+    """
+    Snapshot keyed by binance market id (BTCUSDT):
+    positions {id: {'LONG': qty, 'SHORT': qty}} (both sides >= 0, hedge mode),
+    mark_prices {id: price}, markets {id: ccxt linear swap market}, balance
+    (free USDT). While live, a FuturesStream updates positions and mark
+    prices and apply_fill does nothing.
+    """
+
+    def __init__(self):
+        self.positions: Dict[str, Dict[str, float]] = {}
+        self.mark_prices: Dict[str, float] = {}
+        self.markets: Dict[str, dict] = {}
+        self.balance = 0.0
+        self.loaded_at: Optional[float] = None
+        self.live = False
+
+    def _update_positions(self, positions: List[dict]) -> None:
+        for pos in positions:
+            position_side = pos['info'].get('positionSide')
+            if position_side not in ('LONG', 'SHORT'):
+                continue
+            sides = self.positions.setdefault(pos['info']['symbol'], {'LONG': 0.0, 'SHORT': 0.0})
+            sides[position_side] = abs(float(pos['contracts'] or 0))
+
+    def _update_mark_prices(self, premium_index: List[dict]) -> None:
+        for item in premium_index:
+            self.mark_prices[item['symbol']] = float(item['markPrice'])
+
+    async def load(self, dispatcher, mark_prices: bool = True) -> "ExecutorState":
+        """
+        Bulk-load the whole account through an AsyncOrderDispatcher;
+        mark_prices=False keeps the mark prices pushed by a stream.
+        """
+        exchange = dispatcher.exchange
+        if not exchange.markets:
+            await dispatcher.call("load_markets")
+        requests = [dispatcher.call("fetch_positions"), dispatcher.call("fetch_balance")]
+        if mark_prices:
+            requests.append(dispatcher.call("fapiPublicGetPremiumIndex"))
+        positions, balance, *premium_index = await asyncio.gather(*requests)
+
+        self.markets = {m['id']: m for m in exchange.markets.values() if m.get('swap') and m.get('linear')}
+        self.positions = {}
+        self._update_positions(positions)
+        if mark_prices:
+            self.mark_prices = {}
+            self._update_mark_prices(premium_index[0])
+        self.balance = float(balance['USDT']['free'])
+        self.loaded_at = time.time()
+        logger.info(
+            f"账户快照: {len(self.held_symbols())} 个持仓, {len(self.mark_prices)} 个标记价格, 可用USDT {self.balance:.2f}"
+        )
+        return self
+
+    async def refresh_mark_prices(self, dispatcher) -> None:
+        self._update_mark_prices(await dispatcher.call("fapiPublicGetPremiumIndex"))
+
+    async def resync(self, dispatcher, symbols: List[str]) -> None:
+        """Re-fetch positions and mark prices of the given market ids, e.g. after their orders failed."""
+        symbols = sorted(set(symbols))
+        if not symbols:
+            return
+        unified = [self.markets[s]['symbol'] for s in symbols if s in self.markets]
+        positions, premium_index = await asyncio.gather(
+            dispatcher.call("fetch_positions", unified),
+            dispatcher.call("fapiPublicGetPremiumIndex"),
+        )
+        for symbol in symbols:
+            self.positions.pop(symbol, None)
+        self._update_positions([pos for pos in positions if pos['info']['symbol'] in symbols])
+        self._update_mark_prices(premium_index)
+        logger.info(f"重新同步 {len(symbols)} 个交易对: {symbols}")
+
+    def apply_fill(self, symbol: str, side: str, position_side: str, quantity: float) -> None:
+        if self.live:
+            # ACCOUNT_UPDATE 推送的是最新持仓，再本地累加会重复记账
+            return
+        # 对冲模式：多仓 buy 加仓 sell 减仓，空仓 sell 加仓 buy 减仓
+        sides = self.positions.setdefault(symbol, {'LONG': 0.0, 'SHORT': 0.0})
+        opening = (side == 'buy') == (position_side == 'LONG')
+        sides[position_side] = max(sides[position_side] + (quantity if opening else -quantity), 0.0)
+
+    def held_symbols(self) -> List[str]:
+        return [s for s, sides in self.positions.items() if sides['LONG'] > 0 or sides['SHORT'] > 0]
+
+    def net_positions(self) -> Dict[str, float]:
+        """{id: long - short} of the symbols with a position."""
+        return {s: self.positions[s]['LONG'] - self.positions[s]['SHORT'] for s in self.held_symbols()}
+
+
+class AccountConfig:
+    """
+    Position mode and per-symbol leverage of one account, cached in
+    config_dir/account_config_<hash of api key>.json.
+
+    load() reads the cache, or, when it is missing or older than max_age,
+    reads symbolConfig (leverage of every symbol) and positionSide/dual in
+    two calls and rewrites it. ensure_hedge_mode / ensure_leverage only
+    call the exchange when the cached value differs and then update the
+    cache; a failed change drops the symbol so the next run reads it again.
+    """
+
+    def __init__(self, api_key: str, config_dir: str = ACCOUNT_CONFIG_DIR, max_age: float = ACCOUNT_CONFIG_MAX_AGE):
+        account = hashlib.sha1(api_key.encode("utf-8")).hexdigest()[:12]
+        self.path = os.path.join(config_dir, f"account_config_{account}.json")
+        self.max_age = max_age
+        self.dual_side_position: Optional[bool] = None
+        self.leverage: Dict[str, int] = {}
+        self.updated_at = 0.0
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        payload = {"dual_side_position": self.dual_side_position, "leverage": self.leverage, "updated_at": self.updated_at}
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+
+    async def load(self, dispatcher) -> "AccountConfig":
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if time.time() - cached["updated_at"] < self.max_age:
+                self.dual_side_position = cached["dual_side_position"]
+                self.leverage = cached["leverage"]
+                self.updated_at = cached["updated_at"]
+                return self
+
+        symbol_config, position_mode = await asyncio.gather(
+            dispatcher.call("fapiPrivateGetSymbolConfig"),
+            dispatcher.call("fapiPrivateGetPositionSideDual"),
+        )
+        self.leverage = {item['symbol']: int(item['leverage']) for item in symbol_config}
+        self.dual_side_position = position_mode['dualSidePosition'] in (True, 'true')
+        self.updated_at = time.time()
+        self._save()
+        logger.info(f"读取账户设置: {len(self.leverage)} 个交易对的杠杆, 对冲模式 {self.dual_side_position}")
+        return self
+
+    async def ensure_hedge_mode(self, dispatcher) -> None:
+        if self.dual_side_position:
+            return
+        try:
+            await dispatcher.call("fapiPrivatePostPositionSideDual", {'dualSidePosition': 'true'})
+        except Exception as e:
+            # -4059 No need to change position side：本来就是对冲模式，只是缓存过期了
+            if "-4059" not in str(e):
+                raise
+        self.dual_side_position = True
+        self._save()
+        logger.info("成功设置为对冲模式")
+
+    async def ensure_leverage(self, dispatcher, symbols: Iterable[str], leverage: int) -> None:
+        """Set `leverage` on the market ids whose cached leverage differs, concurrently."""
+        symbols = sorted({s for s in symbols if self.leverage.get(s) != leverage})
+        if not symbols:
+            return
+        results = await asyncio.gather(
+            *(dispatcher.call("set_leverage", leverage, symbol) for symbol in symbols), return_exceptions=True
+        )
+        for symbol, result in zip(symbols, results):
+            if isinstance(result, Exception):
+                self.leverage.pop(symbol, None)
+                logger.warning(f"为 {symbol} 设置杠杆倍数 {leverage}x 失败，继续使用当前杠杆: {result}")
+            else:
+                self.leverage[symbol] = leverage
+        self._save()
+        logger.info(f"{len(symbols)} 个交易对的杠杆需要改为 {leverage}x")
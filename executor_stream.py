@@ -0,0 +1,224 @@
+"""
+User-data and mark-price WebSocket streams for BinanceFuturesExecutor.
+
+FuturesStream opens one combined connection to the user-data stream of the
+account (listenKey) and the all-market mark-price stream, and applies the
+events to the ExecutorState snapshot: markPriceUpdate refreshes the mark
+prices every second, ACCOUNT_UPDATE overwrites the positions of the symbols
+that changed, ORDER_TRADE_UPDATE records the status, filled quantity and
+average price of every order. An order is settled once it has a final
+status and, if anything filled, an ACCOUNT_UPDATE of its symbol arrived
+after its first update, so the pushed positions include it. While the
+stream is live the snapshot is the exchange's own view: planning needs no
+premiumIndex call and fills are confirmed without polling orders or
+positions.
+
+Only aiohttp (a ccxt dependency) is used; mock_exchange.MockStreamServer is
+a local stand-in of the stream endpoint.
+"""
+import asyncio
+import json
+import logging
+from collections import Counter
+from typing import Dict, List, Optional
+
+import aiohttp
+
+logger = logging.getLogger("ExecutorStream")
+
+# U本位合约 WebSocket 地址，key 为 is_test
+STREAM_URLS = {False: "wss://fstream.binance.com", True: "wss://stream.binancefuture.com"}
+# 全市场标记价格，每秒推送一次
+MARK_PRICE_STREAM = "!markPrice@arr@1s"
+# listenKey 60分钟不续期就失效
+LISTEN_KEY_KEEPALIVE = 30 * 60
+# 等第一批标记价格推送的时间，超时后退回 premiumIndex
+PRICE_TIMEOUT = 5.0
+# 下单后等订单终态推送的时间，超时的交易对用 REST 重新同步
+FILL_CONFIRM_TIMEOUT = 10.0
+FINAL_ORDER_STATUSES = ("FILLED", "CANCELED", "EXPIRED", "EXPIRED_IN_MATCH", "REJECTED")
+
+
+class FuturesStream:
+    """
+    Live view of one account on a single WebSocket connection.
+
+    orders {order id: {symbol, client_order_id, side, position_side, status,
+    filled, avg_price, settled}} holds the latest ORDER_TRADE_UPDATE of
+    every order, wallet_balance the cross wallet USDT of the latest
+    ACCOUNT_UPDATE.
+    connected turns False when the connection drops; callers then fall back
+    to REST.
+    """
+
+    def __init__(self, state, base_url: str = STREAM_URLS[False]):
+        self.state = state
+        self.base_url = base_url.rstrip("/")
+        self.orders: Dict[str, dict] = {}
+        self.wallet_balance: Optional[float] = None
+        self.events = Counter()
+        self.connected = False
+        self.listen_key: Optional[str] = None
+        self._prices_ready = asyncio.Event()
+        self._settled: Dict[str, asyncio.Event] = {}
+        # 用户数据事件的序号：每个交易对最近一次 ACCOUNT_UPDATE 的序号，和还在等持仓推送的订单
+        self._seq = 0
+        self._account_seq: Dict[str, int] = {}
+        self._unsettled: Dict[str, set] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._ws = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, dispatcher) -> "FuturesStream":
+        """Create a listenKey, connect, and switch the snapshot to stream-driven updates."""
+        response = await dispatcher.call("fapiPrivatePostListenKey")
+        self.listen_key = response['listenKey']
+        self._session = aiohttp.ClientSession()
+        try:
+            self._ws = await self._session.ws_connect(
+                f"{self.base_url}/stream?streams={self.listen_key}/{MARK_PRICE_STREAM}", heartbeat=60
+            )
+        except Exception:
+            await self._session.close()
+            raise
+        self.connected = True
+        # 持仓改由 ACCOUNT_UPDATE 推送更新，下单返回时不再本地累加，避免重复记账
+        self.state.live = True
+        self._tasks = [asyncio.create_task(self._read()), asyncio.create_task(self._keepalive(dispatcher))]
+        logger.info(f"已连接用户数据流和全市场标记价格流: {self.base_url}")
+        return self
+
+    async def stop(self, dispatcher=None) -> None:
+        self.connected = False
+        self.state.live = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._ws is not None:
+            await self._ws.close()
+        if self._session is not None:
+            await self._session.close()
+        if dispatcher is not None and self.listen_key:
+            try:
+                await dispatcher.call("fapiPrivateDeleteListenKey")
+            except Exception as e:
+                logger.warning(f"关闭 listenKey 失败: {e}")
+        logger.info(f"数据流已关闭，共收到事件: {dict(self.events)}")
+
+    async def _keepalive(self, dispatcher) -> None:
+        while True:
+            await asyncio.sleep(LISTEN_KEY_KEEPALIVE)
+            try:
+                await dispatcher.call("fapiPrivatePutListenKey")
+            except Exception as e:
+                logger.warning(f"listenKey 续期失败: {e}")
+
+    async def _read(self) -> None:
+        try:
+            async for msg in self._ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    payload = json.loads(msg.data)
+                    self.handle(payload.get('data', payload))
+                elif msg.type in (aiohttp.WSMsgType.ERROR, aiohttp.WSMsgType.CLOSED):
+                    break
+        finally:
+            if self.connected:
+                logger.warning("数据流连接断开，之后的持仓和成交改用 REST 查询")
+            self.connected = False
+            self.state.live = False
+            # 断线后不会再有推送，让等待中的确认立即返回
+            for event in self._settled.values():
+                event.set()
+
+    def handle(self, event) -> None:
+        """Apply one stream event (a dict, or the list of a mark-price push) to the snapshot."""
+        if isinstance(event, list):
+            for item in event:
+                self.state.mark_prices[item['s']] = float(item['p'])
+            self.events['markPriceUpdate'] += 1
+            self._prices_ready.set()
+            return
+
+        event_type = event.get('e')
+        self.events[event_type] += 1
+        self._seq += 1
+        if event_type == 'ACCOUNT_UPDATE':
+            self._on_account_update(event['a'])
+        elif event_type == 'ORDER_TRADE_UPDATE':
+            self._on_order_update(event['o'])
+        elif event_type == 'listenKeyExpired':
+            logger.warning("listenKey 已过期，用户数据流不再推送")
+            self.connected = False
+            self.state.live = False
+
+    def _on_account_update(self, account: dict) -> None:
+        for balance in account.get('B', []):
+            if balance['a'] == 'USDT':
+                self.wallet_balance = float(balance['cw'])
+        # P 里只有发生变化的持仓，positionAmt 是该方向的最新数量（空仓为负）
+        for pos in account.get('P', []):
+            if pos['ps'] not in ('LONG', 'SHORT'):
+                continue
+            sides = self.state.positions.setdefault(pos['s'], {'LONG': 0.0, 'SHORT': 0.0})
+            sides[pos['ps']] = abs(float(pos['pa']))
+            self._account_seq[pos['s']] = self._seq
+        for symbol in {pos['s'] for pos in account.get('P', [])}:
+            for order_id in list(self._unsettled.get(symbol, ())):
+                self._settle(order_id)
+
+    def _on_order_update(self, order: dict) -> None:
+        order_id = str(order['i'])
+        first_seq = self.orders.get(order_id, {}).get('first_seq', self._seq)
+        self.orders[order_id] = {
+            'symbol': order['s'],
+            'client_order_id': order.get('c'),
+            'side': order['S'].lower(),
+            'position_side': order.get('ps'),
+            'status': order['X'],
+            'filled': float(order['z']),
+            'avg_price': float(order.get('ap') or 0.0),
+            'first_seq': first_seq,
+        }
+        if order['X'] in FINAL_ORDER_STATUSES:
+            self._unsettled.setdefault(order['s'], set()).add(order_id)
+            self._settle(order_id)
+
+    def _settle(self, order_id: str) -> None:
+        # 有成交的订单要等到它之后的 ACCOUNT_UPDATE，推送的持仓才包含这笔成交
+        order = self.orders[order_id]
+        if order['filled'] > 0 and self._account_seq.get(order['symbol'], 0) <= order['first_seq']:
+            return
+        order['settled'] = True
+        self._unsettled[order['symbol']].discard(order_id)
+        self._settled_event(order_id).set()
+
+    def _settled_event(self, order_id: str) -> asyncio.Event:
+        if order_id not in self._settled:
+            self._settled[order_id] = asyncio.Event()
+        return self._settled[order_id]
+
+    def is_settled(self, order_id: str) -> bool:
+        return self.orders.get(str(order_id), {}).get('settled', False)
+
+    async def wait_prices(self, timeout: float = PRICE_TIMEOUT) -> bool:
+        """True once the first mark-price push has arrived, False after timeout."""
+        try:
+            await asyncio.wait_for(self._prices_ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def wait_orders(self, order_ids: List[str], timeout: float = FILL_CONFIRM_TIMEOUT) -> Dict[str, dict]:
+        """
+        Wait until every order id is settled, at most timeout seconds.
+        Returns {order id: latest update} of the settled orders.
+        """
+        order_ids = [str(i) for i in order_ids if i is not None]
+        if self.connected and order_ids:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(self._settled_event(i).wait() for i in order_ids)), timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+        return {i: self.orders[i] for i in order_ids if self.is_settled(i)}
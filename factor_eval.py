@@ -0,0 +1,207 @@
+"""
+Batched single-factor evaluation for the research notebooks.
+
+Many factor columns are stacked into one (factor x time x symbol) cube and
+evaluated together: IC / RankIC series, quantile-group returns, long-short
+(top minus bottom group) returns, turnover and after-fee performance, with
+one summary row per factor.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import polars as pl
+
+from forward_returns import AlignCube
+from portfolio import RankWithinRows
+
+
+def _PivotIndex(df: pl.DataFrame, time_column: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    times = df[time_column].unique().sort().to_numpy()
+    symbols = df["symbol"].unique().sort().to_numpy()
+    row_idx = np.searchsorted(times, df[time_column].to_numpy())
+    col_idx = np.searchsorted(symbols, df["symbol"].to_numpy())
+    return times, symbols, row_idx, col_idx
+
+
+def PivotCube(
+    df: pl.DataFrame, columns: List[str], time_column: str = "open_time", index=None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Long frame -> (len(columns) x time x symbol) float cube, NaN for missing cells.
+
+    Returns (cube, times, symbols); times and symbols are sorted. `index` is
+    a precomputed _PivotIndex of the same frame, to pivot it in batches.
+    """
+    times, symbols, row_idx, col_idx = index if index is not None else _PivotIndex(df, time_column)
+    cube = np.full((len(columns), len(times), len(symbols)), np.nan)
+    for i, column in enumerate(columns):
+        cube[i, row_idx, col_idx] = df[column].cast(pl.Float64).fill_null(np.nan).to_numpy()
+    return cube, times, symbols
+
+
+def ForwardReturn(close: np.ndarray) -> np.ndarray:
+    # 因子未来收益率：下一根k线的收盘价 / 当前收盘价 - 1，最后一行没有未来收益
+    fwd_ret = np.full_like(close, np.nan)
+    fwd_ret[:-1] = close[1:] / close[:-1] - 1
+    return fwd_ret
+
+
+def _RowCorr(x: np.ndarray, y: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    # 截面相关系数，只用 mask 里的symbol
+    n = mask.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = np.where(mask, x, 0.0).sum(axis=-1) / n
+        mean_y = np.where(mask, y, 0.0).sum(axis=-1) / n
+        dx = np.where(mask, x - mean_x[..., None], 0.0)
+        dy = np.where(mask, y - mean_y[..., None], 0.0)
+        corr = (dx * dy).sum(axis=-1) / np.sqrt((dx * dx).sum(axis=-1) * (dy * dy).sum(axis=-1))
+    return np.where(n >= 3, corr, np.nan)
+
+
+def PerformanceStats(pnl: np.ndarray, periods_per_year: int = 365) -> Dict[str, np.ndarray]:
+    """Notebook factor_stats over the last axis: ann_return, sharpe, maxdd, calmar_ratio."""
+    pnl = np.nan_to_num(pnl, nan=0.0)
+    net_value = np.cumprod(1 + pnl, axis=-1)
+    ann_return = periods_per_year * pnl.mean(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sharpe = periods_per_year ** 0.5 * pnl.mean(axis=-1) / pnl.std(axis=-1, ddof=1)
+        maxdd = (1 - net_value / np.maximum.accumulate(net_value, axis=-1)).max(axis=-1)
+        calmar_ratio = ann_return / maxdd
+    return {"ann_return": ann_return, "sharpe": sharpe, "maxdd": maxdd, "calmar_ratio": calmar_ratio}
+
+
+def EvaluateFactorCube(
+    factor_cube: np.ndarray,
+    fwd_ret: np.ndarray,
+    group_num: int = 10,
+    commission: float = 0.0,
+) -> Dict[str, np.ndarray]:
+    """
+    Per-period evaluation series for a (factor x time x symbol) cube.
+
+    Symbols are sorted by factor value within each (factor, time) into
+    group_num equal-count groups (group 0 = lowest factor); the long-short
+    leg is the top group minus the bottom group, equally weighted. Costs are
+    commission on the traded weight of both legs. RankIC uses ordinal ranks.
+
+    Returns arrays keyed by name: ic, rank_ic, group_ret (factor x time x
+    group), long_short, net_long_short, turnover (factor x time), bench (time).
+    """
+    num_factors, num_times, num_symbols = factor_cube.shape
+    mask = ~np.isnan(factor_cube) & ~np.isnan(fwd_ret)[None]
+    ret = np.broadcast_to(fwd_ret, factor_cube.shape)
+
+    ic = _RowCorr(factor_cube, ret, mask)
+
+    flat_mask = mask.reshape(-1, num_symbols)
+    factor_rank, valid_num = RankWithinRows(factor_cube.reshape(-1, num_symbols), flat_mask)
+    ret_rank, _ = RankWithinRows(ret.reshape(-1, num_symbols), flat_mask)
+    factor_rank = factor_rank.reshape(factor_cube.shape)
+    ret_rank = ret_rank.reshape(factor_cube.shape)
+    valid_num = valid_num.reshape(num_factors, num_times)
+    rank_ic = _RowCorr(factor_rank.astype(float), ret_rank.astype(float), mask)
+
+    # 分组：按因子排序后的位置等分成 group_num 组，不需要展开分位数矩阵
+    with np.errstate(invalid="ignore", divide="ignore"):
+        group = np.where(mask, factor_rank * group_num // np.maximum(valid_num, 1)[..., None], -1)
+    # 每个 (factor, time, group) 一个桶，一次 bincount 求和
+    bucket = (np.arange(num_factors * num_times).reshape(num_factors, num_times, 1) * group_num + group)[mask]
+    size = num_factors * num_times * group_num
+    ret_sum = np.bincount(bucket, weights=ret[mask], minlength=size).reshape(num_factors, num_times, group_num)
+    count = np.bincount(bucket, minlength=size).reshape(num_factors, num_times, group_num)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        group_ret = np.where(count > 0, ret_sum / count, np.nan)
+
+    long_short = group_ret[..., -1] - group_ret[..., 0]
+
+    # 换手：两条腿的等权权重变化
+    traded_weight = np.zeros((num_factors, num_times))
+    for g in [0, group_num - 1]:
+        in_group = group == g
+        weight = in_group / np.maximum(in_group.sum(axis=-1, keepdims=True), 1)
+        traded_weight[:, 1:] += np.abs(np.diff(weight, axis=1)).sum(axis=-1)
+        traded_weight[:, 0] += weight[:, 0].sum(axis=-1)
+    net_long_short = np.nan_to_num(long_short, nan=0.0) - commission * traded_weight
+
+    bench = _NanMean(fwd_ret, axis=-1)
+    return {
+        "ic": ic,
+        "rank_ic": rank_ic,
+        "group_ret": group_ret,
+        "long_short": long_short,
+        "net_long_short": net_long_short,
+        "turnover": traded_weight / 4,  # 单边换手率：两条腿、买卖各算一次
+        "bench": bench,
+        "coverage": valid_num,
+    }
+
+
+def _NanMean(values: np.ndarray, axis: int) -> np.ndarray:
+    # 和 np.nanmean 一样，但全是NaN时直接给NaN，不报 RuntimeWarning
+    count = (~np.isnan(values)).sum(axis=axis)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, np.nansum(values, axis=axis) / count, np.nan)
+
+
+def _SummaryRows(factor_columns: List[str], result: Dict[str, np.ndarray], periods_per_year: int) -> pl.DataFrame:
+    summary = {"factor": factor_columns}
+    for name in ["ic", "rank_ic"]:
+        series = result[name]
+        mean = _NanMean(series, axis=1)
+        std = np.sqrt(_NanMean((series - mean[:, None]) ** 2, axis=1))
+        summary[f"{name}_mean"] = mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            summary[f"{name}_ir"] = mean / std
+    summary["turnover"] = result["turnover"].mean(axis=1)
+    summary["coverage"] = result["coverage"].mean(axis=1)
+    for prefix, pnl in [("long_short", result["long_short"]), ("net", result["net_long_short"])]:
+        for name, values in PerformanceStats(pnl, periods_per_year).items():
+            summary[f"{prefix}_{name}"] = values
+    group_mean = _NanMean(result["group_ret"], axis=1)
+    for g in range(group_mean.shape[1]):
+        summary[f"group{g}_mean_ret"] = group_mean[:, g]
+    return pl.DataFrame(summary)
+
+
+def EvaluateFactors(
+    df: pl.DataFrame,
+    factor_columns: List[str],
+    group_num: int = 10,
+    commission: float = 0.0,
+    periods_per_year: int = 365,
+    price_column: str = "close",
+    time_column: str = "open_time",
+    batch_size: int = 16,
+    fwd_ret_cube: Optional[Dict[str, np.ndarray]] = None,
+    horizon: int = 1,
+) -> Tuple[pl.DataFrame, Dict[str, np.ndarray]]:
+    """
+    Evaluate many factor columns of a long (time, symbol) frame at once.
+
+    The forward return is the next bar's price_column return, or the given
+    horizon's slice of fwd_ret_cube (forward_returns.ForwardReturnStore)
+    when one is passed. Factors are processed batch_size at a time to bound
+    memory. Returns (summary, detail): summary has one row per factor; detail
+    holds the per-period series of EvaluateFactorCube concatenated over
+    factors, plus "times" and "symbols".
+    """
+    index = _PivotIndex(df, time_column)
+    times, symbols = index[0], index[1]
+    if fwd_ret_cube is not None:
+        fwd_ret = AlignCube(fwd_ret_cube, price_column, horizon, times, symbols)
+    else:
+        price, _, _ = PivotCube(df, [price_column], time_column, index)
+        fwd_ret = ForwardReturn(price[0])
+
+    batches = []
+    for start in range(0, len(factor_columns), batch_size):
+        factor_cube, _, _ = PivotCube(df, factor_columns[start:start + batch_size], time_column, index)
+        batches.append(EvaluateFactorCube(factor_cube, fwd_ret, group_num, commission))
+
+    detail = {
+        name: np.concatenate([batch[name] for batch in batches]) for name in batches[0] if name != "bench"
+    }
+    detail["bench"] = batches[0]["bench"]
+    detail["times"] = times
+    detail["symbols"] = symbols
+    return _SummaryRows(factor_columns, detail, periods_per_year), detail
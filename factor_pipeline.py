@@ -0,0 +1,349 @@
+import logging
+import numpy as np
+import polars as pl
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("FactorPipeline")
+
+# 多空过去n天平均收益率都超过该阈值时，调整多空仓位比例
+POS_RET_PCT_SCALE_THRESHOLD = 0.01
+
+# 生产环境中排除的大币种
+PROD_EXCLUDE_SYMBOLS = [
+    "BTCUSDT", "ETHUSDT", "BCHUSDT", "LTCUSDT", "ETCUSDT", "LINKUSDT", "AVAXUSDT", "SOLUSDT"
+]
+
+# 因子计算需要的原始列，其余列不从parquet读取（projection pushdown）
+BASE_COLUMNS = [
+    "open_time", "close_time", "symbol", "open", "high", "low", "close", "volume", "quote_volume"
+]
+
+
+def sign(column: pl.Expr) -> pl.Expr:
+    return pl.when(column > 0).then(1).otherwise(pl.when(column < 0).then(-1).otherwise(0))
+
+
+# ================= 因子表达式 =================
+# 每个函数只返回 pl.Expr，不做任何计算，组合成一个 LazyFrame 查询后一次 collect
+# 所有表达式都假设数据已经按 (symbol, open_time) 排好序
+
+
+def PastReturnExprs(day_num: int) -> List[pl.Expr]:
+    # 千万注意，这里是计算此时刻相对于前一时刻的return，不能使用未来信息 -> shift(1)是整体往下移动
+    exprs = [
+        ((pl.col("close") / pl.col("close").shift(i) - 1) * 100)
+        .over("symbol")
+        .alias(f"past_{i}day_close_return")
+        for i in range(1, day_num + 1)
+    ]
+    # 默认使用过去1天的return作为return列
+    exprs.append(((pl.col("close") / pl.col("close").shift(1) - 1) * 100).over("symbol").alias("return"))
+    return exprs
+
+
+def VolatilityExprs(window_size: int = 30) -> List[pl.Expr]:
+    return [
+        pl.col(bar_name)
+        .pct_change()
+        .rolling_std(window_size=window_size)
+        .over("symbol")
+        .alias(f"{bar_name}_price_volatility")
+        for bar_name in ["open", "close"]
+    ]
+
+
+def AmihudExpr(window_size: int = 10) -> pl.Expr:
+    # 依赖 return 列，需要在 PastReturnExprs 之后的 with_columns 中使用
+    return (
+        pl.col("return").abs().rolling_sum(window_size=window_size)
+        / pl.col("quote_volume").rolling_sum(window_size=window_size)
+    ).over("symbol").alias("amihud")
+
+
+def ReturnSkewnessExpr(window_size: int = 7) -> pl.Expr:
+    # rolling_skew 在窗口内方差为0时会得到NaN，统一转成null
+    return (
+        pl.col("return").rolling_skew(window_size).over("symbol").fill_nan(None).alias("return_skewness")
+    )
+
+
+def IDExpr(max_window: int = 48, min_window: int = 72) -> pl.Expr:
+    ret1 = pl.col("close") / pl.col("open") - 1
+    return (
+        (sign(ret1) * (ret1.rolling_max(window_size=max_window) - ret1.rolling_min(window_size=min_window)) / pl.col("close"))
+        .over("symbol")
+        .clip(-0.2, 0.3)
+        .fill_nan(None)
+        .alias("ID")
+    )
+
+
+def FutureRetExprs(day_num: int) -> List[pl.Expr]:
+    exprs = []
+    for i in range(1, day_num + 1):
+        for bar_name in ["close", "open"]:
+            exprs.append(
+                ((pl.col(bar_name).shift(-i) / pl.col(bar_name) - 1) * 100)
+                .over("symbol")
+                .alias(f"{bar_name}_price_fut_{i}day_ret")
+            )
+    return exprs
+
+
+def CrossSectionalZScoreExprs(column_list: List[str]) -> List[pl.Expr]:
+    # 截面归一化
+    return [
+        ((pl.col(c) - pl.col(c).mean().over("open_time")) / pl.col(c).std().over("open_time")).alias(c)
+        for c in column_list
+    ]
+
+
+# ================= 查询构建 =================
+
+
+def ScanKlines(
+    input_path: str,
+    exclude_symbols: Optional[List[str]] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    symbol_suffix: str = "USDT",
+) -> pl.LazyFrame:
+    """
+    Lazily scan the kline parquet with projection and predicate pushdown.
+
+    start_time / end_time are applied on the raw time column before any
+    rolling window, so the caller must leave enough history for the longest
+    factor lookback.
+    """
+    lf = pl.scan_parquet(input_path).select(BASE_COLUMNS)
+    # data_loader 写的是毫秒时间戳，futures_1h 等研究数据里已经是 Datetime
+    is_epoch = lf.collect_schema()["open_time"].is_integer()
+
+    # 过滤条件直接作用在原始的时间列上，可以下推到parquet读取
+    predicate = pl.col("symbol").str.ends_with(symbol_suffix)
+    if exclude_symbols:
+        predicate = predicate & ~pl.col("symbol").is_in(exclude_symbols)
+    if start_time is not None:
+        predicate = predicate & (pl.col("open_time") >= _TimeBound(start_time, is_epoch))
+    if end_time is not None:
+        predicate = predicate & (pl.col("open_time") < _TimeBound(end_time, is_epoch))
+
+    if is_epoch:
+        time_exprs = [
+            pl.from_epoch(pl.col(c), time_unit="ms").cast(pl.Datetime("ms")).alias(c) for c in ["open_time", "close_time"]
+        ]
+    else:
+        time_exprs = [pl.col(c).cast(pl.Datetime("ms")).alias(c) for c in ["open_time", "close_time"]]
+    return lf.filter(predicate).with_columns(time_exprs)
+
+
+def _TimeBound(ts: datetime, is_epoch: bool):
+    # k线时间都是UTC，naive datetime 也按UTC处理
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    if is_epoch:
+        return int(ts.timestamp() * 1000)
+    return pl.lit(ts.astimezone(timezone.utc).replace(tzinfo=None), dtype=pl.Datetime("ms"))
+
+
+def BuildFeaturePlan(
+    lf: pl.LazyFrame,
+    past_day_num: int = 10,
+    fut_day_num: int = 0,
+    volatility_window: int = 30,
+    amihud_window: int = 10,
+    skewness_window: int = 7,
+) -> pl.LazyFrame:
+    """
+    Attach all per-symbol factor columns to a kline LazyFrame.
+
+    The frame is sorted once by (symbol, open_time); every factor after that is
+    a window expression, so the whole thing stays a single query plan.
+    """
+    lf = lf.sort(["symbol", "open_time"])
+    lf = lf.with_columns(PastReturnExprs(past_day_num) + VolatilityExprs(volatility_window) + [IDExpr()])
+    lf = lf.with_columns(AmihudExpr(amihud_window), ReturnSkewnessExpr(skewness_window))
+    if fut_day_num > 0:
+        lf = lf.with_columns(FutureRetExprs(fut_day_num))
+    return lf
+
+
+def LoadFeatureFrame(
+    input_path: str,
+    past_day_num: int = 10,
+    fut_day_num: int = 0,
+    exclude_symbols: Optional[List[str]] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    streaming: bool = False,
+) -> pl.DataFrame:
+    lf = ScanKlines(input_path, exclude_symbols=exclude_symbols, start_time=start_time, end_time=end_time)
+    lf = BuildFeaturePlan(lf, past_day_num=past_day_num, fut_day_num=fut_day_num)
+    return lf.collect(streaming=streaming)
+
+
+# ================= 线性合成因子 =================
+
+
+def NormalizeFactors(input_df: pl.DataFrame, factor_list: List[str]) -> pl.DataFrame:
+    # 截面归一化
+    return input_df.sort(["symbol", "open_time"]).with_columns(CrossSectionalZScoreExprs(factor_list))
+
+
+def fama_macbeth_get_factor_weight(
+    train_data: pl.DataFrame,
+    update_pos_days: int,
+    factor_num: int,
+    factor_combination_list: List[str],
+) -> Tuple[np.ndarray, float]:
+    # statsmodels 只在拟合时才需要，不在模块导入时加载
+    import statsmodels.api as sm
+
+    # Drop rows containing any null values
+    train_data = train_data.drop_nulls()
+
+    y_column_name = f"close_price_fut_{update_pos_days}day_ret"
+    assert (
+        y_column_name in train_data.columns
+    ), f"Column {y_column_name} (as y) not found in train data"
+
+    total_weights_sum = np.zeros(factor_num)
+    unique_times = train_data["open_time"].unique().sort()
+    constant_sum = 0.0
+
+    for each_time in unique_times:
+        slice_data = train_data.filter(pl.col("open_time") == each_time).fill_nan(0)
+
+        X = slice_data[factor_combination_list].to_numpy()
+        X = sm.add_constant(X)  # Add constant term (intercept)
+        y = slice_data[y_column_name].to_numpy()
+
+        results = sm.OLS(y, X).fit()
+        weights = results.params[1:]
+        constant_sum += results.params[0]  # constant term
+
+        while weights.shape[0] < total_weights_sum.shape[0]:
+            weights = np.append(weights, 0)
+
+        total_weights_sum += weights
+
+    logger.debug(f"fama macbeth over {len(unique_times)} cross sections: {total_weights_sum}")
+    total_weights_sum /= len(unique_times)
+    avg_const_term = constant_sum / len(unique_times)
+
+    return total_weights_sum, avg_const_term
+
+
+def CalcLinearCompoundFactor(
+    input_df: pl.DataFrame,
+    day_num: int,
+    factor_combination_list: list,
+    date_threshold: datetime = datetime(2025, 4, 1),
+    prev_threshold: datetime = datetime(2024, 4, 1),
+) -> pl.DataFrame:
+    factor_num = len(factor_combination_list)
+
+    for cur_update_position_time in range(1, day_num + 1):
+        cur_fut_ret_column_name = f"close_price_fut_{cur_update_position_time}day_ret"
+
+        # 只用 (prev_threshold, date_threshold) 之间有未来收益的数据拟合权重
+        linear_x_train = input_df.filter(
+            pl.col(cur_fut_ret_column_name).is_not_nan()
+            & pl.col(cur_fut_ret_column_name).is_not_null()
+            & (pl.col("open_time") < date_threshold)
+            & (pl.col("open_time") > prev_threshold)
+        ).select(["open_time", "symbol", cur_fut_ret_column_name] + factor_combination_list)
+
+        weighted_factors, const_term = fama_macbeth_get_factor_weight(
+            linear_x_train,
+            cur_update_position_time,
+            factor_num=factor_num,
+            factor_combination_list=factor_combination_list,
+        )
+        logger.info(
+            f"{cur_update_position_time}day weights: const {const_term} "
+            + ", ".join(f"{f}: {w}" for f, w in zip(factor_combination_list, weighted_factors))
+        )
+        if any(np.isnan(weighted_factors)) or np.isnan(const_term):
+            logger.warning("NaN values in weights!")
+        if any(np.abs(weighted_factors) > 100):
+            logger.warning("Unusually large weights!")
+
+        weighted_sum_expr = pl.lit(const_term)
+        for factor, weight in zip(factor_combination_list, weighted_factors):
+            weighted_sum_expr += pl.col(factor) * weight
+
+        # 这个代码用于实际交易的时候，我们只需要使用权重计算未来收益率
+        input_df = input_df.with_columns(
+            weighted_sum_expr.alias(f"linear_compound_factor_{cur_update_position_time}day")
+        )
+
+    return input_df.filter(pl.col("open_time") >= date_threshold)  # only return the data after the threshold
+
+
+def CalcDayPositionScale(
+    input_df: pl.DataFrame, day_num: int, trade_long_rank: int, trade_short_rank: int
+) -> pl.DataFrame:
+    """
+    Per open_time long/short position scale for every holding horizon.
+
+    For each horizon and side, the mean future return of the top-ranked
+    symbols is taken in one group_by over open_time (the rank inside the
+    aggregation is per cross section), then shifted by the horizon so only
+    realized returns are used.
+    """
+    mean_ret_exprs = []
+    for i in range(1, day_num + 1):
+        for side in ["long", "short"]:
+            sort_desc = side == "long"
+            trade_rank_num = trade_long_rank if side == "long" else trade_short_rank
+            mean_ret_exprs.append(
+                pl.when(pl.col(f"linear_compound_factor_{i}day").rank(descending=sort_desc) <= trade_rank_num)
+                .then(pl.col(f"close_price_fut_{i}day_ret"))
+                .otherwise(None)
+                .mean()
+                .alias(f"fut_mean_{side}_ret_{i}day")
+            )
+
+    agg_avg_ret_df = input_df.group_by("open_time").agg(mean_ret_exprs).sort("open_time")
+
+    agg_avg_ret_df = agg_avg_ret_df.with_columns(
+        pl.col(f"fut_mean_{side}_ret_{i}day").shift(i).alias(f"past_mean_{side}_ret_{i}day")
+        for i in range(1, day_num + 1)
+        for side in ["long", "short"]
+    )
+
+    scale_exprs = []
+    for i in range(1, day_num + 1):
+        is_bullish = (pl.col(f"past_mean_long_ret_{i}day") > POS_RET_PCT_SCALE_THRESHOLD) & (
+            pl.col(f"past_mean_short_ret_{i}day") > POS_RET_PCT_SCALE_THRESHOLD
+        )
+        is_bearish = (pl.col(f"past_mean_long_ret_{i}day") < POS_RET_PCT_SCALE_THRESHOLD) & (
+            pl.col(f"past_mean_short_ret_{i}day") < POS_RET_PCT_SCALE_THRESHOLD
+        )
+        for side in ["long", "short"]:
+            bullish_scale = 1.2 if side == "long" else 0.8
+            bearish_scale = 0.8 if side == "long" else 1.2
+            scale_exprs.append(
+                pl.when(is_bullish)
+                .then(bullish_scale)
+                .when(is_bearish)
+                .then(bearish_scale)
+                .otherwise(1.0)
+                .alias(f"{side}_value_scale_{i}day")
+            )
+    return agg_avg_ret_df.with_columns(scale_exprs)
+
+
+def AddTotalPosValueScale(
+    input_df: pl.DataFrame, day_num: int, trade_long_rank: int, trade_short_rank: int
+) -> pl.DataFrame:
+    day_scale_df = CalcDayPositionScale(input_df, day_num, trade_long_rank, trade_short_rank)
+
+    # only need the scale columns
+    select_col = [col for col in day_scale_df.columns if "scale" in col]
+    day_scale_df = day_scale_df.select(pl.col(["open_time"] + select_col))
+
+    input_df = input_df.join(day_scale_df, on="open_time", how="left")
+    return input_df, day_scale_df
@@ -0,0 +1,436 @@
+import glob
+import hashlib
+import inspect
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+import polars as pl
+
+import alpha101_prod
+from factor_pipeline import (
+    AmihudExpr,
+    FutureRetExprs,
+    IDExpr,
+    PastReturnExprs,
+    ReturnSkewnessExpr,
+    ScanKlines,
+    VolatilityExprs,
+    sign,
+)
+
+logger = logging.getLogger("FeatureStore")
+
+FEATURE_STORE_DIR = "data/feature_store"
+KEY_COLUMNS = ["symbol", "open_time"]
+
+# alpha101 里最长的滚动窗口是200根k线左右，留一些余量
+ALPHA_LOOKBACK = 250
+
+
+# pandas 的滚动相关系数 / 协方差 / 标准差按加减窗口的方式累计，结果和窗口之前的全部历史有关，
+# 方差接近0时（比如截面 rank 在窗口内不变）误差会被放大到结果的量级
+ROLLING_MOMENT_HELPERS = ("correlation", "covariance", "stddev")
+
+
+def _DependsOnFullHistory(alpha_name: str) -> bool:
+    func = getattr(alpha101_prod, alpha_name)
+    # 依赖累计vwap（CalcVwapDf 从第一根k线开始 cumsum）的alpha，起点不同结果不同，只能全量重算
+    if "vwap" in inspect.signature(func).parameters:
+        return True
+    src = inspect.getsource(func)
+    return any(re.search(rf"\b{helper}\(", src) for helper in ROLLING_MOMENT_HELPERS)
+
+
+class FeatureSpec:
+    """
+    One cacheable factor column.
+
+    compute(df, **params) receives the (symbol, open_time)-sorted kline frame
+    with the `return` column attached and returns it with `name` added.
+    lookback / lookahead are in bars; lookback=None means the factor depends
+    on the whole history and is always recomputed from scratch. code lists the
+    functions or modules whose source goes into the cache key.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        compute: Callable[..., pl.DataFrame],
+        params: Optional[dict] = None,
+        lookback: Optional[int] = 0,
+        lookahead: int = 0,
+        code: Optional[List[Callable]] = None,
+    ):
+        self.name = name
+        self.compute = compute
+        self.params = params or {}
+        self.lookback = lookback
+        self.lookahead = lookahead
+        self.code = code or [compute]
+
+    def code_hash(self) -> str:
+        src = "".join(inspect.getsource(func) for func in self.code)
+        return hashlib.sha1(src.encode("utf-8")).hexdigest()[:12]
+
+
+def _ExprSpec(name: str, builder: Callable, params: dict, lookback: int, lookahead: int = 0, code=None) -> FeatureSpec:
+    def compute(df: pl.DataFrame, **kwargs) -> pl.DataFrame:
+        exprs = builder(**kwargs)
+        if not isinstance(exprs, list):
+            exprs = [exprs]
+        return df.with_columns([e for e in exprs if e.meta.output_name() == name])
+
+    return FeatureSpec(name, compute, params, lookback, lookahead, code=[builder] + (code or []))
+
+
+def _AlphaSpec(name: str) -> FeatureSpec:
+    def compute(df: pl.DataFrame) -> pl.DataFrame:
+        return alpha101_prod.CalcAlpha101Factor(df, calc_factor_list=[name])
+
+    # 其余 alpha 只用滚动求和 / 均值 / 排名，截断历史后只有最后几位浮点数不同
+    lookback = None if _DependsOnFullHistory(name) else ALPHA_LOOKBACK
+    # alpha 会调用 rank / correlation / ts_* 等模块里的辅助函数，整个模块的源码都算进 code hash
+    return FeatureSpec(name, compute, lookback=lookback, code=[alpha101_prod])
+
+
+def _BuildRegistry(max_day_num: int = 10) -> Dict[str, FeatureSpec]:
+    specs = [
+        _ExprSpec("amihud", AmihudExpr, {"window_size": 10}, 10),
+        _ExprSpec("return_skewness", ReturnSkewnessExpr, {"window_size": 7}, 7),
+        _ExprSpec("ID", IDExpr, {"max_window": 48, "min_window": 72}, 72, code=[sign]),
+        _ExprSpec("open_price_volatility", VolatilityExprs, {"window_size": 30}, 31),
+        _ExprSpec("close_price_volatility", VolatilityExprs, {"window_size": 30}, 31),
+    ]
+    for i in range(1, max_day_num + 1):
+        specs.append(_ExprSpec(f"past_{i}day_close_return", PastReturnExprs, {"day_num": i}, i))
+        for bar_name in ["close", "open"]:
+            specs.append(_ExprSpec(f"{bar_name}_price_fut_{i}day_ret", FutureRetExprs, {"day_num": i}, 0, lookahead=i))
+    for name in dir(alpha101_prod):
+        if name.startswith("alpha") and name[5:].isdigit():
+            specs.append(_AlphaSpec(name))
+    return {spec.name: spec for spec in specs}
+
+
+FEATURE_REGISTRY: Dict[str, FeatureSpec] = _BuildRegistry()
+
+
+class FeatureStore:
+    """
+    Parquet-backed cache of computed factor columns.
+
+    Each factor column is stored as one parquet file of (symbol, open_time,
+    value), keyed by factor name, parameters, code hash and the symbol
+    universe and input file. The sidecar manifest records the input
+    watermark (latest open_time the column was computed on) and a
+    fingerprint of that bar; on the next call the watermark bar (it may have
+    been partial) and the rows after it, plus the factor's
+    lookback/lookahead, are recomputed.
+    """
+
+    def __init__(
+        self,
+        input_path: str = "data/all_data_1d_2023.parquet",
+        store_dir: str = FEATURE_STORE_DIR,
+        exclude_symbols: Optional[List[str]] = None,
+        registry: Optional[Dict[str, FeatureSpec]] = None,
+        end_time: Optional[datetime] = None,
+    ):
+        self.input_path = input_path
+        self.end_time = end_time
+        self.store_dir = store_dir
+        self.exclude_symbols = sorted(exclude_symbols or [])
+        self.registry = registry or FEATURE_REGISTRY
+        self._base: Optional[pl.DataFrame] = None
+
+    # ---------- keys & paths ----------
+
+    def feature_key(self, spec: FeatureSpec) -> str:
+        payload = json.dumps(
+            {
+                "input_path": os.path.abspath(self.input_path),
+                "name": spec.name,
+                "params": spec.params,
+                "code": spec.code_hash(),
+                "universe": self.exclude_symbols,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+    def _paths(self, spec: FeatureSpec):
+        base = os.path.join(self.store_dir, spec.name, self.feature_key(spec))
+        return base + ".parquet", base + ".json"
+
+    def _read_manifest(self, spec: FeatureSpec) -> Optional[dict]:
+        data_path, manifest_path = self._paths(spec)
+        if not (os.path.exists(data_path) and os.path.exists(manifest_path)):
+            return None
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _bar_fingerprint(self, open_time: datetime) -> str:
+        # data_loader 会重新拉当天未走完的k线，同一个 open_time 的内容可能变
+        bar = self.base_frame().filter(pl.col("open_time") == open_time).sort(KEY_COLUMNS)
+        return hashlib.sha1(bar.write_csv().encode("utf-8")).hexdigest()[:16]
+
+    def _write(self, spec: FeatureSpec, values: pl.DataFrame, watermark: datetime):
+        data_path, manifest_path = self._paths(spec)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        # 先写临时文件再rename，避免中途失败留下半个文件
+        values.write_parquet(data_path + ".tmp")
+        os.replace(data_path + ".tmp", data_path)
+        manifest = {
+            "name": spec.name,
+            "params": spec.params,
+            "code_hash": spec.code_hash(),
+            "exclude_symbols": self.exclude_symbols,
+            "input_path": os.path.abspath(self.input_path),
+            "watermark": watermark.isoformat(),
+            "watermark_fingerprint": self._bar_fingerprint(watermark),
+            "rows": values.height,
+        }
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    # ---------- computation ----------
+
+    def base_frame(self) -> pl.DataFrame:
+        """Kline frame sorted by (symbol, open_time) with the `return` column."""
+        if self._base is None:
+            lf = ScanKlines(self.input_path, exclude_symbols=self.exclude_symbols, end_time=self.end_time)
+            self._base = (
+                lf.sort(KEY_COLUMNS)
+                .with_columns([e for e in PastReturnExprs(1) if e.meta.output_name() == "return"])
+                .collect()
+            )
+        return self._base
+
+    def _compute(self, spec: FeatureSpec, df: pl.DataFrame) -> pl.DataFrame:
+        return spec.compute(df, **spec.params).select(KEY_COLUMNS + [spec.name])
+
+    def _update(self, spec: FeatureSpec) -> pl.DataFrame:
+        base = self.base_frame()
+        times = base["open_time"].unique().sort()
+        watermark = times[-1]
+        manifest = self._read_manifest(spec)
+        data_path, _ = self._paths(spec)
+
+        if manifest is not None and spec.lookback is not None:
+            cached_watermark = datetime.fromisoformat(manifest["watermark"])
+            if cached_watermark == watermark and manifest.get("watermark_fingerprint") == self._bar_fingerprint(watermark):
+                return pl.read_parquet(data_path)
+            if cached_watermark > watermark:
+                # 回看历史某一天（end_time 早于缓存），缓存里的未来收益等列用到了之后的数据，直接重算且不覆盖缓存
+                return self._compute(spec, base)
+
+            # 缓存的最后一根k线可能是当时未走完的k线，和之后的新k线一起重算，加上因子的lookback；
+            # lookahead(未来收益)的尾部也要重算
+            cached_idx = times.search_sorted(cached_watermark, side="right")
+            keep_from = times[max(cached_idx - 1 - spec.lookahead, 0)]
+            compute_from = times[max(cached_idx - 1 - spec.lookahead - spec.lookback, 0)]
+            logger.info(f"{spec.name}: 增量计算 {keep_from} 之后的数据 (watermark {cached_watermark})")
+
+            fresh = self._compute(spec, base.filter(pl.col("open_time") >= compute_from))
+            fresh = fresh.filter(pl.col("open_time") >= keep_from)
+            cached = pl.read_parquet(data_path).filter(pl.col("open_time") < keep_from)
+            values = pl.concat([cached, fresh.cast(cached.schema)]).sort(KEY_COLUMNS)
+        else:
+            logger.info(f"{spec.name}: 全量计算")
+            values = self._compute(spec, base)
+
+        self._write(spec, values, watermark)
+        return values
+
+    def get_features(self, feature_list: List[str], with_base: bool = True) -> pl.DataFrame:
+        """
+        Return the requested factor columns, computing only what the cache lacks.
+
+        With with_base=True the kline columns (open/close/volume/return, ...)
+        are included, so the frame can go straight into the rest of the
+        factor script or a research notebook.
+        """
+        unknown = [name for name in feature_list if name not in self.registry]
+        assert not unknown, f"unknown features: {unknown}"
+
+        result = self.base_frame() if with_base else self.base_frame().select(KEY_COLUMNS)
+        for name in feature_list:
+            values = self._update(self.registry[name])
+            result = result.join(values, on=KEY_COLUMNS, how="left")
+        return result
+
+
+def get_features(
+    feature_list: List[str],
+    input_path: str = "data/all_data_1d_2023.parquet",
+    exclude_symbols: Optional[List[str]] = None,
+    store_dir: str = FEATURE_STORE_DIR,
+    with_base: bool = True,
+    end_time: Optional[datetime] = None,
+) -> pl.DataFrame:
+    store = FeatureStore(
+        input_path=input_path, store_dir=store_dir, exclude_symbols=exclude_symbols, end_time=end_time
+    )
+    return store.get_features(feature_list, with_base=with_base)
+
+
+# ================= 分块计算（out-of-core） =================
+
+
+# 分块时多回看的倍数：lookback 是每个交易对的行数，缺k线时按时间算的窗口不够
+CHUNK_LOOKBACK_MARGIN = 2
+
+
+def _LastBarFingerprint(lf: pl.LazyFrame, last_time: datetime) -> str:
+    # data_loader 会重新拉当天未走完的k线，同一个 open_time 的内容可能变
+    bar = lf.filter(pl.col("open_time") == last_time).sort(KEY_COLUMNS).collect()
+    return hashlib.sha1(bar.write_csv().encode("utf-8")).hexdigest()[:16]
+
+
+def _InferBarInterval(lf: pl.LazyFrame) -> timedelta:
+    # binance k线的 close_time = open_time + 周期 - 1ms
+    first_bar = lf.select((pl.col("close_time") - pl.col("open_time")).first()).collect()
+    return first_bar.item() + timedelta(milliseconds=1)
+
+
+def WriteFeaturesChunked(
+    feature_list: List[str],
+    input_path: str,
+    output_dir: str,
+    chunk_size: timedelta = timedelta(days=90),
+    exclude_symbols: Optional[List[str]] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    with_base: bool = False,
+    overwrite: bool = False,
+    registry: Optional[Dict[str, FeatureSpec]] = None,
+) -> pl.LazyFrame:
+    """
+    Out-of-core version of get_features for hourly / minute klines.
+
+    The input is processed in time chunks of chunk_size. Each chunk is scanned
+    together with the largest lookback (before) and lookahead (after) of the
+    requested features, so only the parquet row groups of that window are read;
+    the features are computed, trimmed back to the chunk and written as one
+    parquet part under output_dir. Parts already on disk are skipped, so an
+    interrupted run resumes where it stopped (a manifest.json guards against
+    reusing parts written for other features or chunking). The manifest also
+    records the last bar of the input: when new bars arrive or the last bar
+    is rewritten, only the chunks from last_time - lookahead on are
+    recomputed. overwrite=True recomputes everything. Returns a LazyFrame
+    over all parts.
+
+    Features with lookback=None (cumulative vwap alphas) depend on the whole
+    history and cannot be chunked. lookback counts rows per symbol while the
+    scan window is in time, so a symbol with missing bars before a chunk
+    boundary would get too short a warm-up; the window is widened by
+    CHUNK_LOOKBACK_MARGIN for that, and longer gaps still change the first
+    values of the chunk.
+    """
+    registry = registry or FEATURE_REGISTRY
+    unknown = [name for name in feature_list if name not in registry]
+    assert not unknown, f"unknown features: {unknown}"
+    specs = [registry[name] for name in feature_list]
+    full_history = [spec.name for spec in specs if spec.lookback is None]
+    if full_history:
+        raise ValueError(f"{full_history} 依赖全部历史数据，不能分块计算")
+
+    # return 列本身还要多回看一根k线
+    lookback = max((spec.lookback for spec in specs), default=0) + 1
+    lookahead = max((spec.lookahead for spec in specs), default=0)
+
+    lf = ScanKlines(input_path, exclude_symbols=exclude_symbols, start_time=start_time, end_time=end_time)
+    bar_interval = _InferBarInterval(lf)
+    bounds = lf.select(pl.col("open_time").min().alias("first"), pl.col("open_time").max().alias("last"))
+    first_time, last_time = bounds.collect(streaming=True).row(0)
+    if first_time is None:
+        raise ValueError(f"{input_path} 在指定时间范围内没有数据")
+
+    if end_time is not None and end_time.tzinfo is not None:
+        end_time = end_time.astimezone(timezone.utc).replace(tzinfo=None)
+
+    # 分块参数或因子代码变了，已有的分块都不能再用
+    manifest = {
+        "features": {spec.name: {"params": spec.params, "code_hash": spec.code_hash()} for spec in specs},
+        "exclude_symbols": sorted(exclude_symbols or []),
+        "input_path": os.path.abspath(input_path),
+        "start_time": start_time.isoformat() if start_time is not None else None,
+        "end_time": end_time.isoformat() if end_time is not None else None,
+        "first_time": first_time.isoformat(),
+        "chunk_seconds": chunk_size.total_seconds(),
+        "with_base": with_base,
+    }
+    # 输入的最后一根k线：有新k线或者最后一根被重新拉取时，只重算受影响的分块
+    last_bar = {"last_time": last_time.isoformat(), "last_fingerprint": _LastBarFingerprint(lf, last_time)}
+    # lookahead 也是按行数算的，和 lookback 一样留余量
+    lookahead_span = int(lookahead * CHUNK_LOOKBACK_MARGIN) * bar_interval
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    stale_from = None
+    if not overwrite and os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            old_manifest = json.load(f)
+        old_last_time = old_manifest.pop("last_time", None)
+        old_fingerprint = old_manifest.pop("last_fingerprint", None)
+        if old_manifest != manifest or old_last_time is None or datetime.fromisoformat(old_last_time) > last_time:
+            logger.info(f"{output_dir} 的分块参数已变化，全部重新计算")
+            overwrite = True
+        elif old_last_time != last_bar["last_time"] or old_fingerprint != last_bar["last_fingerprint"]:
+            # 旧的最后一根k线之前 lookahead 以内的未来列现在有数据了
+            stale_from = datetime.fromisoformat(old_last_time) - lookahead_span
+            logger.info(f"{output_dir} 的输入到 {last_time} 有更新，重新计算 {stale_from} 之后的分块")
+    os.makedirs(output_dir, exist_ok=True)
+
+    def part_path_of(chunk_start: datetime) -> str:
+        return os.path.join(output_dir, f"part-{chunk_start:%Y%m%dT%H%M}.parquet")
+
+    if overwrite:
+        for part_path in glob.glob(os.path.join(output_dir, "part-*.parquet")):
+            os.remove(part_path)
+    elif stale_from is not None:
+        # 先删掉过期的分块再写 manifest，中途被打断时重跑也会补算它们
+        chunk_start = first_time
+        while chunk_start <= last_time:
+            if chunk_start + chunk_size > stale_from and os.path.exists(part_path_of(chunk_start)):
+                os.remove(part_path_of(chunk_start))
+            chunk_start += chunk_size
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({**manifest, **last_bar}, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    chunk_start = first_time
+    while chunk_start <= last_time:
+        chunk_end = chunk_start + chunk_size
+        part_path = part_path_of(chunk_start)
+        if not os.path.exists(part_path):
+            scan_end = chunk_end + lookahead_span
+            if end_time is not None:
+                # 未来收益也不能用到 end_time 之后的k线
+                scan_end = min(scan_end, end_time)
+            base = (
+                ScanKlines(
+                    input_path,
+                    exclude_symbols=exclude_symbols,
+                    start_time=chunk_start - int(lookback * CHUNK_LOOKBACK_MARGIN) * bar_interval,
+                    end_time=scan_end,
+                )
+                .sort(KEY_COLUMNS)
+                .with_columns([e for e in PastReturnExprs(1) if e.meta.output_name() == "return"])
+                .collect(streaming=True)
+            )
+
+            result = base if with_base else base.select(KEY_COLUMNS)
+            for spec in specs:
+                values = spec.compute(base, **spec.params).select(KEY_COLUMNS + [spec.name])
+                result = result.join(values, on=KEY_COLUMNS, how="left")
+            result = result.filter((pl.col("open_time") >= chunk_start) & (pl.col("open_time") < chunk_end))
+
+            result.write_parquet(part_path + ".tmp")
+            os.replace(part_path + ".tmp", part_path)
+            logger.info(f"分块 {chunk_start} ~ {chunk_end}: {result.height} 行 -> {part_path}")
+        chunk_start = chunk_end
+
+    return pl.scan_parquet(os.path.join(output_dir, "part-*.parquet"))
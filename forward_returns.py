@@ -0,0 +1,213 @@
+"""
+Forward-return cube shared by factor fitting, factor evaluation and the
+position-scale / backtest inputs.
+
+Forward returns of every horizon are computed once from the close/open
+columns into (horizon x time x symbol) arrays, saved as .npy under a
+directory keyed by the kline watermark and memory-mapped by every consumer:
+AttachForwardReturns adds the `{bar}_price_fut_{i}day_ret` columns the
+fitting code reads, AlignCube returns the (time x symbol) slice that
+factor_eval uses instead of re-pivoting and shifting close prices.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import polars as pl
+
+from factor_pipeline import ScanKlines
+
+logger = logging.getLogger("ForwardReturns")
+
+FWD_RET_CUBE_DIR = "data/fwd_ret_cube"
+BARS = ["close", "open"]
+
+
+def ForwardReturnCube(
+    df: pl.DataFrame,
+    horizons: Sequence[int],
+    bars: Sequence[str] = BARS,
+    dtype=np.float64,
+    out_dir: Optional[str] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Forward returns of a long kline frame as (len(horizons) x time x symbol) arrays.
+
+    Returns {"horizons", "times", "symbols", bar: cube} with times (open_time)
+    and symbols sorted. Values are fractions, price i bars later / price - 1,
+    where "i bars later" is the i-th next row of the same symbol, exactly like
+    FutureRetExprs' shift(-i).over("symbol"); NaN where there is none. With
+    out_dir the arrays are written there as .npy while they are filled.
+    """
+    df = df.select(["symbol", "open_time"] + list(bars)).sort(["symbol", "open_time"])
+    times = df["open_time"].unique().sort().to_numpy()
+    symbols = df["symbol"].unique().sort().to_numpy().astype(str)
+    row_idx = np.searchsorted(times, df["open_time"].to_numpy())
+    col_idx = np.searchsorted(symbols, df["symbol"].to_numpy().astype(str))
+
+    cube = {"horizons": np.asarray(horizons, dtype=np.int64), "times": times, "symbols": symbols}
+    shape = (len(horizons), len(times), len(symbols))
+    for bar in bars:
+        price = df[bar].cast(pl.Float64).fill_null(np.nan).to_numpy()
+        if out_dir is None:
+            values = np.full(shape, np.nan, dtype=dtype)
+        else:
+            values = np.lib.format.open_memmap(os.path.join(out_dir, f"{bar}.npy"), mode="w+", dtype=dtype, shape=shape)
+            values[:] = np.nan
+        for k, horizon in enumerate(horizons):
+            # 按 (symbol, open_time) 排好序后，向后第 horizon 行且还是同一个symbol的才是未来价格
+            ret = np.full(len(price), np.nan)
+            if horizon < len(price):
+                same_symbol = col_idx[horizon:] == col_idx[:-horizon]
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    ret[:-horizon] = np.where(same_symbol, price[horizon:] / price[:-horizon] - 1, np.nan)
+            values[k, row_idx, col_idx] = ret
+        cube[bar] = values
+
+    if out_dir is not None:
+        for name in ["horizons", "times", "symbols"]:
+            np.save(os.path.join(out_dir, f"{name}.npy"), cube[name])
+        for bar in bars:
+            cube[bar].flush()
+    return cube
+
+
+def _HorizonIndex(cube: Dict[str, np.ndarray], horizon: int) -> int:
+    matches = np.flatnonzero(cube["horizons"] == horizon)
+    assert len(matches) == 1, f"horizon {horizon} not in cube {cube['horizons'].tolist()}"
+    return int(matches[0])
+
+
+def _Lookup(axis: np.ndarray, values: np.ndarray):
+    # 在排好序的轴上找位置，找不到的返回 found=False
+    idx = np.minimum(np.searchsorted(axis, values), len(axis) - 1)
+    return idx, axis[idx] == values
+
+
+def AlignCube(
+    cube: Dict[str, np.ndarray], bar: str, horizon: int, times: np.ndarray, symbols: np.ndarray
+) -> np.ndarray:
+    """(len(times) x len(symbols)) float64 slice of one bar/horizon; NaN for times or symbols the cube lacks."""
+    values = cube[bar][_HorizonIndex(cube, horizon)]
+    row_idx, row_found = _Lookup(cube["times"], np.asarray(times, dtype=cube["times"].dtype))
+    col_idx, col_found = _Lookup(cube["symbols"], np.asarray(symbols).astype(str))
+    aligned = np.asarray(values[row_idx][:, col_idx], dtype=np.float64)
+    aligned[~row_found] = np.nan
+    aligned[:, ~col_found] = np.nan
+    return aligned
+
+
+def AttachForwardReturns(
+    df: pl.DataFrame,
+    cube: Dict[str, np.ndarray],
+    horizons: Optional[Sequence[int]] = None,
+    bars: Sequence[str] = BARS,
+) -> pl.DataFrame:
+    """
+    Add the `{bar}_price_fut_{i}day_ret` columns (percent, null where there is
+    no future bar) by gathering from the cube. With a float64 cube the values
+    are bit-identical to FutureRetExprs on the same klines.
+    """
+    horizons = cube["horizons"].tolist() if horizons is None else list(horizons)
+    row_idx, row_found = _Lookup(cube["times"], df["open_time"].to_numpy().astype(cube["times"].dtype))
+    col_idx, col_found = _Lookup(cube["symbols"], df["symbol"].to_numpy().astype(str))
+    found = row_found & col_found
+
+    columns = []
+    for i in horizons:
+        k = _HorizonIndex(cube, i)
+        for bar in bars:
+            values = np.asarray(cube[bar][k][row_idx, col_idx], dtype=np.float64) * 100
+            values[~found] = np.nan
+            columns.append(pl.Series(f"{bar}_price_fut_{i}day_ret", values).fill_nan(None))
+    return df.with_columns(columns)
+
+
+class ForwardReturnStore:
+    """
+    On-disk forward-return cube for one kline file and symbol universe.
+
+    The cube lives under store_dir/<settings key>/<watermark>, where the
+    watermark is the latest open_time, the row count and a fingerprint of
+    the latest bar of the input (plus the file size and mtime when there is
+    no end_time); when the klines get new or rewritten bars the cube is
+    rebuilt once and older watermarks of the same settings are removed.
+    load() memory-maps the arrays read-only.
+    """
+
+    def __init__(
+        self,
+        input_path: str = "data/all_data_1d_2023.parquet",
+        store_dir: str = FWD_RET_CUBE_DIR,
+        exclude_symbols: Optional[List[str]] = None,
+        end_time: Optional[datetime] = None,
+        max_horizon: int = 10,
+        dtype: str = "float64",
+    ):
+        self.input_path = input_path
+        self.store_dir = store_dir
+        self.exclude_symbols = sorted(exclude_symbols or [])
+        self.end_time = end_time
+        self.horizons = list(range(1, max_horizon + 1))
+        self.dtype = dtype
+
+    def settings_key(self) -> str:
+        payload = json.dumps(
+            {
+                "input_path": os.path.abspath(self.input_path),
+                "universe": self.exclude_symbols,
+                "horizons": self.horizons,
+                "dtype": self.dtype,
+                "bars": BARS,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+    def _scan(self) -> pl.LazyFrame:
+        return ScanKlines(self.input_path, exclude_symbols=self.exclude_symbols, end_time=self.end_time)
+
+    def watermark(self) -> str:
+        # 只读parquet统计信息级别的聚合，不需要把数据读进来
+        last_time, rows = self._scan().select(pl.col("open_time").max(), pl.len()).collect().row(0)
+        # data_loader 会重新拉当天未走完的k线，最后一根k线的内容变了时间和行数也不变
+        last_bar = (
+            self._scan()
+            .filter(pl.col("open_time") == last_time)
+            .select(["symbol", "open_time"] + BARS)
+            .sort("symbol")
+            .collect()
+        )
+        fingerprint = hashlib.sha1(last_bar.write_csv().encode("utf-8"))
+        if self.end_time is None and os.path.isfile(self.input_path):
+            stat = os.stat(self.input_path)
+            fingerprint.update(f"{stat.st_size}-{stat.st_mtime_ns}".encode("utf-8"))
+        return f"{last_time:%Y%m%dT%H%M%S}-{rows}-{fingerprint.hexdigest()[:12]}"
+
+    def load(self) -> Dict[str, np.ndarray]:
+        settings_dir = os.path.join(self.store_dir, self.settings_key())
+        cube_dir = os.path.join(settings_dir, self.watermark())
+        if not os.path.exists(os.path.join(cube_dir, "done")):
+            logger.info(f"计算未来收益 cube: {cube_dir}")
+            tmp_dir = cube_dir + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            df = self._scan().select(["symbol", "open_time"] + BARS).collect()
+            ForwardReturnCube(df, self.horizons, BARS, np.dtype(self.dtype), out_dir=tmp_dir)
+            open(os.path.join(tmp_dir, "done"), "w").close()
+            shutil.rmtree(cube_dir, ignore_errors=True)
+            os.replace(tmp_dir, cube_dir)
+            # 同一组设置下旧 watermark 的 cube 不会再用到
+            for name in os.listdir(settings_dir):
+                if name != os.path.basename(cube_dir):
+                    shutil.rmtree(os.path.join(settings_dir, name), ignore_errors=True)
+
+        return {
+            name: np.load(os.path.join(cube_dir, f"{name}.npy"), mmap_mode="r")
+            for name in ["horizons", "times", "symbols"] + BARS
+        }
@@ -0,0 +1,513 @@
+"""
+In-process mock of the binance USDT-M futures endpoints the executor uses,
+and a benchmark of execute_trades on synthetic rebalances.
+
+MockFuturesExchange has the ccxt async method names the executor calls
+(positions, premiumIndex, balance, ticker, bookTicker, leverage,
+symbolConfig, position side, create / batch / cancel / fetch order) and
+models hedge-mode positions, margin, a configurable latency per request and
+the IP weight limit: a request that would exceed `weight_limit` within
+`window` seconds fails with ccxt.RateLimitExceeded (HTTP 429).
+
+MockStreamServer is a local WebSocket stand-in of the futures stream
+endpoint: it serves /stream?streams=<listenKey>/!markPrice@arr@1s, pushes
+the mark prices every `mark_interval` seconds and the ORDER_TRADE_UPDATE /
+ACCOUNT_UPDATE events of the orders the mock exchange fills.
+
+    python mock_exchange.py --legs 50 100 200 300
+
+prints wall time, REST calls, weight and 429s per rebalance size.
+"""
+import asyncio
+import json
+import logging
+import random
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+import ccxt
+from aiohttp import web
+
+from execution_engine import ENDPOINT_WEIGHTS
+from executor_stream import MARK_PRICE_STREAM
+
+logger = logging.getLogger("MockExchange")
+
+# 交易所一侧的 weight，和执行器限速用的 ENDPOINT_WEIGHTS 一致
+MOCK_WEIGHTS = {**ENDPOINT_WEIGHTS, "cancel_order": 1, "fetch_order": 1}
+BINANCE_WEIGHT_LIMIT = 2400
+TAKER_FEE = 4 / 10000.0
+HALF_SPREAD = 1 / 10000.0
+
+
+class MockFuturesExchange:
+    """
+    Hedge-mode USDT-M futures account on `symbols` (market ids like BTCUSDT).
+
+    Market orders fill at once at mark price +- half spread and pay the taker
+    fee; a post-only limit order fills passive_fill_ratio of its quantity by
+    the time it is cancelled or fetched. Opening needs notional / leverage of
+    free margin. Every request sleeps latency (+ uniform jitter) and is
+    counted in calls / weight_used / rate_limited.
+    """
+
+    def __init__(
+        self,
+        symbols: List[str],
+        prices: Optional[Dict[str, float]] = None,
+        balance: float = 100000.0,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        weight_limit: float = BINANCE_WEIGHT_LIMIT,
+        window: float = 60.0,
+        passive_fill_ratio: float = 0.5,
+        dual_side_position: bool = True,
+        seed: int = 0,
+    ):
+        self.rng = random.Random(seed)
+        self.prices = prices or {symbol: round(self.rng.uniform(0.05, 200.0), 4) for symbol in symbols}
+        self.markets = {}
+        for symbol in symbols:
+            base = symbol[:-4]
+            # 价格越高的合约数量步长越细
+            step = 0.001 if self.prices[symbol] > 100 else (0.1 if self.prices[symbol] > 1 else 1.0)
+            self.markets[f"{base}/USDT:USDT"] = {
+                'id': symbol,
+                'symbol': f"{base}/USDT:USDT",
+                'swap': True,
+                'linear': True,
+                'precision': {'amount': step, 'price': 0.0001},
+                'limits': {'amount': {'min': step}, 'cost': {'min': 5.0}},
+            }
+        self._by_id = {m['id']: m for m in self.markets.values()}
+        self.positions: Dict[tuple, float] = {}
+        self.leverage = {symbol: 20 for symbol in symbols}
+        self.dual_side_position = dual_side_position
+        self.wallet = balance
+        self.latency = latency
+        self.jitter = jitter
+        self.weight_limit = weight_limit
+        self.window = window
+        self.passive_fill_ratio = passive_fill_ratio
+        self.orders: Dict[str, dict] = {}
+        self._next_order_id = 1
+        # 连上 MockStreamServer 后成交和持仓变化会推送出去
+        self.stream: Optional["MockStreamServer"] = None
+        self.listen_keys = set()
+
+        self.calls = Counter()
+        self.weight_used = 0.0
+        self.rate_limited = 0
+        self._weight_log = deque()
+        self.last_response_headers: Dict[str, str] = {}
+
+    # ---- 请求计数、延迟和限速 ----
+    async def _request(self, endpoint: str) -> None:
+        now = time.monotonic()
+        while self._weight_log and self._weight_log[0][0] <= now - self.window:
+            self._weight_log.popleft()
+        weight = MOCK_WEIGHTS.get(endpoint, 1)
+        self.calls[endpoint] += 1
+        if sum(w for _, w in self._weight_log) + weight > self.weight_limit:
+            self.rate_limited += 1
+            headers = self._used_weight_headers()
+            await asyncio.sleep(self.latency)
+            self._respond(429, endpoint, headers)
+            raise ccxt.RateLimitExceeded(f"binance 429 Too many requests; current limit is {self.weight_limit}")
+        self._weight_log.append((now, weight))
+        self.weight_used += weight
+        headers = self._used_weight_headers()
+        await asyncio.sleep(self.latency + self.rng.uniform(0, self.jitter))
+        self._respond(200, endpoint, headers)
+
+    def _used_weight_headers(self) -> Dict[str, str]:
+        # 和交易所一样在响应头里返回收到请求时最近一分钟用掉的 weight
+        return {'X-MBX-USED-WEIGHT-1M': str(int(sum(w for _, w in self._weight_log)))}
+
+    def _respond(self, code: int, endpoint: str, headers: Dict[str, str]) -> None:
+        # 响应和 ccxt 一样经过 on_rest_response 钩子；并发时 last_response_headers 是最后返回的那个请求的
+        self.last_response_headers = headers
+        self.on_rest_response(code, 'OK' if code == 200 else 'Too Many Requests', endpoint, 'POST', headers, '', {}, None)
+
+    def on_rest_response(self, code, reason, url, method, response_headers, response_body, request_headers, request_body):
+        return response_body
+
+    def _market_id(self, symbol: str) -> str:
+        return symbol if symbol in self._by_id else self.markets[symbol]['id']
+
+    def stats(self) -> dict:
+        return {"calls": sum(self.calls.values()), "weight": self.weight_used, "rate_limited": self.rate_limited}
+
+    # ---- 行情和账户 ----
+    async def load_markets(self, reload: bool = False):
+        await self._request("load_markets")
+        return self.markets
+
+    def market(self, symbol: str) -> dict:
+        return self._by_id[self._market_id(symbol)]
+
+    def _margin_used(self) -> float:
+        return sum(qty * self.prices[s] / self.leverage[s] for (s, _), qty in self.positions.items())
+
+    async def fetch_balance(self, params: Optional[dict] = None):
+        await self._request("fetch_balance")
+        free = self.wallet - self._margin_used()
+        return {'USDT': {'free': free, 'used': self.wallet - free, 'total': self.wallet}}
+
+    async def fetch_positions(self, symbols: Optional[List[str]] = None, params: Optional[dict] = None):
+        await self._request("fetch_positions")
+        wanted = None if symbols is None else {self._market_id(s) for s in symbols}
+        positions = []
+        for (symbol, side), qty in self.positions.items():
+            if qty <= 0 or (wanted is not None and symbol not in wanted):
+                continue
+            positions.append({
+                'symbol': self._by_id[symbol]['symbol'],
+                'contracts': qty,
+                'side': side.lower(),
+                'info': {'symbol': symbol, 'positionSide': side, 'positionAmt': str(qty if side == 'LONG' else -qty)},
+            })
+        return positions
+
+    async def fapiPublicGetPremiumIndex(self, params: Optional[dict] = None):
+        await self._request("fapiPublicGetPremiumIndex")
+        return [{'symbol': symbol, 'markPrice': str(price)} for symbol, price in self.prices.items()]
+
+    async def fetch_ticker(self, symbol: str, params: Optional[dict] = None):
+        await self._request("fetch_ticker")
+        return {'symbol': symbol, 'last': self.prices[self._market_id(symbol)]}
+
+    async def fapiPublicGetTickerBookTicker(self, params: dict):
+        await self._request("fapiPublicGetTickerBookTicker")
+        price = self.prices[params['symbol']]
+        return {'symbol': params['symbol'], 'bidPrice': str(price * (1 - HALF_SPREAD)), 'askPrice': str(price * (1 + HALF_SPREAD))}
+
+    async def fapiPrivateGetSymbolConfig(self, params: Optional[dict] = None):
+        await self._request("fapiPrivateGetSymbolConfig")
+        return [{'symbol': symbol, 'leverage': leverage, 'marginType': 'CROSSED'} for symbol, leverage in self.leverage.items()]
+
+    async def fapiPrivateGetPositionSideDual(self, params: Optional[dict] = None):
+        await self._request("fapiPrivateGetPositionSideDual")
+        return {'dualSidePosition': self.dual_side_position}
+
+    async def fapiPrivatePostPositionSideDual(self, params: dict):
+        await self._request("fapiPrivatePostPositionSideDual")
+        dual = params['dualSidePosition'] in (True, 'true')
+        if dual == self.dual_side_position:
+            raise ccxt.ExchangeError('binance {"code":-4059,"msg":"No need to change position side."}')
+        self.dual_side_position = dual
+        return {'code': 200, 'msg': 'success'}
+
+    async def set_leverage(self, leverage: int, symbol: str, params: Optional[dict] = None):
+        await self._request("set_leverage")
+        self.leverage[self._market_id(symbol)] = int(leverage)
+        return {'symbol': self._market_id(symbol), 'leverage': int(leverage)}
+
+    async def fapiPrivatePostListenKey(self, params: Optional[dict] = None):
+        await self._request("fapiPrivatePostListenKey")
+        listen_key = f"mock-listen-key-{len(self.listen_keys) + 1}"
+        self.listen_keys.add(listen_key)
+        return {'listenKey': listen_key}
+
+    async def fapiPrivatePutListenKey(self, params: Optional[dict] = None):
+        await self._request("fapiPrivatePutListenKey")
+        return {}
+
+    async def fapiPrivateDeleteListenKey(self, params: Optional[dict] = None):
+        await self._request("fapiPrivateDeleteListenKey")
+        return {}
+
+    # ---- 推送 ----
+    def _publish(self, event: dict) -> None:
+        if self.stream is not None:
+            now = int(time.time() * 1000)
+            self.stream.publish({**event, 'E': now, 'T': now})
+
+    def _publish_order(self, order: dict) -> None:
+        status = {'open': 'NEW', 'closed': 'FILLED', 'canceled': 'CANCELED'}[order['status']]
+        self._publish({'e': 'ORDER_TRADE_UPDATE', 'o': {
+            's': order['symbol'], 'c': order['clientOrderId'], 'S': order['side'].upper(), 'o': order['type'].upper(),
+            'q': str(order['amount']), 'X': status, 'x': 'NEW' if status == 'NEW' else 'TRADE',
+            'i': int(order['id']), 'z': str(order['filled']), 'ap': str(order['average'] or 0), 'ps': order['positionSide'],
+        }})
+
+    def _publish_account(self, symbol: str, position_side: str) -> None:
+        qty = self.positions.get((symbol, position_side), 0.0)
+        self._publish({'e': 'ACCOUNT_UPDATE', 'a': {
+            'm': 'ORDER',
+            'B': [{'a': 'USDT', 'wb': str(self.wallet), 'cw': str(self.wallet)}],
+            'P': [{'s': symbol, 'pa': str(qty if position_side == 'LONG' else -qty), 'ps': position_side}],
+        }})
+
+    # ---- 订单 ----
+    def _fill(self, symbol: str, side: str, position_side: str, quantity: float, price: float) -> None:
+        key = (symbol, position_side)
+        opening = (side == 'buy') == (position_side == 'LONG')
+        if opening:
+            free = self.wallet - self._margin_used()
+            if quantity * price / self.leverage[symbol] > free:
+                raise ccxt.InsufficientFunds('binance {"code":-2019,"msg":"Margin is insufficient."}')
+            self.positions[key] = self.positions.get(key, 0.0) + quantity
+        else:
+            if quantity > self.positions.get(key, 0.0) + 1e-9:
+                raise ccxt.InvalidOrder('binance {"code":-2022,"msg":"ReduceOnly Order is rejected."}')
+            self.positions[key] = round(self.positions[key] - quantity, 10)
+        self.wallet -= quantity * price * TAKER_FEE
+
+    def _new_order(self, symbol: str, type: str, side: str, amount: float, price: Optional[float], params: dict) -> dict:
+        symbol = self._market_id(symbol)
+        position_side = params.get('positionSide')
+        if not self.dual_side_position or position_side not in ('LONG', 'SHORT'):
+            raise ccxt.InvalidOrder('binance {"code":-4061,"msg":"Order\'s position side does not match user\'s setting."}')
+        order_id = str(self._next_order_id)
+        self._next_order_id += 1
+        order = {
+            'id': order_id, 'clientOrderId': params.get('newClientOrderId', f"mock-{order_id}"), 'symbol': symbol,
+            'type': type.lower(), 'side': side, 'amount': amount, 'price': price, 'positionSide': position_side,
+            'filled': 0.0, 'average': None, 'status': 'open', 'info': {'orderId': order_id},
+        }
+        if type.upper() == 'MARKET':
+            fill_price = self.prices[symbol] * (1 + HALF_SPREAD if side == 'buy' else 1 - HALF_SPREAD)
+            self._fill(symbol, side, position_side, amount, fill_price)
+            # 和交易所一样按 NEW、持仓变化、FILLED 的顺序推送
+            self._publish_order(order)
+            order.update(filled=amount, average=fill_price, status='closed')
+            self._publish_account(symbol, position_side)
+        self._publish_order(order)
+        self.orders[order_id] = order
+        return dict(order)
+
+    async def create_order(self, symbol: str, type: str, side: str, amount: float, price: Optional[float] = None, params: Optional[dict] = None):
+        await self._request("create_order")
+        return self._new_order(symbol, type, side, amount, price, params or {})
+
+    async def create_orders(self, orders: List[dict], params: Optional[dict] = None):
+        await self._request("create_orders")
+        # 和 batchOrders 一样，被拒绝的订单位置上返回 {code, msg}
+        responses = []
+        for order in orders:
+            try:
+                responses.append(self._new_order(
+                    order['symbol'], order['type'], order['side'], order['amount'], order.get('price'), order.get('params') or {}
+                ))
+            except ccxt.ExchangeError as e:
+                code, msg = str(e).split('"code":')[1].split(',"msg":')
+                responses.append({'id': None, 'info': {'code': int(code), 'msg': msg.rstrip('"}').strip('"')}})
+        return responses
+
+    def _settle_passive(self, order: dict) -> None:
+        if order['status'] != 'open':
+            return
+        filled = round(order['amount'] * self.passive_fill_ratio, 10)
+        if filled > 0:
+            self._fill(order['symbol'], order['side'], order['positionSide'], filled, order['price'])
+            order.update(filled=filled, average=order['price'])
+            self._publish_account(order['symbol'], order['positionSide'])
+        order['status'] = 'closed' if filled >= order['amount'] else 'canceled'
+        self._publish_order(order)
+
+    async def cancel_order(self, id: str, symbol: Optional[str] = None, params: Optional[dict] = None):
+        await self._request("cancel_order")
+        order = self.orders.get(id)
+        if order is None or order['status'] != 'open':
+            raise ccxt.OrderNotFound('binance {"code":-2011,"msg":"Unknown order sent."}')
+        self._settle_passive(order)
+        return dict(order)
+
+    async def fetch_order(self, id: str, symbol: Optional[str] = None, params: Optional[dict] = None):
+        await self._request("fetch_order")
+        order = self.orders[id]
+        self._settle_passive(order)
+        return dict(order)
+
+    async def close(self):
+        pass
+
+
+class MockStreamServer:
+    """
+    WebSocket server on host:port (0 picks a free port) in a background
+    thread with its own event loop, so the executor's asyncio.run loops can
+    come and go. Every connection gets its events in publish order.
+    """
+
+    def __init__(self, exchange: MockFuturesExchange, mark_interval: float = 1.0, host: str = "127.0.0.1", port: int = 0):
+        self.exchange = exchange
+        self.mark_interval = mark_interval
+        self.host = host
+        self.port = port
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queues = {}
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        exchange.stream = self
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    def start(self) -> "MockStreamServer":
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self) -> None:
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._stopping.set)
+            self._thread.join()
+        self.exchange.stream = None
+
+    def _serve(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self._main())
+        self.loop.close()
+
+    async def _main(self) -> None:
+        self._stopping = asyncio.Event()
+        app = web.Application()
+        app.router.add_get("/stream", self._handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        await self._stopping.wait()
+        await runner.cleanup()
+
+    def publish(self, event: dict) -> None:
+        """Send a user-data event to every user-data connection (thread-safe)."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._broadcast, event)
+
+    def _broadcast(self, event: dict) -> None:
+        for listen_key, queue in self._queues.values():
+            if listen_key is not None:
+                queue.put_nowait(json.dumps({'stream': listen_key, 'data': event}))
+
+    def _mark_prices(self) -> str:
+        data = [{'e': 'markPriceUpdate', 's': symbol, 'p': str(price)} for symbol, price in self.exchange.prices.items()]
+        return json.dumps({'stream': MARK_PRICE_STREAM, 'data': data})
+
+    async def _push_mark_prices(self, queue: asyncio.Queue) -> None:
+        while True:
+            queue.put_nowait(self._mark_prices())
+            await asyncio.sleep(self.mark_interval)
+
+    async def _handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        streams = request.query.get('streams', '').split('/')
+        listen_key = next((s for s in streams if s in self.exchange.listen_keys), None)
+        queue = asyncio.Queue()
+        self._queues[id(ws)] = (listen_key, queue)
+        pusher = asyncio.create_task(self._push_mark_prices(queue)) if MARK_PRICE_STREAM in streams else None
+        writer = asyncio.create_task(self._write(ws, queue))
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            self._queues.pop(id(ws), None)
+            for task in (pusher, writer):
+                if task is not None:
+                    task.cancel()
+        return ws
+
+    async def _write(self, ws, queue: asyncio.Queue) -> None:
+        while True:
+            await ws.send_str(await queue.get())
+
+
+def SyntheticRebalance(num_legs: int, seed: int = 0):
+    """
+    Daily-rotation book with num_legs legs: half of the symbols are held and
+    dropped (close legs), the other half are new targets (open legs), each
+    worth about 50 USDT. Returns (symbols, prices, current positions
+    {(symbol, side): qty}, target positions {symbol: signed qty}).
+    """
+    rng = random.Random(seed)
+    symbols = [f"MOCK{i:03d}USDT" for i in range(num_legs)]
+    prices = {symbol: round(rng.uniform(0.05, 200.0), 4) for symbol in symbols}
+    current, target = {}, {}
+    for i, symbol in enumerate(symbols):
+        quantity = round(50.0 / prices[symbol], 3 if prices[symbol] > 100 else (1 if prices[symbol] > 1 else 0))
+        side = 'LONG' if rng.random() < 0.5 else 'SHORT'
+        if i % 2:
+            current[(symbol, side)] = quantity
+        else:
+            target[symbol] = quantity if side == 'LONG' else -quantity
+    return symbols, prices, current, target
+
+
+def BenchmarkExecutor(
+    leg_counts=(50, 100, 200, 300),
+    latency: float = 0.05,
+    jitter: float = 0.02,
+    settings: Optional[Dict[str, dict]] = None,
+) -> List[dict]:
+    """
+    Run execute_trades against MockFuturesExchange on synthetic rebalances of
+    every size and setting ({name: execute_trades kwargs}); settings with
+    streaming=True also run a MockStreamServer. Returns one row per run with
+    legs, wall time, REST calls, weight and 429s.
+    """
+    from executor import BinanceFuturesExecutor
+    from executor_state import AccountConfig
+
+    settings = settings or {
+        "serial": {"max_concurrency": 1, "batch_size": 1},
+        "concurrent": {"batch_size": 1},
+        "concurrent+batch": {},
+        "concurrent+batch+stream": {"streaming": True},
+    }
+    rows = []
+    for num_legs in leg_counts:
+        for name, kwargs in settings.items():
+            symbols, prices, current, target = SyntheticRebalance(num_legs)
+            mock = MockFuturesExchange(symbols, prices=prices, latency=latency, jitter=jitter)
+            mock.positions = dict(current)
+
+            executor = BinanceFuturesExecutor("mock-key", "mock-secret", is_test=True)
+            executor.create_async_exchange = lambda: mock
+            server = MockStreamServer(mock).start() if kwargs.get("streaming") else None
+            if server is not None:
+                executor.stream_url = server.url
+            with tempfile.TemporaryDirectory() as config_dir:
+                executor.config = AccountConfig("mock-key", config_dir=config_dir)
+                start = time.perf_counter()
+                results = executor.execute_trades(target, journal_dir=config_dir, metrics_dir=config_dir, **kwargs)
+                wall_time = time.perf_counter() - start
+            if server is not None:
+                server.stop()
+
+            rows.append({
+                "legs": len(results),
+                "setting": name,
+                "wall_time": round(wall_time, 3),
+                "submitted": sum(r['status'] == 'submitted' for r in results),
+                **mock.stats(),
+            })
+            logger.info(rows[-1])
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='用本地模拟交易所测试执行器的耗时、请求数和 weight')
+    parser.add_argument('--legs', type=int, nargs='+', default=[50, 100, 200, 300], help='每次调仓的订单数')
+    parser.add_argument('--latency', type=float, default=0.05, help='每个请求的延迟(秒)')
+    parser.add_argument('--jitter', type=float, default=0.02, help='延迟的随机抖动(秒)')
+    args = parser.parse_args()
+
+    # 执行器每个订单都打 INFO 日志，测速时关掉
+    logging.disable(logging.INFO)
+    rows = BenchmarkExecutor(args.legs, latency=args.latency, jitter=args.jitter)
+    columns = list(rows[0])
+    print("\t".join(columns))
+    for row in rows:
+        print("\t".join(str(row[c]) for c in columns))
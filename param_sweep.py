@@ -0,0 +1,227 @@
+"""
+Parallel parameter sweep for the rolling backtest.
+
+The pivoted panels are built once, saved as .npy and memory-mapped read-only
+by every worker process; each configuration only sets the backtest module
+parameters, slices the panels and runs the tranche simulation. Finished
+configurations are written to a parquet results table and skipped on the
+next run, so a large grid can be interrupted and resumed.
+"""
+import hashlib
+import itertools
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import numpy as np
+import polars as pl
+
+import backtest
+
+logger = logging.getLogger("ParamSweep")
+
+SWEEP_RESULTS_PATH = "data/sweep_results.parquet"
+SWEEP_PANEL_DIR = "data/sweep_panels"
+
+# 回测函数参数
+BACKTEST_PARAMS = ["group_num", "long_factor_combination_list", "trade_with_rank", "update_position_time"]
+# backtest 模块里的全局参数，notebook 里通过 backtest.X = ... 修改的那些
+MODULE_PARAMS = ["VOL_FILTER_RATIO", "LONG_TRADE_RANK_RATIO", "SHORT_TRADE_RANK_RATIO"]
+# 从哪个星期几开始第一次开仓，0=周一 ... 6=周日，None 表示不过滤
+WEEKDAY_PARAM = "open_weekday"
+
+DEFAULT_CONFIG = {
+    "group_num": 10,
+    "long_factor_combination_list": [9],
+    "trade_with_rank": -20,
+    "update_position_time": 5,
+    "VOL_FILTER_RATIO": backtest.VOL_FILTER_RATIO,
+    "LONG_TRADE_RANK_RATIO": backtest.LONG_TRADE_RANK_RATIO,
+    "SHORT_TRADE_RANK_RATIO": backtest.SHORT_TRADE_RANK_RATIO,
+    WEEKDAY_PARAM: None,
+}
+
+# worker 进程里只读的 panels
+_PANELS: Optional[Dict[str, np.ndarray]] = None
+
+
+def ExpandGrid(grid: Dict[str, list]) -> List[dict]:
+    """Cartesian product of the grid; parameters not in the grid keep DEFAULT_CONFIG."""
+    unknown = [name for name in grid if name not in DEFAULT_CONFIG]
+    assert not unknown, f"unknown sweep params: {unknown}"
+    names = list(grid)
+    return [{**DEFAULT_CONFIG, **dict(zip(names, values))} for values in itertools.product(*grid.values())]
+
+
+def ConfigKey(config: dict, data_key: str) -> str:
+    payload = json.dumps({"config": config, "data": data_key}, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _DataKey(result_hour: pl.DataFrame) -> str:
+    # predictions 内容变了，缓存的 panels 和结果都要作废
+    row_hash = int(result_hour.hash_rows(seed=0).sum())
+    return hashlib.sha1(f"{result_hour.shape}{result_hour.columns}{row_hash}".encode("utf-8")).hexdigest()[:16]
+
+
+def _SavePanels(result_hour: pl.DataFrame, value_columns: List[str], panel_dir: str) -> None:
+    # 同一份数据后来的扫描可能用到新的持仓周期，只补上缺少的列
+    names = ["symbols", "close_time", "open_time"] + value_columns
+    missing = [name for name in names if not os.path.exists(os.path.join(panel_dir, f"{name}.npy"))]
+    if not missing:
+        return
+    os.makedirs(panel_dir, exist_ok=True)
+    panels = backtest.BuildBacktestPanels(result_hour, [name for name in value_columns if name in missing])
+    for name, panel in panels.items():
+        path = os.path.join(panel_dir, f"{name}.npy")
+        if os.path.exists(path):
+            continue
+        # 每个文件先写临时文件再rename，中途被打断也不会留下半个 panel
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, panel)
+        os.replace(path + ".tmp", path)
+
+
+def _LoadPanels(panel_dir: str) -> None:
+    global _PANELS
+    _PANELS = {
+        file_name[:-4]: np.load(os.path.join(panel_dir, file_name), mmap_mode="r")
+        for file_name in os.listdir(panel_dir)
+        if file_name.endswith(".npy")
+    }
+
+
+def _SliceFromWeekday(panels: Dict[str, np.ndarray], weekday: Optional[int]) -> Dict[str, np.ndarray]:
+    # 等价于 notebook 里 result_hour.filter(open_time >= 第一个周X)
+    if weekday is None:
+        return panels
+    open_days = panels["open_time"].astype("datetime64[D]").astype(np.int64)
+    # 1970-01-01 是周四
+    on_weekday = (open_days + 3) % 7 == weekday
+    # argmax 在没有匹配时返回0，会悄悄跑全部数据
+    assert on_weekday.any(), f"没有开盘时间在星期 {weekday} 的k线"
+    open_start = int(np.argmax(on_weekday))
+    close_start = int(np.searchsorted(panels["close_time"], panels["open_time"][open_start]))
+    sliced = {}
+    for name, panel in panels.items():
+        if name == "symbols":
+            sliced[name] = panel
+        elif name in ["open", "open_time"]:
+            sliced[name] = panel[open_start:]
+        else:
+            sliced[name] = panel[close_start:]
+    return sliced
+
+
+def _RunConfig(config: dict, compound_column_name: str) -> dict:
+    for name in MODULE_PARAMS:
+        setattr(backtest, name, config[name])
+
+    update_position_time = config["update_position_time"]
+    try:
+        panels = _SliceFromWeekday(_PANELS, config[WEEKDAY_PARAM])
+        _, sum_pnl = backtest.RunTranchePnL(
+            panels,
+            compound_column_name + f"_{update_position_time}day",
+            config["group_num"],
+            config["long_factor_combination_list"],
+            update_position_time,
+            config["trade_with_rank"],
+        )
+        return {"metrics": backtest.AnalysePnLTrace(sum_pnl), "error": None, "error_type": None}
+    except Exception as e:
+        # 一组参数出错不影响其他组，错误记在这一组的结果里
+        return {"metrics": None, "error": str(e), "error_type": type(e).__name__}
+
+
+def _ResultRow(config_key: str, data_key: str, config: dict, result: dict) -> dict:
+    row = {
+        "config_key": config_key,
+        "data_key": data_key,
+        **config,
+        "error": result["error"],
+        "error_type": result["error_type"],
+    }
+    for name, value in (result["metrics"] or {}).items():
+        row[name] = float(value)
+    return row
+
+
+def _WriteResults(rows: List[dict], results_path: str) -> pl.DataFrame:
+    results = pl.DataFrame(rows, infer_schema_length=None)
+    os.makedirs(os.path.dirname(results_path) or ".", exist_ok=True)
+    # 先写临时文件再rename，避免中途被打断留下半个文件
+    results.write_parquet(results_path + ".tmp")
+    os.replace(results_path + ".tmp", results_path)
+    return results
+
+
+def RunSweep(
+    result_hour: pl.DataFrame,
+    configs: List[dict],
+    compound_column_name: str = "linear_compound_factor",
+    results_path: str = SWEEP_RESULTS_PATH,
+    panel_dir: str = SWEEP_PANEL_DIR,
+    max_workers: Optional[int] = None,
+    flush_every: int = 20,
+) -> pl.DataFrame:
+    """
+    Run the rolling backtest for every config on a process pool.
+
+    configs come from ExpandGrid (or are hand written with the DEFAULT_CONFIG
+    keys). Results already in results_path for the same config and the same
+    result_hour are reused; new ones are flushed to the table every
+    flush_every finished configs. A config that raises gets its error and
+    error_type in its row; only invalid combinations (AssertionError) are
+    kept as done, other failures are rerun next time. The table also keeps
+    the rows of other configs and other result_hour data (tagged by
+    data_key); the returned frame has only the rows of these configs on this
+    result_hour, one per config with its parameters and AnalysePnLTrace
+    metrics.
+    """
+    data_key = _DataKey(result_hour)
+    configs = [{**DEFAULT_CONFIG, **config} for config in configs]
+    keyed = {ConfigKey(config, data_key): config for config in configs}
+
+    rows = pl.read_parquet(results_path).to_dicts() if os.path.exists(results_path) else []
+    # 参数组合本身不合法（比如多空数目超过symbol总数）的不再重跑，其他错误下次重跑
+    rows = [row for row in rows if row["error"] is None or row.get("error_type") in (None, "AssertionError")]
+    # 表里还有其他参数和其他 predictions 的结果，只留在文件里，不返回
+    done = {row["config_key"] for row in rows if row["config_key"] in keyed}
+    todo = {key: config for key, config in keyed.items() if key not in done}
+    logger.info(f"共 {len(keyed)} 组参数，已完成 {len(keyed) - len(todo)}，待运行 {len(todo)}")
+    if not todo:
+        return pl.DataFrame([row for row in rows if row["config_key"] in keyed], infer_schema_length=None)
+
+    update_position_times = sorted({config["update_position_time"] for config in configs})
+    value_columns = ["open", "volume"]
+    for update_position_time in update_position_times:
+        value_columns += [
+            compound_column_name + f"_{update_position_time}day",
+            f"long_value_scale_{update_position_time}day",
+        ]
+    panel_dir = os.path.join(panel_dir, data_key)
+    _SavePanels(result_hour, value_columns, panel_dir)
+
+    finished = 0
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_LoadPanels, initargs=(panel_dir,)) as pool:
+        futures = {pool.submit(_RunConfig, config, compound_column_name): key for key, config in todo.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # worker 进程本身挂了（比如内存不够被杀）
+                result = {"metrics": None, "error": str(e), "error_type": type(e).__name__}
+            if result["error"] is not None:
+                logger.warning(f"{keyed[key]} 运行失败: {result['error']}")
+            rows.append(_ResultRow(key, data_key, keyed[key], result))
+            finished += 1
+            if finished % flush_every == 0:
+                _WriteResults(rows, results_path)
+                logger.info(f"已完成 {finished}/{len(todo)}")
+
+    results = _WriteResults(rows, results_path)
+    return results.filter(pl.col("config_key").is_in(list(keyed)))
@@ -0,0 +1,131 @@
+"""
+Long-short portfolio construction on (time x symbol) panels.
+
+Every function takes a factor panel and a boolean tradability mask of the
+same shape and returns a target-weight panel: long weights sum to +1 and
+short weights to -1 on each row that trades, rows without a portfolio are
+all zero. The backtest and the live signal both size positions from these
+weights.
+"""
+from typing import List, Tuple
+
+import numpy as np
+
+
+def RankWithinRows(factor_panel: np.ndarray, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Ascending position of each tradable symbol within its row, and the number
+    of tradable symbols per row. Ties keep the column order; untradable cells
+    get positions >= the row count and must be masked out by the caller.
+    """
+    # 不可交易放在最后，作为第一排序键；用 +inf 占位的话，因子值为 +inf 的可交易 symbol 会和它们并列
+    order = np.lexsort((factor_panel, ~mask), axis=1)
+    positions = np.empty_like(order)
+    np.put_along_axis(positions, order, np.arange(factor_panel.shape[1])[None, :], axis=1)
+    return positions, mask.sum(axis=1)
+
+
+def _EqualWeights(long_mask: np.ndarray, short_mask: np.ndarray) -> np.ndarray:
+    long_num = long_mask.sum(axis=1, keepdims=True)
+    short_num = short_mask.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore"):
+        long_weight = np.where(long_num > 0, 1.0 / long_num, 0.0)
+        short_weight = np.where(short_num > 0, -(1.0 / short_num), 0.0)
+    return np.where(long_mask, long_weight, 0.0) + np.where(short_mask, short_weight, 0.0)
+
+
+def GroupWeights(
+    factor_panel: np.ndarray,
+    mask: np.ndarray,
+    group_num: int,
+    long_factor_combination_list: List[int],
+) -> np.ndarray:
+    """
+    Sort each row by factor into group_num groups; long the groups in
+    long_factor_combination_list, short the mirrored groups. Rows with fewer
+    tradable symbols than groups do not trade.
+    """
+    positions, tradable_num = RankWithinRows(factor_panel, mask)
+    group_size = np.maximum((tradable_num / group_num).astype(np.int64), 1)  # 避免除以零
+    group = positions // group_size[:, None]
+
+    short_combination_list = [group_num - 1 - x for x in long_factor_combination_list]
+    enough = (tradable_num >= group_num)[:, None]
+    long_mask = mask & enough & np.isin(group, long_factor_combination_list)
+    short_mask = mask & enough & np.isin(group, short_combination_list)
+    return _EqualWeights(long_mask, short_mask)
+
+
+def RankWeights(
+    factor_panel: np.ndarray,
+    mask: np.ndarray,
+    trade_with_rank: int,
+    long_rank_ratio: float = 1.0,
+    short_rank_ratio: float = 0.5,
+) -> np.ndarray:
+    """
+    Trade by rank instead of groups: with trade_with_rank > 0 long the
+    lowest |trade_with_rank| * long_rank_ratio symbols and short the highest
+    |trade_with_rank| * short_rank_ratio; a negative value flips the sides.
+    """
+    assert trade_with_rank != 0, "trade_with_rank = 0 means group trading"
+    positions, tradable_num = RankWithinRows(factor_panel, mask)
+
+    # 有可能 2 * trade_with_rank 的绝对值大于可交易的symbol数目
+    cur_trade_num = np.minimum(abs(trade_with_rank), tradable_num / 2)
+    active = tradable_num > 0
+    assert np.all(
+        (long_rank_ratio + short_rank_ratio) * cur_trade_num[active] <= tradable_num[active]
+    ), "total of long & short should not exceed total symbol number"
+
+    rank = positions if trade_with_rank > 0 else tradable_num[:, None] - 1 - positions
+    long_mask = mask & (rank < (cur_trade_num * long_rank_ratio)[:, None])
+    short_mask = mask & (rank > (tradable_num - 1 - cur_trade_num * short_rank_ratio)[:, None])
+    return _EqualWeights(long_mask, short_mask)
+
+
+def ProportionalWeights(factor_panel: np.ndarray, mask: np.ndarray, factor_sign: int = 1) -> np.ndarray:
+    """
+    Weights proportional to the cross-sectionally demeaned factor (times
+    factor_sign): symbols above the row mean are long, below are short.
+    """
+    factor = np.where(mask, factor_sign * factor_panel, np.nan)
+    with np.errstate(invalid="ignore"):
+        demeaned = factor - np.nanmean(factor, axis=1, keepdims=True)
+    demeaned = np.nan_to_num(demeaned, nan=0.0)
+
+    long_part = np.clip(demeaned, 0.0, None)
+    short_part = np.clip(demeaned, None, 0.0)
+    long_sum = long_part.sum(axis=1, keepdims=True)
+    short_sum = -short_part.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weights = np.where(long_sum > 0, long_part / long_sum, 0.0) + np.where(short_sum > 0, short_part / short_sum, 0.0)
+    return weights
+
+
+def BuildTargetWeights(
+    factor_panel: np.ndarray,
+    mask: np.ndarray,
+    method: str = "group",
+    group_num: int = 10,
+    long_factor_combination_list: List[int] = [9],
+    trade_with_rank: int = 0,
+    long_rank_ratio: float = 1.0,
+    short_rank_ratio: float = 0.5,
+    factor_sign: int = 1,
+) -> np.ndarray:
+    """
+    Target-weight panel for the whole factor panel in one call.
+
+    method: 'group' (GroupWeights), 'rank' (RankWeights) or 'proportional'
+    (ProportionalWeights). NaN factor values are never tradable, whatever
+    the mask says.
+    """
+    mask = mask & ~np.isnan(factor_panel)
+    if method == "group":
+        return GroupWeights(factor_panel, mask, group_num, long_factor_combination_list)
+    if method == "rank":
+        return RankWeights(factor_panel, mask, trade_with_rank, long_rank_ratio, short_rank_ratio)
+    if method == "proportional":
+        return ProportionalWeights(factor_panel, mask, factor_sign)
+    raise ValueError(f"unknown portfolio method: {method}")
@@ -0,0 +1,141 @@
+"""
+Vectorized rebalance planner for the hedge-mode futures book.
+
+Current LONG / SHORT quantities and signed target quantities of all symbols
+are aligned into arrays and every order quantity is computed in one pass:
+targets are rounded down to each symbol's step size, an order that opens or
+adds below the exchange minimum is raised to it in closed form, and changes
+smaller than a notional / turnover band are skipped. Every leg carries its
+expected cost, so a plan can be built and benchmarked offline (dry run)
+without an exchange.
+
+Only numpy is used, the executor environment has no polars.
+"""
+import math
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# 和 cost_model 的默认值一致：taker 手续费 5bp + 半个买卖价差 1bp
+DEFAULT_COST_RATE = 6 / 10000.0
+# binance U本位合约大多数交易对的最小名义价值（USDT）
+DEFAULT_MIN_NOTIONAL = 5.0
+POSITION_SIDES = ("LONG", "SHORT")
+# 减少仓位的动作，先于开仓/加仓执行以释放保证金
+REDUCING_ACTIONS = ("close", "reduce")
+
+
+def MarketArrays(markets: Dict[str, dict], symbols: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (step size, min quantity, min notional) of every symbol from ccxt markets
+    keyed by market id. binance markets use ccxt's TICK_SIZE precision mode,
+    so precision['amount'] is the step itself. Unknown symbols get step 1.
+    """
+    step = np.ones(len(symbols))
+    min_qty = np.zeros(len(symbols))
+    min_notional = np.full(len(symbols), DEFAULT_MIN_NOTIONAL)
+    for i, symbol in enumerate(symbols):
+        market = markets.get(symbol)
+        if market is None:
+            continue
+        limits = market.get('limits') or {}
+        step[i] = (market.get('precision') or {}).get('amount') or 1.0
+        min_qty[i] = (limits.get('amount') or {}).get('min') or 0.0
+        min_notional[i] = (limits.get('cost') or {}).get('min') or DEFAULT_MIN_NOTIONAL
+    return step, min_qty, min_notional
+
+
+def _StepDecimals(step: np.ndarray) -> int:
+    # 最小步长的小数位数，用来去掉 0.1 + 0.2 这类浮点尾巴
+    return max([0] + [-math.floor(math.log10(s)) for s in np.unique(step)])
+
+
+def _RoundToStep(quantity: np.ndarray, step: np.ndarray) -> np.ndarray:
+    # 按步长向下取整
+    return np.round(np.floor(quantity / step + 1e-9) * step, _StepDecimals(step))
+
+
+def PlanRebalance(
+    symbols: Sequence[str],
+    current_long: np.ndarray,
+    current_short: np.ndarray,
+    target: np.ndarray,
+    prices: np.ndarray,
+    step: np.ndarray,
+    min_qty: np.ndarray,
+    min_notional: np.ndarray,
+    notional_band: float = DEFAULT_MIN_NOTIONAL,
+    turnover_band: float = 0.0,
+    cost_rate: float = DEFAULT_COST_RATE,
+) -> List[dict]:
+    """
+    Orders that move the hedge-mode book (current_long, current_short >= 0)
+    to the signed target quantities, all arrays aligned with symbols.
+
+    A side whose target is zero is closed in full (action "close"), a side
+    with no position is opened at the rounded target ("open", raised to min
+    quantity / min notional). Other changes ("increase" / "reduce") are
+    skipped when their notional is below max(notional_band, turnover_band *
+    side value); an increase below the exchange minimum is raised to it, a
+    reduce below it is skipped. Symbols without a price are only closed.
+
+    Returns one dict per leg: symbol, side, quantity, positionSide, action,
+    price, notional, expected_cost (notional * cost_rate).
+    """
+    symbols = np.asarray(symbols)
+    prices = np.asarray(prices, dtype=np.float64)
+    current = np.stack([np.asarray(current_long, dtype=np.float64), np.asarray(current_short, dtype=np.float64)])
+    target = np.asarray(target, dtype=np.float64)
+    target_side = _RoundToStep(np.stack([np.maximum(target, 0.0), np.maximum(-target, 0.0)]), step)
+
+    closing = (target_side == 0) & (current > 0)
+    opening = (current == 0) & (target_side > 0)
+    delta = np.where(closing, -current, np.round(target_side - current, _StepDecimals(step)))
+    priced = np.isfinite(prices) & (prices > 0)
+
+    with np.errstate(invalid="ignore"):
+        # 小于 band 的调整不做；整个方向的开仓和平仓不受 band 限制
+        band = np.maximum(notional_band, turnover_band * np.maximum(target_side, current) * prices)
+        in_band = np.abs(delta) * prices < band
+        # 开仓和加仓不足交易所最小值时，直接算出满足最小数量和最小名义价值的数量；减仓不足最小值的跳过
+        floor_qty = _RoundToStep(np.maximum(min_qty, np.ceil(min_notional / prices / step - 1e-9) * step), step)
+        increase = delta > 0
+        below_minimum = (np.abs(delta) * prices < min_notional) | (np.abs(delta) < min_qty)
+        delta = np.where(increase & below_minimum, np.maximum(delta, floor_qty), delta)
+        notional = np.abs(delta) * prices
+        adjust = (delta != 0) & ~in_band & (increase | ~below_minimum)
+        trade = closing | (priced & (opening | adjust))
+
+    plan = []
+    for k, i in zip(*np.nonzero(trade)):
+        position_side = POSITION_SIDES[k]
+        if closing[k, i]:
+            action = "close"
+        elif opening[k, i]:
+            action = "open"
+        else:
+            action = "increase" if delta[k, i] > 0 else "reduce"
+        # 多仓 buy 加仓 sell 减仓，空仓反过来
+        buy = (delta[k, i] > 0) == (position_side == "LONG")
+        leg_notional = float(notional[k, i]) if priced[i] else float("nan")
+        plan.append({
+            'symbol': str(symbols[i]),
+            'side': 'buy' if buy else 'sell',
+            'quantity': float(abs(delta[k, i])),
+            'positionSide': position_side,
+            'action': action,
+            'price': float(prices[i]),
+            'notional': leg_notional,
+            'expected_cost': leg_notional * cost_rate,
+        })
+    return plan
+
+
+def SummarizePlan(plan: List[dict]) -> Dict[str, float]:
+    """Leg count per action, traded notional and expected cost of a plan."""
+    summary: Dict[str, float] = {"legs": len(plan)}
+    for leg in plan:
+        summary[leg['action']] = summary.get(leg['action'], 0) + 1
+    summary["notional"] = float(np.nansum([leg['notional'] for leg in plan]))
+    summary["expected_cost"] = float(np.nansum([leg['expected_cost'] for leg in plan]))
+    return summary
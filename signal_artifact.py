@@ -0,0 +1,120 @@
+"""
+Target-positions artifact passed from daily_pipeline to executor.
+
+Each signal is one versioned JSON file with the strategy id, as_of date,
+the signed target quantity / reference price (and optionally the recent
+daily quote volume, used to slice large orders) of every symbol and a
+sha256 checksum of the positions. Files are written atomically and an index
+(latest.json) points to the newest file of each strategy, so the executor
+reads exactly two small files instead of scanning and regex-parsing the
+trading_signals logs (which are still written for humans).
+
+Only the standard library is used, the executor environment has no polars.
+"""
+import hashlib
+import json
+import os
+from datetime import date, datetime, timezone
+from typing import Dict, Optional, Tuple
+
+SCHEMA_VERSION = 1
+SIGNAL_ARTIFACT_DIR = "trading_signals"
+INDEX_FILE = "latest.json"
+DEFAULT_STRATEGY_ID = "linear_compound_factor"
+
+
+def _Checksum(positions: list) -> str:
+    payload = json.dumps(positions, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _WriteJsonAtomic(path: str, obj: dict) -> None:
+    # 先写临时文件再rename，执行器不会读到写了一半的文件
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def WriteTargetPositions(
+    as_of: date,
+    long_positions: Dict[str, float],
+    short_positions: Dict[str, float],
+    prices: Dict[str, float],
+    strategy_id: str = DEFAULT_STRATEGY_ID,
+    artifact_dir: str = SIGNAL_ARTIFACT_DIR,
+    quote_volumes: Optional[Dict[str, float]] = None,
+) -> str:
+    """
+    Write the target positions of one signal date and point the index at it.
+
+    Short quantities are stored negative, whatever sign the caller used.
+    With quote_volumes every position also carries "quote_volume" (null for
+    symbols without one). Returns the artifact path.
+    """
+    positions = [
+        {"symbol": symbol, "quantity": abs(float(size)), "price": float(prices[symbol])}
+        for symbol, size in sorted(long_positions.items())
+    ] + [
+        {"symbol": symbol, "quantity": -abs(float(size)), "price": float(prices[symbol])}
+        for symbol, size in sorted(short_positions.items())
+    ]
+    if quote_volumes is not None:
+        for position in positions:
+            volume = quote_volumes.get(position["symbol"])
+            position["quote_volume"] = None if volume is None else float(volume)
+    checksum = _Checksum(positions)
+    artifact = {
+        "schema_version": SCHEMA_VERSION,
+        "strategy_id": strategy_id,
+        "as_of": as_of.strftime("%Y-%m-%d"),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "positions": positions,
+        "checksum": checksum,
+    }
+
+    os.makedirs(artifact_dir, exist_ok=True)
+    file_name = f"target_positions_{strategy_id}_{as_of.strftime('%Y%m%d')}_{checksum[:8]}.json"
+    _WriteJsonAtomic(os.path.join(artifact_dir, file_name), artifact)
+
+    index_path = os.path.join(artifact_dir, INDEX_FILE)
+    index = {"schema_version": SCHEMA_VERSION, "strategies": {}}
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    index["strategies"][strategy_id] = {"file": file_name, "as_of": artifact["as_of"], "checksum": checksum}
+    _WriteJsonAtomic(index_path, index)
+    return os.path.join(artifact_dir, file_name)
+
+
+def _ReadArtifact(strategy_id: str, artifact_dir: str) -> dict:
+    with open(os.path.join(artifact_dir, INDEX_FILE), "r", encoding="utf-8") as f:
+        entry = json.load(f)["strategies"].get(strategy_id)
+    if entry is None:
+        raise FileNotFoundError(f"{artifact_dir} 中没有策略 {strategy_id} 的交易信号")
+
+    with open(os.path.join(artifact_dir, entry["file"]), "r", encoding="utf-8") as f:
+        artifact = json.load(f)
+    if artifact.get("schema_version") != SCHEMA_VERSION:
+        raise ValueError(f"{entry['file']} schema_version {artifact.get('schema_version')} != {SCHEMA_VERSION}")
+    if _Checksum(artifact["positions"]) != artifact["checksum"] or artifact["checksum"] != entry["checksum"]:
+        raise ValueError(f"{entry['file']} checksum 校验失败")
+    return artifact
+
+
+def ReadTargetPositions(
+    strategy_id: str = DEFAULT_STRATEGY_ID, artifact_dir: str = SIGNAL_ARTIFACT_DIR
+) -> Tuple[Dict[str, float], str]:
+    """
+    Latest target positions of a strategy as ({symbol: signed quantity}, as_of).
+
+    Raises FileNotFoundError when there is no signal yet and ValueError when
+    the artifact has another schema version or fails its checksum.
+    """
+    artifact = _ReadArtifact(strategy_id, artifact_dir)
+    return {p["symbol"]: p["quantity"] for p in artifact["positions"]}, artifact["as_of"]
+
+
+def ReadQuoteVolumes(strategy_id: str = DEFAULT_STRATEGY_ID, artifact_dir: str = SIGNAL_ARTIFACT_DIR) -> Dict[str, float]:
+    """{symbol: recent daily quote volume} stored with the latest signal; empty for older artifacts."""
+    artifact = _ReadArtifact(strategy_id, artifact_dir)
+    return {p["symbol"]: p["quote_volume"] for p in artifact["positions"] if p.get("quote_volume") is not None}
@@ -0,0 +1,140 @@
+"""
+Universe selection: boolean (time x symbol) tradability masks for a whole
+panel, computed in one vectorized pass per filter.
+
+The panels are the ones from backtest.BuildBacktestPanels (rows = bars,
+columns = symbols). The backtest and the parameter sweep consume the mask
+directly.
+"""
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+# 最近用过的mask，参数扫描里同一份数据、同一组过滤参数会反复用到
+_MASK_CACHE: "OrderedDict[str, np.ndarray]" = OrderedDict()
+MASK_CACHE_SIZE = 32
+
+
+def CrossSectionalPercentile(values: np.ndarray, valid: np.ndarray, q: float) -> np.ndarray:
+    """
+    Per-row np.percentile(values[i, valid[i]], q); NaN for rows with no valid cell.
+
+    Rows with the same number of valid cells are evaluated together in one
+    np.percentile call on the row-sorted values, so the result is exactly
+    the row-by-row one.
+    """
+    sorted_values = np.sort(np.where(valid, values, np.nan), axis=1)  # NaN排在最后
+    counts = valid.sum(axis=1)
+    result = np.full(len(values), np.nan)
+    for n in np.unique(counts[counts > 0]):
+        rows = np.flatnonzero(counts == n)
+        result[rows] = np.percentile(sorted_values[rows, :n], q, axis=1)
+    return result
+
+
+def RollingMean(panel: np.ndarray, window: int) -> np.ndarray:
+    """Trailing mean over `window` rows per column; NaN until the window is full or if it has a NaN."""
+    if window <= 1:
+        return panel
+    filled = np.nan_to_num(panel, nan=0.0)
+    csum = np.cumsum(filled, axis=0)
+    cnt = np.cumsum(~np.isnan(panel), axis=0)
+    window_sum = csum.copy()
+    window_cnt = cnt.copy()
+    window_sum[window:] -= csum[:-window]
+    window_cnt[window:] -= cnt[:-window]
+    return np.where(window_cnt == window, window_sum / window, np.nan)
+
+
+def ListingAgeMask(panel: np.ndarray, min_listing_bars: int) -> np.ndarray:
+    """True where the symbol has at least min_listing_bars bars since its first valid bar in the panel."""
+    has_data = ~np.isnan(panel)
+    first_row = np.where(has_data.any(axis=0), np.argmax(has_data, axis=0), len(panel))
+    age = np.arange(len(panel))[:, None] - first_row[None, :]
+    return age >= min_listing_bars
+
+
+def ExchangeStatusMask(symbols: Sequence[str], exchange_status: Dict[str, str], shape) -> np.ndarray:
+    # exchange_status 来自 exchangeInfo 的 status 字段，只有 TRADING 的合约可以交易
+    tradable = np.array([exchange_status.get(symbol) == "TRADING" for symbol in symbols])
+    return np.broadcast_to(tradable[None, :], shape)
+
+
+def _CacheKey(arrays: Sequence[Optional[np.ndarray]], params: dict) -> str:
+    digest = hashlib.sha1(repr(sorted(params.items())).encode("utf-8"))
+    for array in arrays:
+        if array is not None:
+            digest.update(str(array.shape).encode("utf-8"))
+            digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def TradableMask(
+    volume: np.ndarray,
+    valid: Optional[np.ndarray] = None,
+    vol_filter_ratio: float = 30,
+    volume_window: int = 1,
+    close: Optional[np.ndarray] = None,
+    min_price: Optional[float] = None,
+    min_listing_bars: int = 0,
+    quote_volume: Optional[np.ndarray] = None,
+    min_adv: Optional[float] = None,
+    adv_window: int = 30,
+    symbols: Optional[Sequence[str]] = None,
+    exchange_status: Optional[Dict[str, str]] = None,
+) -> np.ndarray:
+    """
+    Boolean (time x symbol) tradability mask.
+
+    A cell is tradable when it is `valid` (e.g. the factor is not NaN), passes
+    the optional listing-age / min-price / ADV (rolling mean quote volume) /
+    exchange-status filters, and its (rolling mean over volume_window bars)
+    volume is above the vol_filter_ratio percentile of the cells that passed
+    everything else in that row. With the defaults this is the backtest's
+    VOL_FILTER_RATIO rule. Results are cached on the input contents.
+    """
+    params = {
+        "vol_filter_ratio": vol_filter_ratio,
+        "volume_window": volume_window,
+        "min_price": min_price,
+        "min_listing_bars": min_listing_bars,
+        "min_adv": min_adv,
+        "adv_window": adv_window,
+        "exchange_status": sorted((exchange_status or {}).items()),
+        "symbols": list(symbols) if symbols is not None else None,
+    }
+    key = _CacheKey([volume, valid, close, quote_volume], params)
+    if key in _MASK_CACHE:
+        _MASK_CACHE.move_to_end(key)
+        return _MASK_CACHE[key]
+
+    volume = RollingMean(volume, volume_window)
+    eligible = ~np.isnan(volume)
+    if valid is not None:
+        eligible &= valid
+    if min_listing_bars > 0:
+        eligible &= ListingAgeMask(close if close is not None else volume, min_listing_bars)
+    if min_price is not None:
+        assert close is not None, "min_price needs the close panel"
+        with np.errstate(invalid="ignore"):
+            eligible &= close >= min_price
+    if min_adv is not None:
+        assert quote_volume is not None, "min_adv needs the quote_volume panel"
+        with np.errstate(invalid="ignore"):
+            eligible &= RollingMean(quote_volume, adv_window) >= min_adv
+    if exchange_status is not None:
+        assert symbols is not None, "exchange_status needs the symbol list"
+        eligible &= ExchangeStatusMask(symbols, exchange_status, eligible.shape)
+
+    # try to avoid trade the last xx% volume symbol ============
+    vol_threshold = CrossSectionalPercentile(volume, eligible, vol_filter_ratio)
+    with np.errstate(invalid="ignore"):
+        mask = eligible & (volume > vol_threshold[:, None])
+
+    mask.flags.writeable = False  # 缓存里的mask是共享的
+    _MASK_CACHE[key] = mask
+    if len(_MASK_CACHE) > MASK_CACHE_SIZE:
+        _MASK_CACHE.popitem(last=False)
+    return mask